@@ -56,6 +56,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.replicas.ReplicaMiddleware',
+    # Last, so only the queries run by the view are counted
+    'store.queries.QueryInspectorMiddleware',
 ]
 
 ROOT_URLCONF = 'django_widget_factory_store.urls'
@@ -86,7 +89,90 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Keep connections between requests, see store/db_profile.py
+        'CONN_MAX_AGE': 60,
+        'TEST': {
+            # File backed, so concurrent tests lock the way production does
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    },
+    # Local read replica, a copy of the primary refreshed by
+    # `manage.py sync_replicas`. Serves reads once listed in
+    # STORE_READ_REPLICAS.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+# Writes go to the primary, catalog reads to the replicas, see
+# store/replicas.py
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+
+# Settings applied to every new connection, per database vendor, see
+# store/db_profile.py. SQLite settings are PRAGMAs; PostgreSQL settings are
+# set for the session.
+STORE_DB_PROFILES = {
+    'sqlite': {
+        # Milliseconds a writer waits for the lock before failing
+        'busy_timeout': 5000,
+        # Page cache per connection, negative sizes are in KiB
+        'cache_size': -20000,
+        # Bytes of the database file read through memory mapping
+        'mmap_size': 268435456,
+        'temp_store': 'memory',
+        # Deployments opt in to WAL journaling: readers don't block the
+        # writer, nor the writer the readers. The journal mode is written
+        # to the database file, so it stays off the development and test
+        # databases.
+        # 'journal_mode': 'wal',
+        # With WAL, durable up to the last checkpoint; a power loss may lose
+        # the latest commits, never corrupt the database
+        # 'synchronous': 'normal',
+    },
+    'postgresql': {
+        'statement_timeout': '30s',
+        'lock_timeout': '5s',
+        'idle_in_transaction_session_timeout': '60s',
+    },
+}
+
+# Check kept connections to database servers when a request starts and
+# reopen the ones that don't answer
+STORE_DB_HEALTH_CHECKS = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Catalog API responses, see store/cache.py
+    'store': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'store-responses',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    # Version tokens of the caches every process keeps in memory, see
+    # store/versions.py. Every process of the deployment must share it:
+    # the processes of one host share the directory; point it at memcached
+    # or Redis when they run on several hosts.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache', 'shared'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
 
@@ -133,9 +219,111 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [],
 
+    # JSON, writing out cached row fragments as they are, see
+    # store/fragments.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'store.fragments.FragmentJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
-    )
+    ),
+
+    # Keyset pagination over each viewset's queryset ordering
+    'DEFAULT_PAGINATION_CLASS': 'store.pagination.StoreCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Maximum number of orders accepted by POST /api/orders/bulk/
+STORE_BULK_ORDER_LIMIT = 100
+
+# Largest SKU id list the attribute index passes back to the database;
+# bigger matches fall back to filtering with joins
+STORE_ATTRIBUTE_INDEX_MAX_IDS = 10000
+
+# SKU full-text search, see store/search.py. Set to None to search with
+# plain database lookups.
+STORE_SEARCH_BACKEND = 'store.search.SQLiteFTS5Backend'
+
+# Serve SKU, product and attribute reads through the values() based
+# serializers in store/fast_serializers.py
+STORE_FAST_READ_SERIALIZERS = False
+
+# Assemble SKU, product and attribute reads from the cached JSON of each
+# row, see store/fragments.py
+STORE_FRAGMENT_CACHE = False
+
+# Bytes of row JSON each process keeps, least recently used first out
+STORE_FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Completed, cancelled and refunded orders older than this many days are
+# moved to the order archive by the archive_orders command
+STORE_ORDER_ARCHIVE_AFTER_DAYS = 365
+
+# Orders archived per transaction
+STORE_ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Queue POST /api/orders/ requests for the process_order_intake workers
+# and answer 202 Accepted, see store/intake.py
+STORE_ASYNC_ORDER_INTAKE = False
+
+# Queued order requests a worker claims and processes per transaction
+STORE_ORDER_INTAKE_BATCH_SIZE = 50
+
+# Seconds after which requests claimed by a worker that didn't finish them
+# are claimed again
+STORE_ORDER_INTAKE_CLAIM_TIMEOUT = 300
+
+# Claims of a request after which it fails instead of being claimed again
+STORE_ORDER_INTAKE_MAX_ATTEMPTS = 3
+
+# Rows an export reads per query, see store/export.py
+STORE_EXPORT_CHUNK_SIZE = 500
+
+# Unfiltered admin changelists of tables estimated to hold more rows than
+# this show the estimate instead of running COUNT(*)
+STORE_ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Database aliases catalog and admin changelist reads are spread over,
+# see store/replicas.py
+STORE_READ_REPLICAS = []
+
+# Seconds reads stay on the primary after a client wrote or the catalog
+# changed; keep it above the replicas' lag
+STORE_REPLICA_STICKY_SECONDS = 5
+
+# Raise instead of logging a warning when a request runs more queries than
+# its viewset's query_budget allows, see store/queries.py. The query budget
+# tests turn this on.
+STORE_QUERY_BUDGET_ENFORCE = False
+
+# Share of requests whose query report is logged to 'store.queries'
+STORE_QUERY_LOG_SAMPLE_RATE = 0.01
+
+# Number of slowest and most repeated statements kept in a query report
+STORE_QUERY_LOG_SLOWEST = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'store.queries': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'store.intake': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
 
 # CORS_ORIGIN_ALLOW_ALL = True
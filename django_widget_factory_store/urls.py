@@ -28,12 +28,19 @@ router = routers.DefaultRouter()
 router.register(r'skus', views.SKUViewSet)
 router.register(r'products', views.ProductViewSet)
 router.register(r'orders', views.OrderViewSet)
+router.register(r'order_intake', views.OrderIntakeViewSet)
 router.register(r'product_attributes', views.AttributeViewSet)
 router.register(r'product_attribute_types', views.AttributeTypeViewSet)
+router.register(r'facets', views.FacetViewSet, base_name='facet')
+router.register(r'categories', views.CategoryViewSet, base_name='category')
+router.register(r'sales', views.SalesViewSet, base_name='sales')
 
 urlpatterns = [
     path(r'', TemplateView.as_view(template_name='index.html'), name="home"),
     path('admin/', admin_site.urls),
+    path('api/cache_stats/', views.CacheStatsView.as_view(),
+         name='cache-stats'),
+    path('api/health/', views.HealthView.as_view(), name='health'),
     path('api/', include(router.urls)),
     path('api-auth/',
          include('rest_framework.urls', namespace='rest_framework')),
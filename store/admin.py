@@ -1,8 +1,21 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Prefetch
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
 from .models import *
 from django.utils.translation import ugettext_lazy as _
 from django.utils.html import format_html, mark_safe
-from .forms import OrderForm
+from rest_framework import serializers
+from .forms import OrderForm, SKUForm
+from .views import sales_report
+from . import inventory, sales, search
 
 
 class StoreAdminSite(admin.AdminSite):
@@ -17,6 +30,167 @@ class StoreAdminSite(admin.AdminSite):
     # Text to put at the top of the admin index page.
     index_title = _('Administration')
 
+    # Links the sales dashboard
+    index_template = 'admin/store/index.html'
+
+    # Rows of the dashboard's breakdown table
+    sales_rows = 20
+
+    def get_urls(self):
+        return [
+            path('sales/', self.admin_view(self.sales_view), name='sales'),
+        ] + super().get_urls()
+
+    def sales_view(self, request):
+        """Sales per day and the best sellers, from the sales rollups"""
+        by = request.GET.get('by') or 'product'
+        context = dict(
+            self.each_context(request), title=_('Sales'),
+            groupings=list(sales.GROUPINGS)[1:], by=by,
+            params=request.GET)
+        try:
+            context['daily'] = sales_report(
+                dict(request.GET.items(), by='day'))
+            context['breakdown'] = sales_report(
+                dict(request.GET.items(), by=by), self.sales_rows)
+        except serializers.ValidationError as exc:
+            context['errors'] = exc.detail
+        request.current_app = self.name
+        return TemplateResponse(request, 'admin/store/sales.html', context)
+
+
+def estimated_count(model):
+    """
+    Returns the database's estimate of the number of rows of ``model``,
+    or None when there is none. Much cheaper than COUNT(*) on big tables.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table])
+        elif connection.vendor == 'sqlite':
+            # Row ids only grow, both ends are read from the primary key
+            cursor.execute(
+                'SELECT MAX(rowid) - MIN(rowid) + 1 FROM %s' %
+                connection.ops.quote_name(table))
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting unfiltered changelists of big tables with the
+    database's row estimate instead of COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model)
+            if estimate is not None and estimate > getattr(
+                    settings, 'STORE_ADMIN_ESTIMATED_COUNT_THRESHOLD',
+                    100000):
+                return estimate
+        return super().count
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    List filter picking a related object through the admin autocomplete
+    view, instead of listing every object in the changelist sidebar. The
+    related model must be registered with ``search_fields``.
+    """
+    template = 'admin/store/autocomplete_filter.html'
+
+    # Related model and the lookup to filter on, e.g. Product and
+    # 'order_line_set__sku__product'
+    related_model = None
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            return queryset.filter(**{self.lookup: self.value()}).distinct()
+        except (ValueError, ValidationError):
+            return queryset.none()
+
+    def selected(self):
+        """Returns the related object filtered on, if any"""
+        if not self.value():
+            return None
+        try:
+            return self.related_model.objects.filter(
+                pk=self.value()).first()
+        except (ValueError, ValidationError):
+            return None
+
+    @property
+    def autocomplete_url(self):
+        return reverse('admin:%s_%s_autocomplete' % (
+            self.related_model._meta.app_label,
+            self.related_model._meta.model_name))
+
+
+class ProductFilter(AutocompleteFilter):
+    """Orders by a product of their lines"""
+    title = _('Product')
+    parameter_name = 'product'
+    related_model = Product
+    lookup = 'order_line_set__sku__product'
+
+
+class SKUProductFilter(AutocompleteFilter):
+    """SKUs by product"""
+    title = _('Product')
+    parameter_name = 'product'
+    related_model = Product
+    lookup = 'product'
+
+
+class MovementSKUFilter(AutocompleteFilter):
+    """Inventory movements by SKU"""
+    title = _('SKU')
+    parameter_name = 'sku'
+    related_model = SKU
+    lookup = 'sku'
+
+
+class SKUAttributeFilter(AutocompleteFilter):
+    """SKUs by attribute"""
+    title = _('Attribute')
+    parameter_name = 'attribute'
+    related_model = Attribute
+    lookup = 'attributes'
+
+
+class ScalableChangeListMixin(object):
+    """
+    Changelist settings for big tables: estimated counts, no second count
+    of the unfiltered table, and the media of the autocomplete filters.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
+
 
 class OrderLineInline(admin.TabularInline):
     """Definition for Inline Tabular display of OrderLines"""
@@ -26,14 +200,19 @@ class OrderLineInline(admin.TabularInline):
     readonly_fields = (
         'sku', 'price', 'currency', 'quantity', 'ordering')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('sku')
 
-class OrderAdmin(admin.ModelAdmin):
+
+class OrderAdmin(ScalableChangeListMixin, admin.ModelAdmin):
     """Definition for admin display of Orders"""
 
     list_display = (
-        'id', 'status_description', 'bill_to_address', 'ship_to_address',
-        'created_timestamp', 'modified_timestamp',)
-    list_filter = ('order_line_set__sku__product',)
+        'id', 'status_description', 'contact_name', 'total',
+        'bill_to_address', 'ship_to_address', 'created_timestamp',
+        'modified_timestamp',)
+    list_select_related = ('bill_to', 'ship_to',)
+    list_filter = (ProductFilter,)
 
     fieldsets = (
         (None, {
@@ -96,22 +275,181 @@ class OrderAdmin(admin.ModelAdmin):
         """List field accessor for status description"""
         return Order.STATUS_CHOICES[instance.status - 1][1]
 
+    def changelist_view(self, request, extra_context=None):
+        """Points to the archived orders of the selected dates"""
+        lookups = {
+            key: value for key, value in request.GET.items()
+            if key.startswith(self.date_hierarchy + '__')
+        }
+        if lookups:
+            try:
+                archived = ArchivedOrder.objects.filter(**lookups).count()
+            except (ValueError, ValidationError):
+                archived = 0
+            if archived:
+                self.message_user(request, format_html(
+                    '{} archived orders match these dates, see '
+                    '<a href="{}?{}">Archived Orders</a>.', archived,
+                    reverse('admin:store_archivedorder_changelist'),
+                    urlencode(lookups)))
+        return super().changelist_view(request, extra_context)
+
     bill_to_address.short_description = _("Address")
     ship_to_address.short_description = _("Address")
 
 
-class SKUAdmin(admin.ModelAdmin):
+class ArchivedOrderLineInline(admin.TabularInline):
+    """Definition for Inline Tabular display of ArchivedOrderLines"""
+
+    model = ArchivedOrderLine
+    extra = 0
+    readonly_fields = (
+        'sku', 'price', 'currency', 'quantity', 'ordering')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    """Read only admin display of Orders moved to the archive"""
+
+    list_display = (
+        'id', 'status_description', 'contact_name', 'total', 'currency',
+        'period', 'created_timestamp',)
+    list_filter = ('period', 'status',)
+    date_hierarchy = 'created_timestamp'
+    inlines = (ArchivedOrderLineInline, )
+    readonly_fields = (
+        'id', 'status', 'ship_to', 'bill_to', 'contact', 'contact_name',
+        'total', 'currency', 'line_count', 'item_count', 'period',
+        'created_timestamp', 'modified_timestamp', 'archived_timestamp',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def status_description(self, instance):
+        """List field accessor for status description"""
+        return Order.STATUS_CHOICES[instance.status - 1][1]
+
+
+class InventoryMovementAdmin(ScalableChangeListMixin, admin.ModelAdmin):
+    """Read only admin display of the inventory ledger"""
+
+    list_display = (
+        'created_timestamp', 'sku', 'kind', 'quantity', 'order_id',)
+    list_select_related = ('sku',)
+    list_filter = ('kind', MovementSKUFilter,)
+    date_hierarchy = 'created_timestamp'
+    readonly_fields = (
+        'created_timestamp', 'sku', 'kind', 'quantity', 'order_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ContentAddressedAdmin(admin.ModelAdmin):
+    """
+    Read only admin display of addresses and contacts: orders share them
+    (see store/dedup.py), an edit would change all of their orders
+    """
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ProductAdmin(admin.ModelAdmin):
+    """Definition for admin display of Products"""
+
+    list_display = ('name', 'manufacturer', 'category',)
+    ordering = ('name',)
+    search_fields = ('name',)
+
+
+class AttributeAdmin(admin.ModelAdmin):
+    """Definition for admin display of Attributes"""
+
+    list_display = ('name', 'type',)
+    list_filter = ('type',)
+    ordering = ('type__name', 'name',)
+    search_fields = ('name', 'type__name',)
+
+
+class SKUAdmin(ScalableChangeListMixin, admin.ModelAdmin):
     """Definition for admin display of SKUs"""
 
+    form = SKUForm
     list_display = (
         'number', 'product', 'attribute_description', 'price', 'currency',
-        'quantity',)
-    list_filter = ('product', 'attributes',)
+        'available',)
+    list_select_related = ('product',)
+    list_filter = (SKUProductFilter, SKUAttributeFilter,)
 
     search_fields = (
         'attributes__name', 'product__name', 'product__category__name'
     )
 
+    def get_queryset(self, request):
+        return inventory.with_available(
+            super().get_queryset(request)
+        ).prefetch_related(
+            Prefetch('attributes', Attribute.objects.order_by('id')))
+
+    def available(self, instance):
+        """List field accessor for the stock, inventory shards included"""
+        return instance.available
+
+    available.short_description = _("Quantity")
+    available.admin_order_field = 'available'
+
+    def save_model(self, request, obj, form, change):
+        """
+        Saves the SKU but its quantity, which is moved through the inventory
+        ledger by the edit, keeping what was reserved since the form loaded
+        """
+        if not change:
+            super().save_model(request, obj, form, change)
+            if obj.quantity:
+                InventoryMovement.objects.create(
+                    sku=obj, kind=InventoryMovement.ADJUSTMENT,
+                    quantity=obj.quantity)
+            return
+
+        obj.save(update_fields=[
+            field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name != 'quantity'])
+        quantity_change = form.quantity_change()
+        if quantity_change:
+            try:
+                inventory.adjust(obj.pk, quantity_change)
+            except inventory.InsufficientStock as exc:
+                self.message_user(request, ' '.join(
+                    exc.detail['order_line_set']), messages.ERROR)
+        obj.refresh_from_db(fields=['quantity'])
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search through the SKU search index when one is available"""
+        backend = search.get_backend()
+        if not search_term or backend is None:
+            return super().get_search_results(
+                request, queryset, search_term)
+
+        return backend.filter(queryset, search_term), False
+
     def attribute_description(self, instance):
         """List field accessor for attribute description"""
         html = ""
@@ -125,10 +463,12 @@ class SKUAdmin(admin.ModelAdmin):
 # Instantiate admin_site and register urls
 admin_site = StoreAdminSite()
 admin_site.register(ProductCategory)
-admin_site.register(Product)
+admin_site.register(Product, ProductAdmin)
 admin_site.register(AttributeType)
-admin_site.register(Attribute)
+admin_site.register(Attribute, AttributeAdmin)
 admin_site.register(SKU, SKUAdmin)
-admin_site.register(Address)
-admin_site.register(Contact)
+admin_site.register(Address, ContentAddressedAdmin)
+admin_site.register(Contact, ContentAddressedAdmin)
 admin_site.register(Order, OrderAdmin)
+admin_site.register(ArchivedOrder, ArchivedOrderAdmin)
+admin_site.register(InventoryMovement, InventoryMovementAdmin)
@@ -0,0 +1,157 @@
+"""
+Order archive.
+
+Orders that reached a final status (completed, cancelled or refunded) and
+are older than ``STORE_ORDER_ARCHIVE_AFTER_DAYS`` are moved, with their
+lines, from the Order and OrderLine tables into ArchivedOrder and
+ArchivedOrderLine in chunked transactions, so the tables orders are written
+to and listed from stay small. Archived rows keep their ids and timestamps
+and are partitioned by month in ``ArchivedOrder.period``.
+
+Reads that ask for a date range go through ``OrderHistory``, which pages
+over the hot and archived orders as if they were one table.
+"""
+import heapq
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import *
+
+# Statuses an order doesn't leave anymore
+ARCHIVABLE_STATUSES = (Order.COMPLETED, Order.CANCELLED, Order.REFUNDED)
+
+
+def period(timestamp):
+    """Returns the archive period (YYYY-MM) of ``timestamp``"""
+    return timestamp.strftime('%Y-%m')
+
+
+def cutoff(days=None):
+    """Returns the timestamp before which final orders are archived"""
+    if days is None:
+        days = getattr(settings, 'STORE_ORDER_ARCHIVE_AFTER_DAYS', 365)
+    return timezone.now() - timedelta(days=days)
+
+
+def copy_fields(instance, model, **extra):
+    """Returns a ``model`` instance with the field values of ``instance``"""
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    }
+    values.update(extra)
+    return model(**values)
+
+
+def delete_rows(model, field_name, values):
+    """
+    Deletes the rows of ``model`` whose ``field_name`` is in ``values``
+    without loading them or sending delete signals; the order summary
+    receivers have nothing to do for rows that are moved.
+    """
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            quote_name(model._meta.db_table),
+            quote_name(model._meta.get_field(field_name).column),
+            ', '.join(['%s'] * len(values))), list(values))
+
+
+def archive_batch(before, batch_size, statuses=ARCHIVABLE_STATUSES):
+    """Archives up to ``batch_size`` of the oldest archivable orders"""
+    with transaction.atomic():
+        orders = list(Order.objects.filter(
+            status__in=statuses, created_timestamp__lt=before
+        ).order_by('created_timestamp', 'pk')[:batch_size])
+        if not orders:
+            return 0
+
+        order_ids = [order.pk for order in orders]
+        ArchivedOrder.objects.bulk_create(
+            copy_fields(order, ArchivedOrder,
+                        period=period(order.created_timestamp))
+            for order in orders)
+        ArchivedOrderLine.objects.bulk_create(
+            copy_fields(order_line, ArchivedOrderLine)
+            for order_line in OrderLine.objects.filter(
+                order_id__in=order_ids))
+
+        delete_rows(OrderLine, 'order', order_ids)
+        delete_rows(Order, 'id', order_ids)
+        return len(orders)
+
+
+def archive_orders(before=None, batch_size=None):
+    """
+    Moves every archivable order created before ``before`` (default
+    ``cutoff()``) to the archive, ``batch_size`` orders per transaction.
+    Returns the number of archived orders.
+    """
+    before = before or cutoff()
+    batch_size = batch_size or getattr(
+        settings, 'STORE_ORDER_ARCHIVE_BATCH_SIZE', 500)
+    # Order ids of a batch are passed as query parameters
+    batch_size = min(batch_size, connection.features.max_query_params or
+                     batch_size)
+
+    archived = 0
+    while True:
+        count = archive_batch(before, batch_size)
+        if not count:
+            return archived
+        archived += count
+
+
+class OrderHistory(object):
+    """
+    Read only union of hot and archived order querysets with the same
+    ordering. Supports what the pagination classes use: ``order_by()``,
+    ``filter()``, slicing and ``count()``.
+    """
+
+    def __init__(self, *querysets):
+        self.querysets = querysets
+
+    @property
+    def query(self):
+        return self.querysets[0].query
+
+    def _clone(self, method, *args, **kwargs):
+        return OrderHistory(*[
+            getattr(queryset, method)(*args, **kwargs)
+            for queryset in self.querysets])
+
+    def order_by(self, *field_names):
+        return self._clone('order_by', *field_names)
+
+    def filter(self, *args, **kwargs):
+        return self._clone('filter', *args, **kwargs)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def merge(self, limit):
+        """Returns the first ``limit`` rows of the union, in order"""
+        ordering = self.query.order_by
+        descending = ordering[0].startswith('-')
+        assert all(
+            field.startswith('-') == descending for field in ordering), (
+            'OrderHistory needs an ordering in a single direction.')
+
+        fields = [field.lstrip('-') for field in ordering]
+        rows = heapq.merge(
+            *[list(queryset[:limit]) for queryset in self.querysets],
+            key=lambda row: [getattr(row, field) for field in fields],
+            reverse=descending)
+        return [row for row, _ in zip(rows, range(limit))]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            assert index.stop is not None and not index.step, (
+                'OrderHistory only supports bounded slices.')
+            return self.merge(index.stop)[index]
+        return self.merge(index + 1)[index]
+
+    def __iter__(self):
+        return iter(self.merge(self.count()))
@@ -0,0 +1,113 @@
+"""
+In-memory attribute -> SKU bitmap index.
+
+Every attribute maps to an integer used as a bitmap over SKU ids, so a
+filter on several attributes becomes a few bitwise ANDs instead of one join
+on the SKU/attribute table per attribute.
+
+The index is built lazily on first use in each worker. Changes to
+``SKU.attributes`` bump its version token once they commit (see
+``store.signals`` and ``store.versions``), and every worker rebuilds on its
+next read once it sees a new token.
+"""
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+from .models import SKU
+from . import versions
+
+VERSION_NAME = 'attribute_index'
+
+
+def encode(sku_ids, size):
+    """Returns a bitmap with the bit of each sku id set"""
+    buffer = bytearray(size // 8 + 1)
+    for sku_id in sku_ids:
+        buffer[sku_id >> 3] |= 1 << (sku_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def decode(bitmap):
+    """Returns the sorted sku ids set in a bitmap"""
+    sku_ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for offset, byte in enumerate(data):
+        if byte:
+            base = offset * 8
+            sku_ids.extend(
+                base + bit for bit in range(8) if byte >> bit & 1)
+    return sku_ids
+
+
+class AttributeIndex(object):
+    """Lazily built attribute -> SKU bitmap index"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bitmaps = None
+        self._version = None
+
+    def build(self):
+        """Reads the SKU/attribute table into one bitmap per attribute"""
+        sku_ids_by_attribute = defaultdict(list)
+        max_sku_id = 0
+        rows = SKU.attributes.through.objects.values_list(
+            'attribute_id', 'sku_id').order_by().iterator()
+        for attribute_id, sku_id in rows:
+            sku_ids_by_attribute[attribute_id].append(sku_id)
+            max_sku_id = max(max_sku_id, sku_id)
+
+        return {
+            attribute_id: encode(sku_ids, max_sku_id)
+            for attribute_id, sku_ids in sku_ids_by_attribute.items()
+        }
+
+    @property
+    def bitmaps(self):
+        """The current bitmaps, rebuilt if another change was recorded"""
+        version = versions.get(VERSION_NAME)
+        with self._lock:
+            if self._bitmaps is None or self._version != version:
+                self._bitmaps = self.build()
+                self._version = version
+            return self._bitmaps
+
+    def invalidate(self):
+        """Marks the index stale in every worker once the change commits"""
+        versions.bump(VERSION_NAME)
+
+    def intersect(self, attribute_ids):
+        """Returns the bitmap of SKUs having every given attribute"""
+        bitmaps = self.bitmaps
+        result = None
+        for attribute_id in attribute_ids:
+            bitmap = bitmaps.get(attribute_id, 0)
+            result = bitmap if result is None else result & bitmap
+            if not result:
+                return 0
+        return result or 0
+
+    def sku_ids(self, attribute_ids):
+        """
+        Returns the sorted ids of SKUs having every given attribute, or
+        ``None`` when there are too many to pass back to the database as a
+        single ``IN`` list.
+        """
+        bitmap = self.intersect(attribute_ids)
+        if bin(bitmap).count('1') > max_sku_ids():
+            return None
+        return decode(bitmap)
+
+
+def max_sku_ids():
+    """Largest id list the index hands back to the database"""
+    limit = getattr(settings, 'STORE_ATTRIBUTE_INDEX_MAX_IDS', 10000)
+    max_query_params = connection.features.max_query_params
+    if max_query_params:
+        # Leave room for the other parameters of the query
+        limit = min(limit, max_query_params - 100)
+    return limit
+
+
+attribute_index = AttributeIndex()
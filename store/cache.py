@@ -0,0 +1,120 @@
+"""
+Response cache for the catalog read endpoints.
+
+Responses are cached per viewset group, keyed on the full request URL and
+the group's version token (see ``store.versions``). A change to any model
+a group is built from replaces the token once it commits, in every
+process, which orphans all of the group's entries at once. Orphans age out
+through the cache backend's own size bound and eviction (see the ``store``
+alias in ``CACHES``).
+"""
+import hashlib
+import threading
+from collections import Counter
+from django.core.cache import caches
+from rest_framework.response import Response
+from .models import *
+from . import versions
+
+CACHE_ALIAS = 'store'
+
+# The models each cached group's responses are built from
+DEPENDENCIES = {
+    'skus': (SKU, Product, Attribute, AttributeType, ProductCategory),
+    'products': (Product, ProductCategory),
+    'product_attributes': (Attribute, AttributeType, SKU),
+    'product_attribute_types': (AttributeType, Attribute, SKU),
+    'facets': (AttributeType, Attribute, SKU, Product, ProductCategory),
+}
+
+
+class ResponseCache(object):
+    """Versioned response cache with per-process hit/miss counters"""
+
+    def __init__(self, alias=CACHE_ALIAS):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._misses = Counter()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self, group):
+        return versions.get('response:%s' % group)
+
+    def key(self, group, request):
+        """Returns the cache key for the request's full URL"""
+        url = request.build_absolute_uri()
+        return 'store:response:%s:%s:%s' % (
+            group, self.version(group),
+            hashlib.md5(url.encode('utf-8')).hexdigest())
+
+    def fetch(self, group, request, build):
+        """
+        Returns the cached response for ``request``, or the one returned
+        by ``build`` after storing it when it's cacheable.
+        """
+        key = self.key(group, request)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count(self._hits, group)
+            data, status = cached
+            response = Response(data, status=status)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        self._count(self._misses, group)
+        response = build()
+        if response.status_code == 200:
+            self.cache.set(key, (response.data, response.status_code))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def invalidate(self, group):
+        """Orphans every cached response of ``group`` once committed"""
+        versions.bump('response:%s' % group)
+
+    def invalidate_model(self, model):
+        """Orphans the responses of every group built from ``model``"""
+        for group, models in DEPENDENCIES.items():
+            if model in models:
+                self.invalidate(group)
+
+    def _count(self, counter, group):
+        with self._lock:
+            counter[group] += 1
+
+    def stats(self):
+        """Returns hit/miss counters of this process per group"""
+        with self._lock:
+            return {
+                group: {
+                    'hits': self._hits[group],
+                    'misses': self._misses[group],
+                }
+                for group in DEPENDENCIES
+            }
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin(object):
+    """Serves list and retrieve GETs from the response cache"""
+
+    # Key of DEPENDENCIES the viewset's responses belong to
+    cache_group = None
+
+    def list(self, request, *args, **kwargs):
+        parent = super(CachedResponseMixin, self)
+        return response_cache.fetch(
+            self.cache_group, request,
+            lambda: parent.list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        parent = super(CachedResponseMixin, self)
+        return response_cache.fetch(
+            self.cache_group, request,
+            lambda: parent.retrieve(request, *args, **kwargs))
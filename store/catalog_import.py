@@ -0,0 +1,426 @@
+"""
+Bulk catalog import.
+
+Every input row describes one SKU, identified by its ``number``, with its
+product (identified by ``product_manufacturer`` and ``product_name``), the
+product's category path (``category``, names separated by `` / ``) and the
+SKU's attributes (``attributes``, ``Type: Name`` pairs separated by ``;``,
+or in JSONL an object of type names to attribute names). Rows are upserted:
+missing rows are created, changed rows updated and a SKU's attributes are
+replaced by the ones of its row. A row's ``quantity`` is the SKU's whole
+stock; the difference is recorded in the inventory ledger.
+
+Rows are imported in batches, one transaction each, with bulk inserts for
+new rows and for the SKU/attribute links. New categories are inserted with
+MPTT updates disabled and the trees they were added to are rebuilt at the
+end of their batch's transaction, so reads never see categories outside
+the tree; a new top level category renumbers the trees, ordered by name,
+and rebuilds all of them. Bulk writes
+skip the signals keeping the search index and caches current, so batches
+reindex their SKUs and invalidate the caches when they commit.
+"""
+import csv
+import json
+from collections import Counter, OrderedDict
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from . import inventory, search
+from .attribute_index import attribute_index
+from .cache import DEPENDENCIES, response_cache
+from .category_tree import category_tree
+from .fragments import STAMPS, fragment_cache
+from .models import *
+
+FORMATS = ('csv', 'jsonl')
+
+CATEGORY_SEPARATOR = ' / '
+
+
+class RowError(ValueError):
+    """An input row that can't be imported"""
+
+
+def read_rows(input_file, format):
+    """Yields ``(line number, row dict)`` of a CSV or JSONL file"""
+    if format == 'csv':
+        reader = csv.DictReader(input_file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(input_file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, RowError('Invalid JSON: %s' % exc)
+            continue
+        yield line_number, row
+
+
+def parse_attributes(value):
+    """Returns the ``(type name, attribute name)`` pairs of a row"""
+    if isinstance(value, dict):
+        pairs = value.items()
+    else:
+        pairs = []
+        for pair in (value or '').split(';'):
+            if not pair.strip():
+                continue
+            if ':' not in pair:
+                raise RowError(
+                    'Expected "Type: Name" attributes, got "%s".' % pair)
+            pairs.append(pair.split(':', 1))
+    return [(str(type_name).strip(), str(name).strip())
+            for type_name, name in pairs]
+
+
+def clean_value(model, field_name, value):
+    """Returns ``value`` converted and validated by the model field"""
+    field = model._meta.get_field(field_name)
+    try:
+        return field.clean(value, None)
+    except ValidationError as exc:
+        raise RowError('%s: %s' % (field_name, ' '.join(exc.messages)))
+
+
+class CatalogImporter(object):
+    """Imports batches of rows, counting what it does in ``stats``"""
+
+    def __init__(self):
+        self.stats = Counter()
+        self.updated_products = []
+        self.rebuild_tree = ProductCategory.objects.filter(lft=0).exists()
+        self.touched_trees = set()
+        self.categories = self.category_paths()
+        self.category_trees = dict(
+            ProductCategory.objects.values_list('pk', 'tree_id'))
+        self.attribute_types = dict(
+            AttributeType.objects.values_list('name', 'pk'))
+        self.attributes = {
+            (type_id, name): pk
+            for pk, type_id, name in Attribute.objects.values_list(
+                'pk', 'type_id', 'name')
+        }
+
+    def category_paths(self):
+        """Returns ``{category path: id}`` of the existing categories"""
+        rows = {
+            pk: (parent_id, name)
+            for pk, parent_id, name in ProductCategory.objects.values_list(
+                'pk', 'parent_id', 'name')
+        }
+        paths = {}
+        for pk in rows:
+            names = []
+            category_id = pk
+            while category_id in rows:
+                category_id, name = rows[category_id]
+                names.append(name)
+            paths.setdefault(CATEGORY_SEPARATOR.join(reversed(names)), pk)
+        return paths
+
+    def clean(self, row):
+        """Returns the typed values of an input row, raises RowError"""
+        if isinstance(row, Exception):
+            raise row
+        values = {
+            'number': clean_value(SKU, 'number', row.get('number')),
+            'price': clean_value(SKU, 'price', row.get('price')),
+            'currency': clean_value(SKU, 'currency', row.get('currency')),
+            'quantity': clean_value(SKU, 'quantity', row.get('quantity')),
+            'product_name': clean_value(
+                Product, 'name', row.get('product_name')),
+            'product_manufacturer': clean_value(
+                Product, 'manufacturer', row.get('product_manufacturer')),
+            'product_description': row.get('product_description') or None,
+            'category': tuple(
+                name.strip() for name in (row.get('category') or '').split(
+                    CATEGORY_SEPARATOR.strip()) if name.strip()),
+            'attributes': parse_attributes(row.get('attributes')),
+        }
+        if values['product_description'] is not None:
+            values['product_description'] = clean_value(
+                Product, 'description', values['product_description'])
+        return values
+
+    def import_batch(self, rows):
+        """
+        Upserts a batch of cleaned rows in one transaction. Returns the
+        ``(row, error)`` pairs of the rows that were left out.
+        """
+        # The last row of a SKU wins
+        rows = list(OrderedDict((row['number'], row) for row in rows).values())
+        with transaction.atomic():
+            with ProductCategory.objects.disable_mptt_updates():
+                self.create_categories(rows)
+            products, errors = self.upsert_products(rows)
+            rows = [row for row in rows if row['number'] not in errors]
+            self.create_attributes(rows)
+            sku_ids = self.upsert_skus(rows, products, errors)
+            rows = [row for row in rows if row['number'] not in errors]
+            self.link_attributes(rows, sku_ids)
+            search.index_skus([sku_ids[row['number']] for row in rows] + list(
+                SKU.objects.filter(product_id__in=self.updated_products)
+                .values_list('pk', flat=True)))
+            self.publish()
+        return list(errors.values())
+
+    def create_categories(self, rows):
+        """Creates the missing categories, leaving the tree unbuilt"""
+        for row in rows:
+            path = row['category']
+            for depth in range(len(path)):
+                key = CATEGORY_SEPARATOR.join(path[:depth + 1])
+                if key in self.categories:
+                    continue
+                parent_id = (
+                    self.categories[CATEGORY_SEPARATOR.join(path[:depth])]
+                    if depth else None)
+                # In its parent's tree, to rebuild; roots get theirs then
+                tree_id = self.category_trees[parent_id] if depth else 0
+                category = ProductCategory(
+                    parent_id=parent_id, name=path[depth],
+                    description=path[depth], level=depth,
+                    tree_id=tree_id, lft=0, rght=0)
+                category.save()
+                self.categories[key] = category.pk
+                self.category_trees[category.pk] = tree_id
+                if tree_id:
+                    self.touched_trees.add(tree_id)
+                else:
+                    self.rebuild_tree = True
+                self.stats['categories created'] += 1
+
+    def upsert_products(self, rows):
+        """
+        Creates and updates the products of ``rows``. Returns their
+        ``{(manufacturer, name): id}`` and ``{number: (row, error)}`` of
+        the rows whose product can't be created.
+        """
+        wanted = OrderedDict()
+        for row in rows:
+            key = (row['product_manufacturer'], row['product_name'])
+            wanted.setdefault(key, row)
+
+        products = {}
+        for product in Product.objects.filter(
+                name__in={name for manufacturer, name in wanted}
+        ).order_by('-pk'):
+            # The oldest product wins when the key isn't unique
+            products[(product.manufacturer, product.name)] = product
+
+        now = timezone.now()
+        created = []
+        errors = {}
+        self.updated_products = []
+        for key, row in wanted.items():
+            category_id = (
+                self.categories[CATEGORY_SEPARATOR.join(row['category'])]
+                if row['category'] else None)
+            product = products.get(key)
+            if product is None:
+                if category_id is None:
+                    errors[key] = RowError(
+                        'category: Required for new products.')
+                    continue
+                created.append(Product(
+                    manufacturer=key[0], name=key[1],
+                    description=row['product_description'] or '',
+                    category_id=category_id))
+                continue
+
+            changes = {}
+            if category_id is not None and category_id != product.category_id:
+                changes['category_id'] = category_id
+            if row['product_description'] is not None and \
+                    row['product_description'] != product.description:
+                changes['description'] = row['product_description']
+            if changes:
+                Product.objects.filter(pk=product.pk).update(
+                    modified_timestamp=now, **changes)
+                self.updated_products.append(product.pk)
+                self.stats['products updated'] += 1
+
+        if created:
+            Product.objects.bulk_create(created)
+            self.stats['products created'] += len(created)
+            # SQLite doesn't return the ids of bulk inserted rows
+            for product in Product.objects.filter(
+                    name__in={product.name for product in created}
+            ).order_by('-pk'):
+                products[(product.manufacturer, product.name)] = product
+
+        row_errors = {}
+        for row in rows:
+            key = (row['product_manufacturer'], row['product_name'])
+            if key in errors:
+                row_errors[row['number']] = (row, errors[key])
+        return (
+            {key: product.pk for key, product in products.items()},
+            row_errors)
+
+    def create_attributes(self, rows):
+        """Creates the missing attribute types and attributes"""
+        pairs = OrderedDict(
+            (pair, None) for row in rows for pair in row['attributes'])
+
+        type_names = [
+            type_name for type_name in OrderedDict.fromkeys(
+                type_name for type_name, name in pairs)
+            if type_name not in self.attribute_types]
+        if type_names:
+            AttributeType.objects.bulk_create(
+                AttributeType(name=type_name, description=type_name)
+                for type_name in type_names)
+            self.attribute_types.update(AttributeType.objects.filter(
+                name__in=type_names).values_list('name', 'pk'))
+            self.stats['attribute types created'] += len(type_names)
+
+        missing = [
+            (self.attribute_types[type_name], name)
+            for type_name, name in pairs
+            if (self.attribute_types[type_name], name) not in self.attributes]
+        if missing:
+            Attribute.objects.bulk_create(
+                Attribute(type_id=type_id, name=name, description=name)
+                for type_id, name in missing)
+            for pk, type_id, name in Attribute.objects.filter(
+                    name__in={name for type_id, name in missing}
+            ).values_list('pk', 'type_id', 'name'):
+                self.attributes.setdefault((type_id, name), pk)
+            self.stats['attributes created'] += len(missing)
+
+    def upsert_skus(self, rows, products, errors):
+        """
+        Creates and updates the SKUs of ``rows``, recording their stock
+        changes in the inventory ledger. Returns their ids, and adds the
+        rows whose stock couldn't be lowered, left unchanged, to
+        ``errors``.
+        """
+        fields = ('price', 'currency', 'quantity', 'product_id')
+        existing = {
+            values['number']: values
+            for values in SKU.objects.filter(
+                number__in=[row['number'] for row in rows]
+            ).order_by('-pk').values(
+                'pk', 'number', 'inventory_shards', *fields)
+        }
+
+        now = timezone.now()
+        created = []
+        movements = []
+        for row in rows:
+            values = {
+                'price': row['price'],
+                'currency': row['currency'],
+                'quantity': row['quantity'],
+                'product_id': products[
+                    (row['product_manufacturer'], row['product_name'])],
+            }
+            current = existing.get(row['number'])
+            if current is None:
+                created.append(SKU(number=row['number'], **values))
+                continue
+
+            # The row's quantity is all the stock, shards included
+            if current['inventory_shards']:
+                current['quantity'] += inventory.fold(current['pk'])
+            difference = values['quantity'] - current['quantity']
+            if difference:
+                # Moved by the difference, so stock reserved since it was
+                # read stays reserved. First, so a row left out writes
+                # nothing else.
+                try:
+                    inventory.adjust(current['pk'], difference)
+                except inventory.InsufficientStock as exc:
+                    errors[row['number']] = (row, RowError(
+                        'quantity: %s' % ' '.join(
+                            exc.detail['order_line_set'])))
+                    continue
+            changed = {
+                name: values[name] for name in fields
+                if name != 'quantity' and current[name] != values[name]}
+            if changed:
+                SKU.objects.filter(pk=current['pk']).update(
+                    modified_timestamp=now, **changed)
+            if changed or difference:
+                self.stats['skus updated'] += 1
+
+        if created:
+            SKU.objects.bulk_create(created)
+            self.stats['skus created'] += len(created)
+            existing.update(
+                (values['number'], values)
+                for values in SKU.objects.filter(
+                    number__in=[sku.number for sku in created]
+                ).order_by('-pk').values('pk', 'number'))
+            movements.extend(
+                InventoryMovement(
+                    sku_id=existing[sku.number]['pk'],
+                    kind=InventoryMovement.RECEIPT, quantity=sku.quantity)
+                for sku in created if sku.quantity)
+        InventoryMovement.objects.bulk_create(movements)
+
+        return {number: values['pk'] for number, values in existing.items()}
+
+    def link_attributes(self, rows, sku_ids):
+        """Replaces the attributes of the SKUs of ``rows``"""
+        Through = SKU.attributes.through
+        wanted = {
+            (sku_ids[row['number']],
+             self.attributes[(self.attribute_types[type_name], name)])
+            for row in rows for type_name, name in row['attributes']
+        }
+        current = {
+            link[1:]: link[0]
+            for link in Through.objects.filter(
+                sku_id__in=[sku_ids[row['number']] for row in rows]
+            ).values_list('pk', 'sku_id', 'attribute_id')
+        }
+
+        stale = [pk for link, pk in current.items() if link not in wanted]
+        if stale:
+            Through.objects.filter(pk__in=stale).delete()
+            self.stats['attribute links removed'] += len(stale)
+
+        added = [link for link in wanted if link not in current]
+        if added:
+            Through.objects.bulk_create(
+                Through(sku_id=sku_id, attribute_id=attribute_id)
+                for sku_id, attribute_id in added)
+            self.stats['attribute links added'] += len(added)
+
+    def publish(self):
+        """
+        Rebuilds the category trees categories were inserted in, and
+        invalidates the read caches once the transaction commits.
+        """
+        if self.rebuild_tree:
+            ProductCategory.objects.rebuild()
+            self.category_trees = dict(
+                ProductCategory.objects.values_list('pk', 'tree_id'))
+        else:
+            for tree_id in sorted(self.touched_trees):
+                ProductCategory.objects.partial_rebuild(tree_id)
+        self.rebuild_tree = False
+        self.touched_trees = set()
+        attribute_index.invalidate()
+        category_tree.invalidate()
+        for group in DEPENDENCIES:
+            response_cache.invalidate(group)
+        for model in STAMPS:
+            fragment_cache.invalidate(model)
+
+    def finish(self):
+        """Rebuilds a tree an earlier, failed import left unbuilt"""
+        if self.rebuild_tree:
+            with transaction.atomic():
+                self.publish()
+
+
+def batch_size(requested):
+    """Caps ``requested`` to the ids a batch passes as query parameters"""
+    return min(requested, connection.features.max_query_params or requested)
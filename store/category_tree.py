@@ -0,0 +1,107 @@
+"""
+In-memory product category tree.
+
+The whole ProductCategory tree is read into nested dicts, with the number
+of products filed directly under each category and under its subtree, in
+two queries: one over the categories in MPTT order and one counting
+products per category. The tree is built lazily in each worker and kept
+like the attribute index: changes to categories and products bump its
+version token once they commit (see ``store.signals`` and
+``store.versions``) and every worker rebuilds on its next read once it
+sees a new token.
+
+The ``tree_id``, ``lft`` and ``rght`` of every category are kept too, so a
+subtree is selected with a single range predicate, see ``subtree()``.
+"""
+import threading
+from django.db.models import Count
+from .models import Product, ProductCategory
+from . import versions
+
+VERSION_NAME = 'category_tree'
+
+
+class CategoryTree(object):
+    """Lazily built category tree with cumulative product counts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._version = None
+
+    def build(self):
+        """
+        Returns the root nodes, ``{category id: node}`` and ``{category
+        id: (tree_id, lft, rght)}``.
+        """
+        product_counts = dict(
+            Product.objects.values('category_id').annotate(
+                count=Count('pk')
+            ).order_by().values_list('category_id', 'count'))
+
+        roots = []
+        nodes = {}
+        ranges = {}
+        for category in ProductCategory.objects.order_by(
+                'tree_id', 'lft').values():
+            count = product_counts.get(category['id'], 0)
+            node = {
+                'id': category['id'],
+                'name': category['name'],
+                'description': category['description'],
+                'level': category['level'],
+                'product_count': count,
+                'total_product_count': count,
+                'children': [],
+            }
+            nodes[node['id']] = node
+            ranges[node['id']] = (
+                category['tree_id'], category['lft'], category['rght'])
+            parent = nodes.get(category['parent_id'])
+            (parent['children'] if parent else roots).append(node)
+
+        # Children come after their parent in MPTT order, so walking
+        # backwards adds every subtree up before it reaches the parent
+        for node in reversed(list(nodes.values())):
+            for child in node['children']:
+                node['total_product_count'] += child['total_product_count']
+        return roots, nodes, ranges
+
+    @property
+    def tree(self):
+        """The current tree, rebuilt if another change was recorded"""
+        version = versions.get(VERSION_NAME)
+        with self._lock:
+            if self._tree is None or self._version != version:
+                self._tree = self.build()
+                self._version = version
+            return self._tree
+
+    def invalidate(self):
+        """Marks the tree stale in every worker once the change commits"""
+        versions.bump(VERSION_NAME)
+
+    def roots(self):
+        return self.tree[0]
+
+    def node(self, category_id):
+        """Returns the node of ``category_id``, or ``None``"""
+        return self.tree[1].get(category_id)
+
+    def subtree(self, category_id, prefix=''):
+        """
+        Returns the lookups selecting the rows whose category, reached
+        through ``prefix``, is ``category_id`` or one of its descendants,
+        or ``None`` for an unknown category.
+        """
+        subtree_range = self.tree[2].get(category_id)
+        if subtree_range is None:
+            return None
+        tree_id, lft, rght = subtree_range
+        return {
+            prefix + 'tree_id': tree_id,
+            prefix + 'lft__range': (lft, rght),
+        }
+
+
+category_tree = CategoryTree()
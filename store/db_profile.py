@@ -0,0 +1,109 @@
+"""
+Database connection profile.
+
+Every new database connection is tuned from ``STORE_DB_PROFILES``, the
+settings to apply per database vendor, through the ``connection_created``
+signal:
+
+- SQLite runs ``PRAGMA <name> = <value>`` for each setting.
+  ``busy_timeout`` makes a writer wait for the lock instead of failing with
+  "database is locked". Deployments opt in to WAL journaling, which lets
+  catalog reads go on while an order commits, with ``synchronous =
+  normal`` syncing the WAL at checkpoints only: the journal mode is
+  written to the database file and leaves ``-wal`` and ``-shm`` files next
+  to it, so the development and test databases keep the rollback journal.
+  ``journal_mode`` is left alone on the read replicas, which are copies
+  ``sync_replicas`` swaps in and nothing writes to.
+- PostgreSQL sets each setting for the session, e.g. ``statement_timeout``
+  and ``lock_timeout``, so a runaway query or a lock queue fails fast
+  instead of holding a persistent connection.
+
+Connections are kept between requests for ``CONN_MAX_AGE`` seconds (see
+``DATABASES``). A kept connection may have been dropped by the server in
+the meantime; with ``STORE_DB_HEALTH_CHECKS`` on, the connections of the
+thread to a database server are checked when a request starts and
+reopened if they don't answer. SQLite opens a local file, with no server
+to drop the connection, and isn't checked. ``health()`` reports every
+database for /api/health/.
+"""
+import time
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from . import replicas
+
+# SQLite settings read back by health()
+SQLITE_REPORTED = (
+    'journal_mode', 'synchronous', 'busy_timeout', 'cache_size',
+    'mmap_size')
+
+
+def profile(vendor):
+    """Returns the ``{name: value}`` settings of ``vendor``'s connections"""
+    return dict(getattr(settings, 'STORE_DB_PROFILES', {}).get(vendor, {}))
+
+
+def apply(connection):
+    """Applies the profile of its vendor to ``connection``"""
+    settings_ = profile(connection.vendor)
+    if not settings_:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            if connection.alias in replicas.replicas():
+                settings_.pop('journal_mode', None)
+            for name, value in settings_.items():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+        elif connection.vendor == 'postgresql':
+            for name, value in settings_.items():
+                cursor.execute(
+                    'SELECT set_config(%s, %s, false)', [name, str(value)])
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    apply(connection)
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    """Closes the kept connections of this thread that no longer answer"""
+    if not getattr(settings, 'STORE_DB_HEALTH_CHECKS', True):
+        return
+    for connection in connections.all():
+        if connection.vendor == 'sqlite':
+            continue
+        # A new connection is opened on the next query
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+def health():
+    """
+    Returns ``{alias: report}`` of the primary and the read replicas, with
+    whether each answers, its round trip time and, for SQLite, the settings
+    in effect.
+    """
+    reports = {}
+    for alias in ['default'] + replicas.replicas():
+        connection = connections[alias]
+        report = {'vendor': connection.vendor}
+        started = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+                report['ms'] = (time.perf_counter() - started) * 1000
+                if connection.vendor == 'sqlite':
+                    for name in SQLITE_REPORTED:
+                        cursor.execute('PRAGMA %s' % name)
+                        report[name] = cursor.fetchone()[0]
+        except DatabaseError as error:
+            report['ok'] = False
+            report['error'] = str(error)
+        else:
+            report['ok'] = True
+        reports[alias] = report
+    return reports
@@ -0,0 +1,152 @@
+"""
+Content-addressed Address and Contact rows.
+
+Addresses and contacts are identified by ``content_hash``, a hash of their
+normalized field values with a unique index, so a repeat customer or a
+bill-to equal to the ship-to reuses the existing row. ``upsert()`` writes
+the rows of an order with one ``INSERT ... ON CONFLICT DO NOTHING`` and
+reads them back with one query.
+
+Rows written before the hash existed have none; ``backfill()`` (the
+``dedupe_contacts`` command) hashes them, keeping the oldest row of every
+hash and repointing the orders and archived orders of its duplicates.
+"""
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from .archive import delete_rows
+from .models import *
+
+# The order foreign keys to each content-addressed model
+REFERENCES = {
+    Address: ('ship_to', 'bill_to'),
+    Contact: ('contact',),
+}
+REFERENCING_MODELS = (Order, ArchivedOrder)
+
+
+def upsert(model, values_list):
+    """
+    Returns the ``model`` rows with each of ``values_list`` (dicts of field
+    values), created if they don't exist yet.
+    """
+    instances = {}
+    hashes = []
+    for values in values_list:
+        content_hash = model.hash_content(values)
+        hashes.append(content_hash)
+        instances.setdefault(
+            content_hash, model(content_hash=content_hash, **values))
+
+    if connection.vendor in ('sqlite', 'postgresql'):
+        insert_ignoring_conflicts(model, list(instances.values()))
+    else:
+        for content_hash, instance in instances.items():
+            model.objects.get_or_create(
+                content_hash=content_hash, defaults={
+                    field.name: getattr(instance, field.name)
+                    for field in model.content_fields()})
+
+    rows = model.objects.in_bulk(hashes, field_name='content_hash')
+    return [rows[content_hash] for content_hash in hashes]
+
+
+def insert_ignoring_conflicts(model, instances):
+    """Inserts ``instances``, skipping those whose content_hash exists"""
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key]
+    quote_name = connection.ops.quote_name
+    params = []
+    for instance in instances:
+        params.extend(
+            field.get_db_prep_save(
+                field.pre_save(instance, True), connection)
+            for field in fields)
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO NOTHING' % (
+                quote_name(model._meta.db_table),
+                ', '.join(quote_name(field.column) for field in fields),
+                ', '.join([row] * len(instances)),
+                quote_name(model._meta.get_field('content_hash').column)),
+            params)
+
+
+def repoint(duplicates):
+    """
+    Points the order foreign keys at the rows in ``duplicates``
+    (``{model: {duplicate id: kept id}}``) to the kept rows.
+    """
+    for model, kept_ids in duplicates.items():
+        if not kept_ids:
+            continue
+        for referencing_model in REFERENCING_MODELS:
+            for name in REFERENCES[model]:
+                column = name + '_id'
+                referencing_model.objects.filter(**{
+                    column + '__in': list(kept_ids)
+                }).update(**{column: Case(
+                    *[When(**{column: duplicate_id, 'then': Value(kept_id)})
+                      for duplicate_id, kept_id in kept_ids.items()])})
+
+
+def backfill_batch(model, batch_size):
+    """
+    Hashes up to ``batch_size`` of the oldest unhashed ``model`` rows,
+    merging the duplicates into the oldest row of their hash. Returns the
+    numbers of rows hashed and merged.
+    """
+    with transaction.atomic():
+        rows = list(model.objects.filter(
+            content_hash__isnull=True).order_by('pk')[:batch_size])
+        if not rows:
+            return 0, 0
+
+        hashes = {
+            row.pk: model.hash_content({
+                field.name: getattr(row, field.attname)
+                for field in model.content_fields()})
+            for row in rows
+        }
+        kept = dict(model.objects.filter(
+            content_hash__in=set(hashes.values())
+        ).values_list('content_hash', 'pk'))
+        duplicates = {}
+        for pk, content_hash in sorted(hashes.items()):
+            kept_pk = kept.setdefault(content_hash, pk)
+            if kept_pk > pk:
+                # A newer row hashed when it was stored
+                duplicates[kept_pk] = kept[content_hash] = pk
+            elif kept_pk != pk:
+                duplicates[pk] = kept_pk
+
+        repoint({model: duplicates})
+        if duplicates:
+            delete_rows(model, 'id', list(duplicates))
+        hashed = {
+            pk: content_hash for pk, content_hash in hashes.items()
+            if pk not in duplicates}
+        model.objects.filter(pk__in=list(hashed)).update(
+            content_hash=Case(
+                *[When(pk=pk, then=Value(content_hash))
+                  for pk, content_hash in hashed.items()]))
+        return len(hashed), len(duplicates)
+
+
+def backfill(model, batch_size=200):
+    """
+    Hashes every unhashed ``model`` row, collapsing duplicates. Returns
+    the numbers of rows hashed and merged.
+    """
+    # Every row of a batch is a parameter of the statements repointing
+    # and hashing it, twice
+    batch_size = min(batch_size, (
+        connection.features.max_query_params or batch_size * 3) // 3)
+    hashed = merged = 0
+    while True:
+        batch_hashed, batch_merged = backfill_batch(model, batch_size)
+        if not batch_hashed and not batch_merged:
+            return hashed, merged
+        hashed += batch_hashed
+        merged += batch_merged
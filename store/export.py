@@ -0,0 +1,283 @@
+"""
+Streaming exports of orders and the catalog.
+
+An export reads its queryset in chunks of ``STORE_EXPORT_CHUNK_SIZE`` rows
+by primary key (keyset pagination), with the related rows of each chunk
+prefetched, and yields NDJSON lines or CSV rows as it goes; at no point is
+more than one chunk in memory. Records come out in primary key order and
+carry their ``id``, so an interrupted export resumes with ``after`` set to
+the last id it received.
+
+Orders are exported with their addresses, contact and lines, archived
+orders included. In NDJSON there is one line per order with its lines
+nested; in CSV there is one row per order line, the order columns repeated.
+"""
+import csv
+import datetime
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from rest_framework import serializers
+from . import inventory
+from .archive import OrderHistory
+from .models import *
+import django_filters
+
+FORMATS = ('ndjson', 'csv')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+ADDRESS_FIELDS = [
+    field.name for field in Address._meta.concrete_fields
+    if field.name not in ('created_timestamp', 'modified_timestamp')
+]
+
+
+def cell(value):
+    """Returns ``value`` as written to a CSV cell"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if value is None:
+        return ''
+    return value
+
+
+class Echo(object):
+    """File-like object handing back what csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+class Export(object):
+    """
+    Streams ``queryset`` as NDJSON or CSV. Subclasses build the ``record()``
+    of an instance and its CSV ``rows()``, under the ``header`` columns.
+    """
+
+    header = ()
+
+    def __init__(self, queryset, after=None, chunk_size=None):
+        self.queryset = queryset
+        self.after = after
+        self.chunk_size = chunk_size or getattr(
+            settings, 'STORE_EXPORT_CHUNK_SIZE', 500)
+
+    def chunks(self):
+        """Yields the instances of the queryset in primary key order"""
+        queryset = self.queryset.order_by('pk')
+        after = self.after
+        while True:
+            if after is not None:
+                chunk = queryset.filter(pk__gt=after)[:self.chunk_size]
+            else:
+                chunk = queryset[:self.chunk_size]
+            chunk = list(chunk)
+            if not chunk:
+                return
+            yield chunk
+            after = chunk[-1].pk
+
+    def record(self, instance):
+        raise NotImplementedError()
+
+    def rows(self, instance):
+        raise NotImplementedError()
+
+    def ndjson(self):
+        """Yields one JSON line per instance"""
+        for chunk in self.chunks():
+            for instance in chunk:
+                yield json.dumps(
+                    self.record(instance), cls=DjangoJSONEncoder) + '\n'
+
+    def csv(self):
+        """Yields the header line, then the rows of each instance"""
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for chunk in self.chunks():
+            for instance in chunk:
+                # All rows of an instance at once, a resumed export starts
+                # after the last complete instance
+                yield ''.join(
+                    writer.writerow([cell(value) for value in row])
+                    for row in self.rows(instance))
+
+    def stream(self, format):
+        """Yields the export in ``format``, one of FORMATS"""
+        return getattr(self, format)()
+
+
+class OrderExport(Export):
+    """Orders with their addresses, contact and lines"""
+
+    order_fields = (
+        'id', 'status', 'created_timestamp', 'modified_timestamp', 'total',
+        'currency', 'line_count', 'item_count')
+
+    line_fields = (
+        'id', 'sku', 'sku_number', 'price', 'currency', 'quantity',
+        'ordering')
+
+    header = (
+        order_fields + ('archived', 'contact_full_name', 'contact_email') +
+        tuple('ship_to_' + name for name in ADDRESS_FIELDS) +
+        tuple('bill_to_' + name for name in ADDRESS_FIELDS) +
+        tuple('line_' + name for name in line_fields))
+
+    def address(self, address):
+        return {name: getattr(address, name) for name in ADDRESS_FIELDS}
+
+    def record(self, order):
+        record = {name: getattr(order, name) for name in self.order_fields}
+        record.update({
+            'archived': isinstance(order, ArchivedOrder),
+            'contact': {
+                'full_name': order.contact.full_name,
+                'email': order.contact.email,
+            },
+            'ship_to': self.address(order.ship_to),
+            'bill_to': self.address(order.bill_to),
+            'order_line_set': [
+                {
+                    'id': order_line.id,
+                    'sku': order_line.sku_id,
+                    'sku_number': order_line.sku.number,
+                    'price': order_line.price,
+                    'currency': order_line.currency,
+                    'quantity': order_line.quantity,
+                    'ordering': order_line.ordering,
+                }
+                for order_line in order.order_line_set.all()
+            ],
+        })
+        return record
+
+    def rows(self, order):
+        record = self.record(order)
+        columns = [record[name] for name in self.order_fields] + [
+            record['archived'], record['contact']['full_name'],
+            record['contact']['email']]
+        columns += [record['ship_to'][name] for name in ADDRESS_FIELDS]
+        columns += [record['bill_to'][name] for name in ADDRESS_FIELDS]
+        # An order without lines still gets its row
+        order_lines = record['order_line_set'] or [{}]
+        return [
+            columns + [order_line.get(name) for name in self.line_fields]
+            for order_line in order_lines
+        ]
+
+
+class SKUExport(Export):
+    """SKUs with their product and attributes"""
+
+    header = (
+        'id', 'number', 'price', 'currency', 'quantity', 'created_timestamp',
+        'modified_timestamp', 'product_id', 'product_name',
+        'product_manufacturer', 'attributes')
+
+    def record(self, sku):
+        return {
+            'id': sku.id,
+            'number': sku.number,
+            'price': sku.price,
+            'currency': sku.currency,
+            # All the stock, as a catalog import reads it
+            'quantity': sku.available,
+            'created_timestamp': sku.created_timestamp,
+            'modified_timestamp': sku.modified_timestamp,
+            'product': {
+                'id': sku.product_id,
+                'name': sku.product.name,
+                'manufacturer': sku.product.manufacturer,
+            },
+            'attributes': [
+                {'type': attribute.type.name, 'name': attribute.name}
+                for attribute in sku.attributes.all()
+            ],
+        }
+
+    def rows(self, sku):
+        record = self.record(sku)
+        return [[
+            record['id'], record['number'], record['price'],
+            record['currency'], record['quantity'],
+            record['created_timestamp'], record['modified_timestamp'],
+            record['product']['id'], record['product']['name'],
+            record['product']['manufacturer'],
+            '; '.join(
+                '%(type)s: %(name)s' % attribute
+                for attribute in record['attributes']),
+        ]]
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    """Comma separated numbers, e.g. ``?status=4,6``"""
+
+
+class OrderExportFilterSet(django_filters.FilterSet):
+    """FilterSet of an order export, also applied to ArchivedOrder"""
+    created_after = django_filters.IsoDateTimeFilter(
+        name='created_timestamp', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(
+        name='created_timestamp', lookup_expr='lt')
+    status = NumberInFilter(name='status', lookup_expr='in')
+
+    class Meta:
+        model = Order
+        fields = ('created_after', 'created_before', 'status')
+
+
+class SKUExportFilterSet(django_filters.FilterSet):
+    """FilterSet of a catalog export"""
+    modified_after = django_filters.IsoDateTimeFilter(
+        name='modified_timestamp', lookup_expr='gte')
+    modified_before = django_filters.IsoDateTimeFilter(
+        name='modified_timestamp', lookup_expr='lt')
+
+    class Meta:
+        model = SKU
+        fields = ('modified_after', 'modified_before', 'product_id')
+
+
+def filtered(filterset_class, params, queryset):
+    filterset = filterset_class(params, queryset=queryset)
+    if not filterset.form.is_valid():
+        raise serializers.ValidationError(filterset.form.errors)
+    return filterset.qs
+
+
+def orders(params, after=None, chunk_size=None):
+    """Returns the OrderExport of the hot and archived orders"""
+    querysets = [
+        filtered(OrderExportFilterSet, params, model.objects.select_related(
+            'ship_to', 'bill_to', 'contact'
+        ).prefetch_related(
+            Prefetch('order_line_set', line_model.objects.select_related(
+                'sku').order_by('ordering', 'id'))
+        ))
+        for model, line_model in (
+            (Order, OrderLine), (ArchivedOrder, ArchivedOrderLine))
+    ]
+    return OrderExport(OrderHistory(*querysets), after, chunk_size)
+
+
+def skus(params, after=None, chunk_size=None):
+    """Returns the SKUExport of the catalog"""
+    queryset = inventory.with_available(
+        SKU.objects.select_related('product')
+    ).prefetch_related(
+        Prefetch('attributes', Attribute.objects.select_related(
+            'type').order_by('type__name', 'id')))
+    return SKUExport(
+        filtered(SKUExportFilterSet, params, queryset), after, chunk_size)
+
+
+EXPORTS = {
+    'orders': orders,
+    'skus': skus,
+}
@@ -0,0 +1,276 @@
+"""
+Fast read path for catalog list and retrieve endpoints.
+
+A fast serializer reproduces the output of a regular serializer from
+``values()`` rows instead of model instances. The regular serializer's
+fields are compiled once per class into a plan of ``(key, build)`` steps,
+plain fields reuse the DRF field's own ``to_representation`` and hyperlinks
+are built from a URL template instead of calling ``reverse()`` per row.
+The rendered JSON is byte for byte the same as the regular serializer's.
+"""
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework.relations import HyperlinkedIdentityField
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.serializers import BaseSerializer
+from .fragments import STAMPS, fragment_cache
+from . import fieldsets
+from .models import Attribute, AttributeType, Product, SKU
+from .serializers import (
+    AttributeSerializer, AttributeSerializerForAttributeType,
+    AttributeTypeSerializer, AttributeTypeSerializerForSKU, ProductSerializer,
+    SKUSerializer)
+
+# Stand-in primary key used to derive URL templates from reverse()
+URL_PK_PLACEHOLDER = 987654321
+
+
+class FastSerializer(object):
+    """
+    Builds ``serializer_class`` representations from ``values()`` rows.
+
+    Columns of the row are looked up with ``prefix`` so the same fast
+    serializer can read a related object's columns from its parent's row.
+    Nested serializers are declared in ``nested`` (to-one relations read
+    from the same row) and to-many relations are loaded by ``prefetch()``.
+    """
+
+    serializer_class = None
+    model = None
+
+    # {field name: fast serializer class} of to-one relations
+    nested = {}
+
+    _compiled = None
+
+    def __init__(self, request, prefix=''):
+        self.request = request
+        self.prefix = prefix
+        self.children = {
+            key: fast_class(request, prefix + self.source(key) + '__')
+            for key, fast_class in self.nested.items()
+        }
+        self.many = {}
+        self.url_templates = {}
+
+    @classmethod
+    def compiled_fields(cls):
+        """Returns the serializer's fields, instantiated once per class"""
+        if cls.__dict__.get('_compiled') is None:
+            cls._compiled = list(cls.serializer_class().fields.items())
+        return cls._compiled
+
+    def source(self, key):
+        return dict(self.compiled_fields())[key].source
+
+    def column(self, name):
+        return self.prefix + name
+
+    def columns(self):
+        """Returns the ``values()`` lookups needed to build a row"""
+        columns = [self.column('id')]
+        for key, field in self.compiled_fields():
+            if key in self.children:
+                columns.extend(self.children[key].columns())
+            elif not isinstance(
+                    field, (BaseSerializer, HyperlinkedIdentityField)):
+                columns.append(self.column(field.source))
+        return list(OrderedDict.fromkeys(columns))
+
+    def url(self, view_name, pk):
+        """Returns the absolute URL of ``view_name`` for ``pk``"""
+        if view_name not in self.url_templates:
+            url = reverse(
+                view_name, kwargs={'pk': URL_PK_PLACEHOLDER},
+                request=self.request)
+            self.url_templates[view_name] = url.rsplit(
+                str(URL_PK_PLACEHOLDER), 1)
+
+        head, tail = self.url_templates[view_name]
+        return head + str(pk) + tail
+
+    def prefetch(self, rows):
+        """
+        Loads to-many relations for ``rows`` into ``self.many`` as
+        ``{field name: {id: [representation, ...]}}``.
+        """
+        for child in self.children.values():
+            child.prefetch(rows)
+
+    def to_representation(self, row):
+        ret = OrderedDict()
+        for key, field in self.compiled_fields():
+            if isinstance(field, HyperlinkedIdentityField):
+                ret[key] = self.url(field.view_name, row[self.column('id')])
+            elif key in self.children:
+                child = self.children[key]
+                if row[child.column('id')] is None:
+                    ret[key] = None
+                else:
+                    ret[key] = child.to_representation(row)
+            elif key in self.many:
+                ret[key] = self.many[key].get(row[self.column('id')], [])
+            else:
+                value = row[self.column(field.source)]
+                ret[key] = None if value is None else (
+                    field.to_representation(value))
+        return ret
+
+    def serialize(self, pks):
+        """Returns representations of the given objects, in ``pks`` order"""
+        rows = {
+            row['id']: row
+            for row in self.model.objects.filter(
+                pk__in=pks).values(*self.columns())
+        }
+        self.prefetch(rows.values())
+        return [self.to_representation(rows[pk]) for pk in pks if pk in rows]
+
+
+class FastProductSerializer(FastSerializer):
+    """Fast ProductSerializer"""
+    serializer_class = ProductSerializer
+    model = Product
+
+
+class FastAttributeTypeSerializerForSKU(FastSerializer):
+    """Fast AttributeTypeSerializerForSKU"""
+    serializer_class = AttributeTypeSerializerForSKU
+    model = Attribute
+
+
+class FastSKUSerializer(FastSerializer):
+    """Fast SKUSerializer"""
+    serializer_class = SKUSerializer
+    model = SKU
+    nested = {'product': FastProductSerializer}
+
+    def prefetch(self, rows):
+        super().prefetch(rows)
+
+        # Same ordering as the SKUViewSet attribute prefetch
+        child = FastAttributeTypeSerializerForSKU(
+            self.request, 'attribute__')
+        attributes = defaultdict(list)
+        through_rows = SKU.attributes.through.objects.filter(
+            sku_id__in=[row[self.column('id')] for row in rows]
+        ).values(
+            'sku_id', *child.columns()
+        ).order_by('attribute__type__name', 'attribute_id')
+        for through_row in through_rows:
+            attributes[through_row['sku_id']].append(
+                child.to_representation(through_row))
+        self.many['attributes'] = attributes
+
+
+class FastAttributeSerializerForAttributeType(FastSerializer):
+    """Fast AttributeSerializerForAttributeType"""
+    serializer_class = AttributeSerializerForAttributeType
+    model = Attribute
+
+
+class FastAttributeTypeSerializer(FastSerializer):
+    """Fast AttributeTypeSerializer"""
+    serializer_class = AttributeTypeSerializer
+    model = AttributeType
+
+    def prefetch(self, rows):
+        super().prefetch(rows)
+
+        # Same ordering as the AttributeViewSet attribute_set prefetch
+        child = FastAttributeSerializerForAttributeType(self.request)
+        attribute_set = defaultdict(list)
+        attribute_rows = Attribute.objects.filter(
+            type_id__in=[row[self.column('id')] for row in rows]
+        ).values('type_id', *child.columns()).order_by('id')
+        for attribute_row in attribute_rows:
+            attribute_set[attribute_row['type_id']].append(
+                child.to_representation(attribute_row))
+        self.many['attribute_set'] = attribute_set
+
+
+class FastAttributeSerializer(FastSerializer):
+    """Fast AttributeSerializer"""
+    serializer_class = AttributeSerializer
+    model = Attribute
+    nested = {'type': FastAttributeTypeSerializer}
+
+
+class FastReadMixin(object):
+    """
+    Serves list and retrieve through ``fast_serializer_class`` when
+    ``STORE_FAST_READ_SERIALIZERS`` is on. Only the primary keys (and the
+    ordering columns pagination needs) of the filtered queryset are read;
+    the fast serializer loads everything else. With
+    ``STORE_FRAGMENT_CACHE`` on, the rows are served from their cached
+    JSON, see store/fragments.py.
+    """
+
+    fast_serializer_class = None
+
+    def use_fast_read(self):
+        # Format suffixes change hyperlinks and sparse fieldsets the
+        # fields, leave them to the serializer
+        return (
+            getattr(settings, 'STORE_FAST_READ_SERIALIZERS', False) and
+            self.fast_serializer_class is not None and
+            self.format_kwarg is None and
+            not fieldsets.requested(self.request))
+
+    def use_fragments(self):
+        return (
+            getattr(settings, 'STORE_FRAGMENT_CACHE', False) and
+            self.fast_serializer_class is not None and
+            self.format_kwarg is None and
+            not fieldsets.requested(self.request))
+
+    def key_queryset(self):
+        """
+        Returns the filtered queryset reduced to pk and ordering values,
+        and the fragment keys when fragments are on.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = [
+            field.lstrip('-') for field in queryset.query.order_by]
+        stamps = []
+        if self.use_fragments():
+            stamps = STAMPS[self.fast_serializer_class.model]
+        return queryset.prefetch_related(None).values(
+            *OrderedDict.fromkeys(['pk'] + ordering + list(stamps)))
+
+    def fast_data(self, rows):
+        """Returns the representations of the ``key_queryset()`` rows"""
+        fast_serializer = self.fast_serializer_class(self.request)
+        if self.use_fragments():
+            return fragment_cache.fragments(fast_serializer, rows)
+        return fast_serializer.serialize([row['pk'] for row in rows])
+
+    def list(self, request, *args, **kwargs):
+        if not (self.use_fast_read() or self.use_fragments()):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.key_queryset()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.fast_data(page))
+
+        return Response(self.fast_data(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not (self.use_fast_read() or self.use_fragments()):
+            return super().retrieve(request, *args, **kwargs)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            rows = list(self.key_queryset().filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})[:1])
+        except (TypeError, ValueError, ValidationError):
+            # A lookup value of the wrong type, as in get_object_or_404()
+            raise Http404
+        data = self.fast_data(rows)
+        if not data:
+            raise Http404
+        return Response(data[0])
@@ -0,0 +1,283 @@
+"""
+Sparse fieldsets.
+
+Reads take ``?fields=`` to keep only the named fields of every row and
+``?omit=`` to leave fields out, both comma separated with nested fields
+dotted, e.g. ``/api/skus/?fields=id,number,price,product.name``. Naming a
+nested serializer without its fields keeps all of them.
+
+With serializers (``SparseFieldsMixin``) the serializer's fields are
+removed before it runs, unknown names are rejected, and the queryset is
+reduced to what the fields left read: ``only()`` their columns, plus the
+columns hyperlinks and pagination need, and the ``select_related()`` joins
+and prefetches of the nested serializers left, with their own columns
+pruned the same way. A serializer reading anything but model fields, e.g.
+a method field, keeps its queryset whole.
+
+Views answering plain data (``SparseDataMixin``) trim the data after the
+fact; reports with ``results`` trim the results only, like the paginated
+responses.
+"""
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import permissions, serializers
+from rest_framework.relations import HyperlinkedIdentityField
+
+PARAMS = ('fields', 'omit')
+
+
+def parse(value):
+    """Returns comma separated dotted paths as a ``{name: subtree}`` tree"""
+    tree = OrderedDict()
+    for path in value.split(','):
+        if not path.strip():
+            continue
+        node = tree
+        for name in path.strip().split('.'):
+            node = node.setdefault(name, OrderedDict())
+    return tree
+
+
+def requested(request):
+    """Returns whether ``request`` is a read asking for sparse fields"""
+    return request.method in permissions.SAFE_METHODS and any(
+        request.query_params.get(param) for param in PARAMS)
+
+
+class Fieldset(object):
+    """
+    The fields kept at one level: those of ``include`` (all if ``None``)
+    not left out entirely by ``exclude``, both trees from ``parse()``.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = include
+        self.exclude = exclude or {}
+
+    @classmethod
+    def from_request(cls, request):
+        """Returns the fieldset of ``request``, or ``None`` for all fields"""
+        if not requested(request):
+            return None
+        fields = request.query_params.get('fields')
+        return cls(
+            parse(fields) if fields else None,
+            parse(request.query_params.get('omit', '')))
+
+    def keeps(self, name):
+        if name in self.exclude and not self.exclude[name]:
+            return False
+        return self.include is None or name in self.include
+
+    def child(self, name):
+        """Returns the fieldset of the nested field ``name``"""
+        include = None
+        if self.include is not None and self.include.get(name):
+            include = self.include[name]
+        return Fieldset(include, self.exclude.get(name))
+
+    def names(self):
+        """Returns ``(param, name)`` of every name at this level"""
+        return [('fields', name) for name in self.include or ()] + [
+            ('omit', name) for name in self.exclude]
+
+
+def nested_serializer(field):
+    """Returns the serializer of a nested (or nested many) field, if any"""
+    field = getattr(field, 'child', field)
+    return field if isinstance(field, serializers.BaseSerializer) else None
+
+
+def prune(serializer, fieldset, prefix=''):
+    """Removes the fields of ``serializer`` left out by ``fieldset``"""
+    fields = serializer.fields
+    unknown = OrderedDict()
+    for param, name in fieldset.names():
+        if name not in fields:
+            unknown.setdefault(param, []).append(
+                'Unknown field "%s".' % (prefix + name))
+    if unknown:
+        raise serializers.ValidationError(unknown)
+
+    for name in list(fields):
+        if not fieldset.keeps(name):
+            del fields[name]
+            continue
+        child = fieldset.child(name)
+        nested = nested_serializer(fields[name])
+        if nested is not None:
+            prune(nested, child, prefix + name + '.')
+        elif child.names():
+            param, nested_name = child.names()[0]
+            raise serializers.ValidationError({param: [
+                'Unknown field "%s.%s".' % (prefix + name, nested_name)]})
+    return serializer
+
+
+def sources(serializer, model):
+    """
+    Returns the fields of ``model`` that ``serializer`` reads and
+    ``{relation name: serializer}`` of its nested serializers, or ``None``
+    if it reads anything else.
+    """
+    columns = [model._meta.pk.name]
+    relations = OrderedDict()
+    for field in serializer.fields.values():
+        if isinstance(field, HyperlinkedIdentityField):
+            columns.append(
+                model._meta.pk.name if field.lookup_field == 'pk'
+                else field.lookup_field)
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        nested = nested_serializer(field)
+        if nested is not None:
+            relations[field.source] = nested
+        elif not (model_field.many_to_many or model_field.one_to_many):
+            columns.append(field.source)
+    return columns, relations
+
+
+def collect(serializer, model, selected, prefix=''):
+    """
+    Returns the ``only()`` fields, ``select_related()`` paths and
+    ``(path, serializer, relation)`` of the to-many relations
+    ``serializer`` reads from ``model``, following the joins in ``selected`` (a
+    ``query.select_related`` tree). Returns ``None`` if it can't tell.
+    """
+    read = sources(serializer, model)
+    if read is None:
+        return None
+    columns, relations = read
+    only = [prefix + column for column in columns]
+    select_related = []
+    to_many = []
+    for name, nested in relations.items():
+        field = model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            to_many.append((prefix + name, nested, field))
+            continue
+        only.append(prefix + name)
+        if name not in selected:
+            continue
+        select_related.append(prefix + name)
+        joined = collect(
+            nested, field.related_model, selected[name],
+            prefix + name + '__')
+        if joined is None:
+            return None
+        only.extend(joined[0])
+        select_related.extend(joined[1])
+        to_many.extend(joined[2])
+    return only, select_related, to_many
+
+
+def prune_queryset(queryset, serializer, extra=()):
+    """
+    Returns ``queryset`` loading only what ``serializer`` (already pruned)
+    outputs, and the ``extra`` fields.
+    """
+    selected = queryset.query.select_related
+    if selected is True:
+        return queryset
+    collected = collect(serializer, queryset.model, selected or {})
+    if collected is None:
+        return queryset
+    only, select_related, to_many = collected
+    # Pagination reads the ordering values from the rows
+    only.extend(
+        field.lstrip('-') for field in queryset.query.order_by
+        if '__' not in field)
+
+    to_many = {path: (nested, field) for path, nested, field in to_many}
+    lookups = []
+    for lookup in queryset._prefetch_related_lookups:
+        path = (
+            lookup.prefetch_through if isinstance(lookup, Prefetch)
+            else lookup)
+        if path not in to_many:
+            continue
+        nested, field = to_many[path]
+        related = field.related_model._default_manager.all()
+        to_attr = None
+        if isinstance(lookup, Prefetch):
+            if lookup.queryset is not None:
+                related = lookup.queryset
+            to_attr = lookup.to_attr
+        # Related rows are matched to theirs through the foreign key
+        lookups.append(Prefetch(
+            path, to_attr=to_attr, queryset=prune_queryset(
+                related, nested,
+                [field.field.name] if field.one_to_many else [])))
+
+    queryset = queryset.select_related(None)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    return queryset.prefetch_related(None).prefetch_related(
+        *lookups
+    ).only(*OrderedDict.fromkeys(list(only) + list(extra)))
+
+
+def trim(data, fieldset):
+    """Returns ``data`` without the keys left out by ``fieldset``"""
+    if isinstance(data, list):
+        return [trim(item, fieldset) for item in data]
+    if isinstance(data, dict):
+        return OrderedDict(
+            (key, trim(value, fieldset.child(key)))
+            for key, value in data.items() if fieldset.keeps(key))
+    return data
+
+
+class SparseFieldsMixin(object):
+    """Applies ``?fields=`` and ``?omit=`` to a generic viewset's reads"""
+
+    def fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = Fieldset.from_request(self.request)
+        return self._fieldset
+
+    def sparse_serializer(self, serializer):
+        """Returns ``serializer`` (or a many serializer) pruned"""
+        fieldset = self.fieldset()
+        if fieldset is not None:
+            prune(getattr(serializer, 'child', serializer), fieldset)
+        return serializer
+
+    def sparse_queryset(self, queryset, serializer_class=None):
+        """Returns ``queryset`` pruned for ``serializer_class``'s output"""
+        if self.fieldset() is None:
+            return queryset
+        serializer = self.sparse_serializer(
+            (serializer_class or self.get_serializer_class())(
+                context=self.get_serializer_context()))
+        return prune_queryset(queryset, serializer)
+
+    def get_queryset(self):
+        return self.sparse_queryset(super().get_queryset())
+
+    def get_serializer(self, *args, **kwargs):
+        return self.sparse_serializer(
+            super().get_serializer(*args, **kwargs))
+
+
+class SparseDataMixin(object):
+    """Applies ``?fields=`` and ``?omit=`` to a viewset's plain data"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        fieldset = Fieldset.from_request(request)
+        if fieldset is not None and response.status_code == 200 and \
+                hasattr(response, 'data'):
+            data = response.data
+            if isinstance(data, dict) and isinstance(
+                    data.get('results'), list):
+                data = OrderedDict(data, results=trim(
+                    data['results'], fieldset))
+            else:
+                data = trim(data, fieldset)
+            response.data = data
+        return super().finalize_response(
+            request, response, *args, **kwargs)
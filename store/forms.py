@@ -1,5 +1,5 @@
 from django import forms
-from .models import Order
+from .models import Order, SKU
 
 
 class OrderForm(forms.ModelForm):
@@ -14,3 +14,29 @@ class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
         fields = ('id', 'status', 'contact', 'bill_to', 'ship_to',)
+
+
+class SKUForm(forms.ModelForm):
+    """ Form for SKUs, keeping the quantity it showed """
+
+    class Meta:
+        model = SKU
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Posted back, so the edit is told apart from checkouts since
+        self.fields['quantity'].show_hidden_initial = True
+
+    def quantity_change(self):
+        """Returns the quantity entered minus the quantity shown"""
+        field = self.fields['quantity']
+        shown = field.hidden_widget().value_from_datadict(
+            self.data, self.files, self.add_initial_prefix('quantity'))
+        try:
+            shown = field.to_python(shown)
+        except forms.ValidationError:
+            shown = None
+        if shown is None:
+            shown = self.initial.get('quantity') or 0
+        return self.cleaned_data['quantity'] - shown
@@ -0,0 +1,237 @@
+"""
+Pre-encoded JSON fragments of catalog rows.
+
+List and retrieve responses of SKUs, products and attributes are assembled
+from the JSON of each row, encoded once and kept in a per-process LRU cache
+bounded to ``STORE_FRAGMENT_CACHE_MAX_BYTES``. A response only serializes,
+with the fast serializers, the rows it has no fragment for, so a new filter
+combination over known rows costs the query selecting them.
+
+A fragment is keyed by its row's primary key and ``modified_timestamp``,
+with the ``modified_timestamp`` of the to-one rows it embeds (see
+``STAMPS``), all read by the query selecting the page. What the timestamps
+don't show, the attribute links, names and ordering embedded through to-many
+relations, is covered by a version token per fragment model (see
+``store.versions``): a change to a model in ``INDIRECT_DEPENDENCIES``
+replaces it in every worker once it commits (see ``store.signals``) and
+the older fragments age out of the LRU. Bulk writes skipping the signals or
+``modified_timestamp`` must call ``invalidate()`` themselves.
+
+Responses hold fragments as ``Encoded`` bytes, alone or in an
+``EncodedList``, which ``FragmentJSONRenderer`` writes out as they are.
+"""
+import json
+import threading
+from collections import Counter, OrderedDict
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from .models import Attribute, AttributeType, Product, SKU
+from . import versions
+
+# The values() columns a fragment of each model is keyed on
+STAMPS = {
+    SKU: ('modified_timestamp', 'product__modified_timestamp'),
+    Product: ('modified_timestamp',),
+    Attribute: ('modified_timestamp', 'type__modified_timestamp'),
+}
+
+# {fragment model: models embedded in its fragments without a timestamp}:
+# attribute names and their order by type name in SKUs, and the attributes
+# of the type in attributes
+INDIRECT_DEPENDENCIES = {
+    SKU: (Attribute, AttributeType),
+    Attribute: (Attribute,),
+}
+
+# Approximate bytes taken by the key and bookkeeping of an entry
+ENTRY_OVERHEAD = 200
+
+
+class Encoded(bytes):
+    """A value already encoded as JSON"""
+
+
+class EncodedList(list):
+    """A list of ``Encoded`` values"""
+
+
+def has_encoded(data):
+    if isinstance(data, (Encoded, EncodedList)):
+        return True
+    return isinstance(data, dict) and any(
+        has_encoded(value) for value in data.values())
+
+
+def decoded(data):
+    """Returns ``data`` with its encoded values decoded"""
+    if isinstance(data, Encoded):
+        return json.loads(data.decode('utf-8'), object_pairs_hook=OrderedDict)
+    if isinstance(data, EncodedList):
+        return [decoded(value) for value in data]
+    if isinstance(data, dict):
+        return OrderedDict(
+            (key, decoded(value)) for key, value in data.items())
+    return data
+
+
+class FragmentJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer writing out ``Encoded`` values as they are. Indented
+    output, e.g. for the browsable API, decodes them first.
+    """
+
+    def separators(self):
+        return (',', ':') if self.compact else (', ', ': ')
+
+    def dumps(self, data):
+        """Returns ``data`` encoded like JSONRenderer does, unindented"""
+        ret = json.dumps(
+            data, cls=self.encoder_class, ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict, separators=self.separators())
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode('utf-8')
+
+    def encode(self, data):
+        if isinstance(data, Encoded):
+            return bytes(data)
+        item_separator, key_separator = [
+            separator.encode('utf-8') for separator in self.separators()]
+        if isinstance(data, EncodedList):
+            return b'[' + item_separator.join(data) + b']'
+        if isinstance(data, dict) and has_encoded(data):
+            return b'{' + item_separator.join(
+                self.dumps(str(key)) + key_separator + self.encode(value)
+                for key, value in data.items()) + b'}'
+        return self.dumps(data)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not has_encoded(data):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        if self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None:
+            return super().render(
+                decoded(data), accepted_media_type, renderer_context)
+        return self.encode(data)
+
+
+class FragmentCache(object):
+    """LRU cache of encoded rows with per-process hit/miss counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+        self._hits = Counter()
+        self._misses = Counter()
+
+    @property
+    def max_bytes(self):
+        return getattr(
+            settings, 'STORE_FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+
+    def version_name(self, model):
+        return 'fragments:%s' % model._meta.model_name
+
+    def generation(self, model):
+        return versions.get(self.version_name(model))
+
+    def invalidate(self, model):
+        """Orphans every fragment of ``model``, in every worker, on commit"""
+        versions.bump(self.version_name(model))
+
+    def invalidate_model(self, changed):
+        """Orphans the fragments embedding ``changed`` without a timestamp"""
+        for model, dependencies in INDIRECT_DEPENDENCIES.items():
+            if changed in dependencies:
+                self.invalidate(model)
+
+    def get_many(self, name, keys):
+        """Returns ``{key: fragment}`` of the cached ``keys``"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                fragment = self._entries.get(key)
+                if fragment is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = fragment
+            self._hits[name] += len(found)
+            self._misses[name] += len(keys) - len(found)
+        return found
+
+    def set_many(self, fragments):
+        """Stores ``{key: fragment}``, evicting the least recently used"""
+        max_bytes = self.max_bytes
+        with self._lock:
+            for key, fragment in fragments.items():
+                size = len(fragment) + ENTRY_OVERHEAD
+                if size > max_bytes:
+                    continue
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self._bytes -= len(previous) + ENTRY_OVERHEAD
+                self._entries[key] = fragment
+                self._bytes += size
+            while self._bytes > max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted) + ENTRY_OVERHEAD
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns the counters and size of this process' cache"""
+        with self._lock:
+            stats = {
+                model._meta.model_name: {
+                    'hits': self._hits[model._meta.model_name],
+                    'misses': self._misses[model._meta.model_name],
+                }
+                for model in STAMPS
+            }
+            for counters in stats.values():
+                lookups = counters['hits'] + counters['misses']
+                counters['hit_rate'] = (
+                    counters['hits'] / lookups if lookups else None)
+            stats.update(
+                entries=len(self._entries), bytes=self._bytes,
+                max_bytes=self.max_bytes, evictions=self._evictions)
+            return stats
+
+    def fragments(self, fast_serializer, rows):
+        """
+        Returns the fragments of ``rows`` (``values()`` rows with ``pk`` and
+        the ``STAMPS`` columns), encoding and storing the missing ones with
+        ``fast_serializer``. Rows deleted meanwhile are left out.
+        """
+        model = fast_serializer.model
+        name = model._meta.model_name
+        # Fragments hold absolute URLs
+        prefix = (
+            name, self.generation(model),
+            fast_serializer.request.build_absolute_uri('/'))
+        keys = OrderedDict(
+            (row['pk'], prefix + (row['pk'],) + tuple(
+                row[column] for column in STAMPS[model]))
+            for row in rows)
+        found = self.get_many(name, list(keys.values()))
+
+        missing = [pk for pk, key in keys.items() if key not in found]
+        if missing:
+            renderer = FragmentJSONRenderer()
+            encoded = {
+                keys[representation['id']]: Encoded(
+                    renderer.dumps(representation))
+                for representation in fast_serializer.serialize(missing)
+            }
+            self.set_many(encoded)
+            found.update(encoded)
+        return EncodedList(
+            found[key] for key in keys.values() if key in found)
+
+
+fragment_cache = FragmentCache()
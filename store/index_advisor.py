@@ -0,0 +1,221 @@
+"""
+Index advisor.
+
+Collects the SELECT statements a workload runs, reads their query plans
+and looks for full table scans and temporary B-trees (sorts and groupings
+the database can't read from an index). For each such table it proposes a
+composite index: the columns compared with ``=`` or ``IN`` first, then the
+ORDER BY columns when they all belong to the table, otherwise the first
+range-compared column. A proposal is kept only if creating it actually
+changes the plan; it is tried inside a transaction that is rolled back.
+
+Plans are read with SQLite's ``EXPLAIN QUERY PLAN``, which has no cost
+estimate, so the before/after cost reported is the measured execution time
+of the statement.
+"""
+import re
+import time
+from collections import OrderedDict
+from django.apps import apps
+from django.db import connection, models, transaction
+
+# "table"."column" followed by the comparison it's used in
+COMPARISON = re.compile(
+    r'"(\w+)"\."(\w+)" (=|IN|<=|>=|<|>|LIKE|IS)[ (]')
+COLUMN = re.compile(r'"(\w+)"\."(\w+)"')
+CLAUSE_END = re.compile(r' (?:GROUP BY|ORDER BY|LIMIT|HAVING) ')
+
+
+class Rollback(Exception):
+    """Raised to drop the indexes created to try a proposal"""
+
+
+class QueryCollector(object):
+    """Database execute wrapper collecting distinct SELECT statements"""
+
+    def __init__(self):
+        self.statements = OrderedDict()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.statements.setdefault(sql, params)
+        return execute(sql, params, many, context)
+
+
+def query_plan(sql, params):
+    """Returns the plan steps of ``sql`` as a list of strings"""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+# A step reading every row of a table
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+
+
+def plan_problems(plan):
+    """Returns the full scans and temp B-trees of ``plan``"""
+    return [
+        step for step in plan
+        if FULL_SCAN.match(step) or 'TEMP B-TREE' in step
+    ]
+
+
+def execution_ms(sql, params, repeat=3):
+    """Returns the best of ``repeat`` runs of ``sql`` in milliseconds"""
+    timings = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def models_by_table():
+    return {model._meta.db_table: model for model in apps.get_models()}
+
+
+def table_aliases(sql):
+    """Returns ``{alias: table}`` of the subquery aliases (U0, T3...)"""
+    return dict(
+        (alias, table)
+        for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql))
+
+
+def order_by_columns(sql):
+    """Returns ``(table, column)`` of the outermost ORDER BY"""
+    if ' ORDER BY ' not in sql:
+        return []
+    aliases = table_aliases(sql)
+    clause = sql.rsplit(' ORDER BY ', 1)[1].split(' LIMIT ', 1)[0]
+    return [
+        (aliases.get(table, table), column)
+        for table, column in COLUMN.findall(clause)
+    ]
+
+
+def problem_tables(sql, plan):
+    """Returns the tables ``plan`` fully scans or sorts"""
+    tables = set()
+    for step in plan_problems(plan):
+        match = FULL_SCAN.match(step)
+        if match:
+            tables.add(match.group(1))
+        elif 'FOR ORDER BY' in step:
+            tables.update(table for table, column in order_by_columns(sql))
+    return tables
+
+
+def candidate_columns(sql, table):
+    """Returns the columns of ``table`` an index for ``sql`` should cover"""
+    where = ''
+    if ' WHERE ' in sql:
+        where = CLAUSE_END.split(sql.split(' WHERE ', 1)[1], 1)[0]
+
+    aliases = table_aliases(sql)
+    equality, ranges = [], []
+    for comparison_table, column, operator in COMPARISON.findall(where):
+        if aliases.get(comparison_table, comparison_table) != table:
+            continue
+        target = equality if operator in ('=', 'IN', 'IS') else ranges
+        if column not in equality and column not in target:
+            target.append(column)
+
+    order_by = order_by_columns(sql)
+    columns = list(equality)
+    if order_by and all(
+            order_table == table for order_table, column in order_by):
+        columns.extend(
+            column for order_table, column in order_by
+            if column not in columns)
+    elif ranges:
+        columns.append(ranges[0])
+    return columns
+
+
+def existing_indexes(table):
+    """Returns the column lists of the indexes on ``table``"""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [
+        constraint['columns'] for constraint in constraints.values()
+        if constraint['index'] or constraint['primary_key']
+    ]
+
+
+def proposals_for(sql, plan, tables=None):
+    """Returns the ``(model, models.Index)`` proposals for one statement"""
+    tables = tables or models_by_table()
+    proposals = []
+    for table in sorted(problem_tables(sql, plan)):
+        model = tables.get(table)
+        if model is None:
+            continue
+
+        field_names = {
+            field.column: field.name for field in model._meta.concrete_fields
+        }
+        columns = [
+            column for column in candidate_columns(sql, table)
+            if column in field_names
+        ]
+        if not columns or columns in existing_indexes(table):
+            continue
+
+        index = models.Index(
+            fields=[field_names[column] for column in columns])
+        index.set_name_with_model(model)
+        proposals.append((model, index))
+    return proposals
+
+
+def try_indexes(proposals, sql, params):
+    """
+    Returns the plan and execution time of ``sql`` with the ``proposals``
+    created; the indexes are dropped afterwards.
+    """
+    schema_editor = connection.schema_editor()
+    result = {}
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model, index in proposals:
+                    cursor.execute(str(index.create_sql(model, schema_editor)))
+            result['plan'] = query_plan(sql, params)
+            result['ms'] = execution_ms(sql, params)
+            raise Rollback()
+    except Rollback:
+        return result
+
+
+def advise(statements):
+    """
+    Returns a report for each of ``statements`` (``{sql: params}``) with
+    plan problems, with the proposals that fix them.
+    """
+    tables = models_by_table()
+    reports = []
+    for sql, params in statements.items():
+        plan = query_plan(sql, params)
+        if not plan_problems(plan):
+            continue
+
+        report = {
+            'sql': sql,
+            'plan': plan,
+            'problems': plan_problems(plan),
+            'ms': execution_ms(sql, params),
+            'proposals': [],
+        }
+        proposals = proposals_for(sql, plan, tables)
+        if proposals:
+            after = try_indexes(proposals, sql, params)
+            # Only indexes the planner picks up are worth proposing
+            if after['plan'] != plan:
+                report['proposals'] = proposals
+                report['plan_after'] = after['plan']
+                report['ms_after'] = after['ms']
+        reports.append(report)
+    return reports
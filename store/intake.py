@@ -0,0 +1,179 @@
+"""
+Asynchronous order intake.
+
+With ``STORE_ASYNC_ORDER_INTAKE`` on, POST /api/orders/ only validates the
+request and appends it to the OrderIntake table, which serves as a durable
+local queue, then answers ``202 Accepted`` with a handle to poll at
+/api/order_intake/<handle>/. Workers (``process_order_intake``) drain the
+queue in batches:
+
+1. A batch of queued requests is claimed with an UPDATE that only matches
+   unclaimed requests, so concurrent workers never pick the same request.
+2. The batch is processed in one transaction, every request in its own
+   savepoint. A request creates its order through OrderSerializer, with
+   the same stock reservation as a synchronous checkout, and ends up DONE.
+   If validation fails, for example on stock, it ends up FAILED with the
+   errors; so does a request failing any other way, logged to the
+   ``store.intake`` logger, without taking the rest of the batch with it.
+3. The request is marked DONE or FAILED in the same transaction that
+   creates its order, so a worker dying mid-batch creates no orders. Its
+   claim expires after ``STORE_ORDER_INTAKE_CLAIM_TIMEOUT`` seconds and the
+   requests are queued again, up to ``STORE_ORDER_INTAKE_MAX_ATTEMPTS``
+   claims; a request still unfinished then ends up FAILED.
+
+An order taken in starts in the status of a synchronous checkout's; until
+it exists, the status of its OrderIntake tells the client where the
+request is.
+"""
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import (
+    OperationalError, close_old_connections, connection, transaction)
+from django.utils import timezone
+from rest_framework import serializers
+from .models import *
+from .serializers import OrderSerializer
+
+logger = logging.getLogger('store.intake')
+
+# Errors of a request that failed other than on validation
+UNPROCESSABLE = {'non_field_errors': ['The order could not be processed.']}
+
+
+def enqueue(data):
+    """Appends an order request to the queue, returns its OrderIntake"""
+    return OrderIntake.objects.create(payload=json.dumps(data))
+
+
+def worker_name():
+    return 'worker-%d' % os.getpid()
+
+
+def claim(worker, batch_size):
+    """
+    Marks up to ``batch_size`` queued (or expired) requests as PROCESSING
+    by ``worker`` and returns them, oldest first.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=getattr(
+        settings, 'STORE_ORDER_INTAKE_CLAIM_TIMEOUT', 300))
+    max_attempts = getattr(settings, 'STORE_ORDER_INTAKE_MAX_ATTEMPTS', 3)
+    # Requests whose workers kept dying on them aren't claimed again
+    OrderIntake.objects.filter(
+        status=OrderIntake.PROCESSING, claimed_timestamp__lt=expired,
+        attempts__gte=max_attempts
+    ).update(
+        status=OrderIntake.FAILED, modified_timestamp=now,
+        errors=json.dumps(UNPROCESSABLE))
+    claimable = OrderIntake.objects.filter(
+        models.Q(status=OrderIntake.QUEUED) |
+        models.Q(status=OrderIntake.PROCESSING,
+                 claimed_timestamp__lt=expired))
+    while True:
+        ids = claimable.order_by('id').values('id')[:batch_size]
+        if not connection.features.allow_sliced_subqueries:
+            ids = list(ids)
+        # The claimable condition leaves out requests another worker
+        # claimed since they were selected
+        claimed = claimable.filter(pk__in=ids).update(
+            status=OrderIntake.PROCESSING, claimed_by=worker,
+            claimed_timestamp=now, attempts=models.F('attempts') + 1,
+            modified_timestamp=now)
+        if claimed:
+            break
+        if not claimable.exists():
+            return []
+    return list(OrderIntake.objects.filter(
+        status=OrderIntake.PROCESSING, claimed_by=worker,
+        claimed_timestamp=now
+    ).order_by('id'))
+
+
+def process_one(intake):
+    """Creates the order of one claimed request, or records its errors"""
+    serializer = OrderSerializer(data=json.loads(intake.payload))
+    try:
+        with transaction.atomic():
+            serializer.is_valid(raise_exception=True)
+            intake.order_id = serializer.save().pk
+    except serializers.ValidationError as exc:
+        intake.status = OrderIntake.FAILED
+        intake.errors = json.dumps(exc.detail)
+    except OperationalError:
+        # The database rather than the request, the batch is retried
+        raise
+    except Exception:
+        logger.exception('Order intake %s failed', intake.handle)
+        intake.status = OrderIntake.FAILED
+        intake.errors = json.dumps(UNPROCESSABLE)
+    else:
+        intake.status = OrderIntake.DONE
+    intake.save(update_fields=(
+        'status', 'order_id', 'errors', 'modified_timestamp'))
+
+
+def process(intakes):
+    """Processes claimed requests in one transaction"""
+    with transaction.atomic():
+        # Writing first takes the write lock up front; on SQLite a
+        # transaction that read first can't wait for it to be released
+        OrderIntake.objects.filter(
+            pk__in=[intake.pk for intake in intakes]
+        ).update(modified_timestamp=timezone.now())
+        for intake in intakes:
+            process_one(intake)
+
+
+def retry_locked(func, *args, attempts=5):
+    """
+    Calls ``func``, retrying with a growing delay while another worker
+    holds the database write lock (SQLite allows a single writer).
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except OperationalError as exc:
+            if 'locked' not in str(exc) or attempt == attempts - 1:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def drain(worker=None, batch_size=None):
+    """
+    Processes queued requests until the queue is empty, returns how many
+    were processed.
+    """
+    worker = worker or worker_name()
+    batch_size = batch_size or getattr(
+        settings, 'STORE_ORDER_INTAKE_BATCH_SIZE', 50)
+
+    processed = 0
+    while True:
+        intakes = retry_locked(claim, worker, batch_size)
+        if not intakes:
+            return processed
+        retry_locked(process, intakes)
+        processed += len(intakes)
+
+
+def run_worker(batch_size=None, poll_interval=1.0, once=False):
+    """Worker loop: drains the queue, then polls it for new requests"""
+    worker = worker_name()
+    while True:
+        close_old_connections()
+        try:
+            drain(worker, batch_size)
+        except OperationalError:
+            # The database stayed locked, claimed requests are processed
+            # again once their claim expires
+            pass
+        except Exception:
+            # Likewise, until they run out of attempts
+            logger.exception('Order intake batch failed')
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,296 @@
+"""
+Inventory reservation for order intake, and the inventory ledger.
+
+Stock is decremented by the database itself with a guarded ``UPDATE``, so
+concurrent checkouts can never oversell a SKU or drive ``SKU.quantity``
+below zero. Every change to the stock is recorded as an
+``InventoryMovement``: receipts and adjustments (``adjust()``), sales
+(``record_sale()``) and refunds (``refund()``, posted when an order becomes
+``Order.REFUNDED``, see ``store.signals``).
+
+All checkouts of a popular SKU update the same row and queue on its lock.
+A SKU with ``inventory_shards`` set spreads its stock over that many
+``InventoryShard`` rows instead: a sale takes from a random shard, then
+from any shard holding enough, then from the SKU row, so concurrent
+checkouts mostly lock different rows. ``compact()`` (run periodically by
+the ``compact_inventory`` command) folds the shards back into
+``SKU.quantity`` and deals the stock out to them again. The stock
+available is ``SKU.quantity`` plus the SKU's shards, read by
+``available()`` (or annotated by ``with_available()``) from a handful of
+rows whatever the length of the ledger.
+"""
+import random
+from collections import OrderedDict
+from django.db import connection, transaction
+from django.db.models import (
+    Case, F, IntegerField, OuterRef, Q, Subquery, Sum, When)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers
+from .models import InventoryMovement, InventoryShard, SKU
+
+
+class InsufficientStock(serializers.ValidationError):
+    """Raised when at least one line of an order can't be reserved"""
+
+    default_code = 'insufficient_stock'
+
+    def __init__(self, shortages):
+        # shortages: {sku_id: (requested, available)}
+        self.shortages = shortages
+        messages = [
+            _("Insufficient stock for SKU %(sku)s: requested %(requested)d, "
+              "available %(available)d.") % {
+                'sku': sku_id,
+                'requested': requested,
+                'available': available
+            }
+            for sku_id, (requested, available) in shortages.items()
+        ]
+        super().__init__({'order_line_set': messages})
+
+
+class _Shortfall(Exception):
+    """Internal marker used to roll back a partial reservation"""
+
+
+def aggregate_demand(lines):
+    """
+    Returns an ordered mapping of sku id to total requested quantity.
+
+    ``lines`` is an iterable of ``(sku, quantity)`` pairs where ``sku`` is
+    either a SKU instance or its primary key. SKUs are sorted by id so
+    that every order locks rows in the same sequence.
+    """
+    demand = {}
+    for sku, quantity in lines:
+        sku_id = getattr(sku, 'pk', sku)
+        demand[sku_id] = demand.get(sku_id, 0) + quantity
+
+    return OrderedDict(sorted(demand.items()))
+
+
+def shard_counts(lines):
+    """Returns ``{sku id: inventory_shards}`` of the SKUs of ``lines``"""
+    counts = {}
+    missing = []
+    for sku, quantity in lines:
+        if isinstance(sku, SKU):
+            counts[sku.pk] = sku.inventory_shards
+        else:
+            missing.append(sku)
+    if missing:
+        counts.update(SKU.objects.filter(pk__in=missing).values_list(
+            'pk', 'inventory_shards'))
+    return counts
+
+
+def with_available(queryset):
+    """Annotates the SKUs of ``queryset`` with their ``available`` stock"""
+    # A subquery rather than a join, the queryset may join to-many rows
+    shards = InventoryShard.objects.filter(
+        sku=OuterRef('pk')
+    ).order_by().values('sku').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    return queryset.annotate(available=F('quantity') + Coalesce(
+        Subquery(shards, output_field=IntegerField()), 0))
+
+
+def available(sku_ids):
+    """Returns ``{sku id: stock available}``, shards included"""
+    return dict(with_available(SKU.objects.filter(
+        pk__in=sku_ids)).values_list('pk', 'available'))
+
+
+def take(sku_id, quantity, shards):
+    """
+    Takes ``quantity`` from the shards or the row of a sharded SKU.
+    Returns whether there was enough.
+    """
+    # The first shard holding enough, starting from a random one
+    start = random.randrange(shards)
+    rows = InventoryShard.objects.filter(
+        sku_id=sku_id, quantity__gte=quantity
+    ).order_by(Case(
+        When(index__gte=start, then=F('index') - start),
+        default=F('index') + shards - start))
+    if connection.features.allow_sliced_subqueries:
+        shard = rows.values('pk')[:1]
+    else:
+        shard = list(rows.values_list('pk', flat=True)[:1])
+    decrement = {'quantity': F('quantity') - quantity}
+    if InventoryShard.objects.filter(pk__in=shard).update(**decrement):
+        return True
+    sku = SKU.objects.filter(pk=sku_id, quantity__gte=quantity)
+    if sku.update(**decrement):
+        return True
+
+    # Enough stock may be spread thinner than ``quantity`` over the shards
+    fold(sku_id)
+    return bool(sku.update(**decrement))
+
+
+def reserve(lines):
+    """
+    Atomically decrement stock for all lines of an order.
+
+    Either every line is reserved or none is: a shortfall on any SKU rolls
+    back the whole statement and raises ``InsufficientStock``.
+    """
+    lines = list(lines)
+    demand = aggregate_demand(lines)
+    if not demand:
+        return demand
+    shards = shard_counts(lines)
+
+    # Only rows that still hold enough stock match the guard
+    guard = Q()
+    decrement = []
+    for sku_id, quantity in demand.items():
+        if not shards.get(sku_id):
+            guard |= Q(pk=sku_id, quantity__gte=quantity)
+            decrement.append(When(pk=sku_id, then=F('quantity') - quantity))
+
+    try:
+        with transaction.atomic():
+            if decrement:
+                updated = SKU.objects.filter(guard).update(
+                    quantity=Case(*decrement, default=F('quantity')),
+                    modified_timestamp=timezone.now())
+
+                if updated != len(decrement):
+                    raise _Shortfall()
+
+            for sku_id, quantity in demand.items():
+                if shards.get(sku_id) and not take(
+                        sku_id, quantity, shards[sku_id]):
+                    raise _Shortfall()
+    except _Shortfall:
+        stock = available(demand)
+        raise InsufficientStock(OrderedDict(
+            (sku_id, (quantity, stock.get(sku_id, 0)))
+            for sku_id, quantity in demand.items()
+            if stock.get(sku_id, 0) < quantity
+        ))
+
+    return demand
+
+
+def record_sale(order, demand):
+    """Records the stock ``reserve()`` took for ``order``"""
+    InventoryMovement.objects.bulk_create(
+        InventoryMovement(
+            sku_id=sku_id, kind=InventoryMovement.SALE, quantity=-quantity,
+            order_id=order.pk)
+        for sku_id, quantity in demand.items())
+
+
+def refund(order):
+    """
+    Puts back the stock an order took, recording REFUND movements. Only
+    what the order's movements haven't already put back is refunded;
+    orders sold before the ledger existed refund their lines.
+    """
+    net = dict(InventoryMovement.objects.filter(
+        order_id=order.pk
+    ).values('sku_id').annotate(
+        quantity=Sum('quantity')
+    ).order_by().values_list('sku_id', 'quantity'))
+    if not net:
+        net = aggregate_demand(
+            (line.sku_id, -line.quantity)
+            for line in order.order_line_set.all())
+    restock = OrderedDict(
+        (sku_id, -quantity) for sku_id, quantity in sorted(net.items())
+        if quantity < 0)
+    if not restock:
+        return restock
+
+    with transaction.atomic():
+        SKU.objects.filter(pk__in=restock).update(
+            quantity=Case(
+                *[When(pk=sku_id, then=F('quantity') + quantity)
+                  for sku_id, quantity in restock.items()],
+                default=F('quantity')),
+            modified_timestamp=timezone.now())
+        InventoryMovement.objects.bulk_create(
+            InventoryMovement(
+                sku_id=sku_id, kind=InventoryMovement.REFUND,
+                quantity=quantity, order_id=order.pk)
+            for sku_id, quantity in restock.items())
+    return restock
+
+
+def adjust(sku_id, quantity, kind=InventoryMovement.ADJUSTMENT):
+    """
+    Adds ``quantity`` (negative to remove stock) to a SKU and records it.
+    Raises ``InsufficientStock`` rather than going below zero.
+    """
+    with transaction.atomic():
+        if quantity < 0:
+            fold(sku_id)
+        updated = SKU.objects.filter(
+            pk=sku_id, quantity__gte=max(-quantity, 0)
+        ).update(
+            quantity=F('quantity') + quantity,
+            modified_timestamp=timezone.now())
+        if not updated:
+            raise InsufficientStock({sku_id: (
+                -quantity, available([sku_id]).get(sku_id, 0))})
+        return InventoryMovement.objects.create(
+            sku_id=sku_id, kind=kind, quantity=quantity)
+
+
+def fold(sku_id):
+    """
+    Moves the stock of a SKU's shards back into ``SKU.quantity``, in the
+    caller's transaction. Returns the quantity moved.
+    """
+    # Write first: it locks the SKU row, and on SQLite the database,
+    # before the shards are read
+    SKU.objects.filter(pk=sku_id).update(modified_timestamp=timezone.now())
+    shards = list(InventoryShard.objects.select_for_update().filter(
+        sku_id=sku_id, quantity__gt=0).values_list('pk', 'quantity'))
+    total = sum(quantity for pk, quantity in shards)
+    if total:
+        InventoryShard.objects.filter(
+            pk__in=[pk for pk, quantity in shards]).update(quantity=0)
+        SKU.objects.filter(pk=sku_id).update(
+            quantity=F('quantity') + total)
+    return total
+
+
+def compact(sku_ids=None):
+    """
+    Folds the shards of every sharded SKU (or of ``sku_ids``) back into
+    ``SKU.quantity`` and deals the stock out evenly to its shards again,
+    one transaction per SKU. Returns the number of SKUs compacted.
+    """
+    skus = SKU.objects.filter(
+        Q(inventory_shards__gt=0) | Q(inventory_shard_set__isnull=False)
+    ).distinct()
+    if sku_ids is not None:
+        skus = skus.filter(pk__in=sku_ids)
+
+    compacted = 0
+    for sku_id, shards in skus.values_list('pk', 'inventory_shards'):
+        with transaction.atomic():
+            fold(sku_id)
+            InventoryShard.objects.filter(
+                sku_id=sku_id, index__gte=shards).delete()
+            stock = SKU.objects.values_list(
+                'quantity', flat=True).get(pk=sku_id)
+            share = stock // shards if shards else 0
+            existing = set(InventoryShard.objects.filter(
+                sku_id=sku_id).values_list('index', flat=True))
+            InventoryShard.objects.filter(sku_id=sku_id).update(
+                quantity=share)
+            InventoryShard.objects.bulk_create(
+                InventoryShard(sku_id=sku_id, index=index, quantity=share)
+                for index in range(shards) if index not in existing)
+            SKU.objects.filter(pk=sku_id).update(
+                quantity=F('quantity') - share * shards)
+        compacted += 1
+    return compacted
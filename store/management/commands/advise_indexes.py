@@ -0,0 +1,141 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations import Migration
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.operations import AddIndex
+from django.db.migrations.writer import MigrationWriter
+from django.test import override_settings
+from store import index_advisor
+from store.cache import response_cache
+from .benchmark_store import Command as BenchmarkCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a request workload, finds statements whose query plan "
+        "scans a whole table or sorts in a temporary B-tree, and proposes "
+        "the indexes that fix them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            help="File of captured requests, one JSON object per line with "
+                 "'method', 'path' and optional 'data'. Defaults to the "
+                 "benchmark_store workload.")
+        parser.add_argument(
+            '--page-size', type=int, default=50,
+            help="page_size of the benchmark_store list requests")
+        parser.add_argument(
+            '--json', action='store_true',
+            help="Print the report as JSON")
+        parser.add_argument(
+            '--write-migration', action='store_true',
+            help="Write the proposed indexes as a store migration")
+
+    def handle(self, *args, **options):
+        benchmark = BenchmarkCommand()
+        if options['requests']:
+            workload = self.load_requests(options['requests'])
+        else:
+            workload = [
+                (method, url, data) for name, method, url, data
+                in benchmark.cases(options['page_size'])]
+
+        collector = index_advisor.QueryCollector()
+        # Requests come from the test client's 'testserver' host
+        with override_settings(ALLOWED_HOSTS=['*']), \
+                connection.execute_wrapper(collector):
+            for method, url, data in workload:
+                response_cache.cache.clear()
+                benchmark.request(method, url, data)
+
+        reports = index_advisor.advise(collector.statements)
+        proposals = self.unique_proposals(reports)
+        if options['json']:
+            self.stdout.write(json.dumps(
+                [self.as_json(report) for report in reports], indent=2))
+        else:
+            self.print_reports(len(collector.statements), reports, proposals)
+
+        if options['write_migration'] and proposals:
+            self.write_migration(proposals)
+
+    def load_requests(self, path):
+        workload = []
+        with open(path) as requests_file:
+            for line in requests_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                method = request.get('method', 'GET').lower()
+                if method not in ('get', 'post'):
+                    raise CommandError(
+                        "Only GET and POST requests can be replayed.")
+                workload.append(
+                    (method, request['path'], request.get('data', {})))
+        return workload
+
+    def unique_proposals(self, reports):
+        """Returns the proposed (model, index) pairs without repeats"""
+        proposals = {}
+        for report in reports:
+            for model, index in report['proposals']:
+                proposals.setdefault((model, tuple(index.fields)),
+                                     (model, index))
+        return list(proposals.values())
+
+    def as_json(self, report):
+        report = dict(report)
+        report['proposals'] = [
+            {'model': model.__name__, 'fields': index.fields,
+             'name': index.name}
+            for model, index in report['proposals']
+        ]
+        return report
+
+    def print_reports(self, statements, reports, proposals):
+        self.stdout.write(
+            "%d distinct statements, %d with plan problems.\n" % (
+                statements, len(reports)))
+        for report in reports:
+            self.stdout.write(report['sql'][:300])
+            for step in report['plan']:
+                self.stdout.write("    before: %s" % step)
+            for step in report.get('plan_after', []):
+                self.stdout.write("    after:  %s" % step)
+            if report['proposals']:
+                self.stdout.write("    %.2f ms -> %.2f ms with %s" % (
+                    report['ms'], report['ms_after'], ', '.join(
+                        '%s(%s)' % (model.__name__, ', '.join(index.fields))
+                        for model, index in report['proposals'])))
+            else:
+                self.stdout.write(
+                    "    %.2f ms, no index changes the plan" % report['ms'])
+            self.stdout.write('')
+
+        if not proposals:
+            self.stdout.write("No indexes to propose.")
+            return
+        self.stdout.write("Proposed indexes, add them to Meta.indexes:")
+        for model, index in proposals:
+            self.stdout.write("    %s: models.Index(fields=%r)" % (
+                model.__name__, index.fields))
+
+    def write_migration(self, proposals):
+        """Writes a store migration adding the proposed indexes"""
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        leaf_nodes = loader.graph.leaf_nodes('store')
+        number = max(
+            int(name.split('_', 1)[0]) for app_label, name in leaf_nodes)
+
+        migration = Migration('%04d_advised_indexes' % (number + 1), 'store')
+        migration.dependencies = leaf_nodes
+        migration.operations = [
+            AddIndex(model_name=model._meta.model_name, index=index)
+            for model, index in proposals
+        ]
+        writer = MigrationWriter(migration)
+        with open(writer.path, 'w') as migration_file:
+            migration_file.write(writer.as_string())
+        self.stdout.write("Wrote %s." % writer.path)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from store import archive
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves completed, cancelled and refunded orders older than "
+        "STORE_ORDER_ARCHIVE_AFTER_DAYS to the order archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help="Archive orders older than this many days instead")
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Orders moved per transaction")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only count the orders that would be archived")
+
+    def handle(self, *args, **options):
+        before = archive.cutoff(options['days'])
+        if options['dry_run']:
+            count = Order.objects.filter(
+                status__in=archive.ARCHIVABLE_STATUSES,
+                created_timestamp__lt=before).count()
+            self.stdout.write(
+                "%d orders created before %s would be archived." % (
+                    count, before.isoformat()))
+            return
+
+        count = archive.archive_orders(before, options['batch_size'])
+        self.stdout.write("Archived %d orders created before %s." % (
+            count, before.isoformat()))
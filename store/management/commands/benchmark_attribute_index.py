@@ -0,0 +1,145 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.attribute_index import AttributeIndex
+from store.models import *
+from store.views import M2MFilter
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic catalog"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares multi-attribute SKU filtering through the in-memory "
+        "attribute index with the join based filter. Synthetic catalogs are "
+        "created inside a transaction that is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10000,100000,1000000',
+            help="Comma separated SKU counts to benchmark")
+        parser.add_argument(
+            '--attribute-types', type=int, default=5,
+            help="Number of attribute types, each SKU gets one of each")
+        parser.add_argument(
+            '--values', type=int, default=8,
+            help="Number of attributes per attribute type")
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Runs per query, the best one is reported")
+        parser.add_argument(
+            '--json', action='store_true',
+            help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        results = []
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            try:
+                with transaction.atomic():
+                    results.extend(self.run(size, options))
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("%10s %6s %12s %12s %8s %s" % (
+            'skus', 'facets', 'join (ms)', 'index (ms)', 'matches', ''))
+        for result in results:
+            self.stdout.write("%10d %6d %12.2f %12.2f %8d %s" % (
+                result['skus'], result['facets'], result['join_ms'],
+                result['index_ms'], result['matches'],
+                '(join fallback)' if result['fallback'] else ''))
+
+    def populate(self, size, options):
+        """Creates ``size`` SKUs with one attribute of every type"""
+        category = ProductCategory.objects.create(
+            name='benchmark', description='benchmark')
+        product = Product.objects.create(
+            name='benchmark', description='benchmark',
+            manufacturer='benchmark', category=category)
+
+        attributes = []
+        for type_number in range(options['attribute_types']):
+            attribute_type = AttributeType.objects.create(
+                name='type-%d' % type_number, description='benchmark')
+            attributes.append([
+                Attribute.objects.create(
+                    type=attribute_type, name='value-%d' % value_number)
+                for value_number in range(options['values'])
+            ])
+
+        Through = SKU.attributes.through
+        rng = random.Random(size)
+        batch_size = 5000
+        for start in range(0, size, batch_size):
+            skus = SKU.objects.bulk_create(
+                SKU(number='BENCH-%08d' % number, product=product,
+                    price=0, currency='BTC', quantity=1)
+                for number in range(start, min(start + batch_size, size)))
+            if not skus[0].pk:
+                # Backends that don't return ids from bulk inserts
+                skus = SKU.objects.filter(
+                    number__range=(skus[0].number, skus[-1].number))
+            Through.objects.bulk_create(
+                Through(sku_id=sku.pk, attribute_id=rng.choice(values).pk)
+                for sku in skus
+                for values in attributes)
+
+        return attributes
+
+    def best_of(self, repeat, function):
+        """Returns the best run time in ms and the last result"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings), result
+
+    def run(self, size, options):
+        self.stderr.write("Populating %d SKUs..." % size)
+        attributes = self.populate(size, options)
+        queryset = SKU.objects.order_by('number')
+
+        index = AttributeIndex()
+        build_ms, _ = self.best_of(1, lambda: index.bitmaps)
+        self.stderr.write("Index built in %.2f ms" % build_ms)
+
+        results = []
+        for facets in range(1, len(attributes) + 1):
+            attribute_ids = [values[0].pk for values in attributes[:facets]]
+            value = ','.join(str(pk) for pk in attribute_ids)
+
+            join_ms, join_page = self.best_of(
+                options['repeat'],
+                lambda: list(M2MFilter(name='attributes').filter(
+                    queryset, value).values_list('pk', flat=True)[:50]))
+
+            def indexed():
+                sku_ids = index.sku_ids(attribute_ids)
+                filtered = (
+                    M2MFilter(name='attributes').filter(queryset, value)
+                    if sku_ids is None else queryset.filter(pk__in=sku_ids))
+                return list(filtered.values_list('pk', flat=True)[:50])
+
+            index_ms, index_page = self.best_of(options['repeat'], indexed)
+            assert join_page == index_page
+
+            results.append({
+                'skus': size,
+                'facets': facets,
+                'join_ms': join_ms,
+                'index_ms': index_ms,
+                'index_build_ms': build_ms,
+                'matches': bin(index.intersect(attribute_ids)).count('1'),
+                'fallback': index.sku_ids(attribute_ids) is None,
+            })
+
+        return results
@@ -0,0 +1,179 @@
+import json
+import random
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import override_settings
+from store.models import *
+
+# SQLite's own defaults, with Python's 5 second lock timeout, and a new
+# connection per request: what the store ran with before
+# STORE_DB_PROFILES
+BASELINE = {
+    'sqlite': {
+        'journal_mode': 'delete',
+        'synchronous': 'full',
+        'busy_timeout': 5000,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'default',
+    },
+}
+
+# Settings deployments opt in to on top of STORE_DB_PROFILES, benchmarked
+# with it
+OPT_IN = {
+    'sqlite': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the read and write throughput of concurrent workers with "
+        "the default connection settings and with STORE_DB_PROFILES, WAL "
+        "journaling included. Writes reserve one unit of a SKU and release "
+        "it again, so the stock is unchanged. Run generate_store_data "
+        "first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', default='1,4,16',
+            help="Comma separated numbers of concurrent workers")
+        parser.add_argument(
+            '--seconds', type=float, default=5,
+            help="Duration of every run")
+        parser.add_argument(
+            '--write-share', type=float, default=0.2,
+            help="Share of the requests that write")
+        parser.add_argument(
+            '--json', action='store_true',
+            help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        self.sku_ids = list(SKU.objects.values_list('pk', flat=True))
+        if not self.sku_ids:
+            raise CommandError(
+                "The catalog is empty, run generate_store_data first.")
+
+        tuned = dict(OPT_IN.get(connection.vendor, {}))
+        tuned.update(getattr(settings, 'STORE_DB_PROFILES', {}).get(
+            connection.vendor, {}))
+        profiles = (
+            ('baseline', BASELINE.get(connection.vendor, {}), False),
+            ('tuned', tuned, True),
+        )
+        journal_mode = self.journal_mode()
+        results = []
+        for workers in [int(n) for n in options['workers'].split(',')]:
+            for name, profile, persistent in profiles:
+                self.stderr.write("%s, %d workers..." % (name, workers))
+                results.append(dict(
+                    self.run(profile, persistent, workers, options),
+                    profile=name, workers=workers))
+        # Back to the configured profile and the journal mode the database
+        # had
+        connection.close()
+        if journal_mode is not None:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode = %s' % journal_mode)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("%-9s %7s %10s %10s %12s %12s %7s" % (
+            'profile', 'workers', 'reads/s', 'writes/s', 'read p95 ms',
+            'write p95 ms', 'errors'))
+        for result in results:
+            self.stdout.write("%-9s %7d %10.1f %10.1f %12.2f %12.2f %7d" % (
+                result['profile'], result['workers'], result['reads_per_s'],
+                result['writes_per_s'], result['read_p95_ms'],
+                result['write_p95_ms'], result['errors']))
+
+    def journal_mode(self):
+        """Returns the journal mode of an SQLite database, else ``None``"""
+        if connection.vendor != 'sqlite':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def run(self, profile, persistent, workers, options):
+        connection.close()
+        with override_settings(
+                STORE_DB_PROFILES={connection.vendor: profile}):
+            # The first connection switches the journal mode of the file
+            connection.ensure_connection()
+            deadline = time.perf_counter() + options['seconds']
+            timings = {'read': [], 'write': []}
+            errors = []
+            threads = [
+                threading.Thread(target=self.work, args=(
+                    random.Random(number), persistent, deadline,
+                    options['write_share'], timings, errors))
+                for number in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            connection.close()
+
+        seconds = options['seconds']
+        return {
+            'reads_per_s': len(timings['read']) / seconds,
+            'writes_per_s': len(timings['write']) / seconds,
+            'read_p95_ms': self.p95(timings['read']),
+            'write_p95_ms': self.p95(timings['write']),
+            'errors': len(errors),
+        }
+
+    def work(self, rng, persistent, deadline, write_share, timings,
+             errors):
+        """Serves requests until ``deadline``, in its own connection"""
+        try:
+            while time.perf_counter() < deadline:
+                kind = 'write' if rng.random() < write_share else 'read'
+                started = time.perf_counter()
+                try:
+                    getattr(self, kind)(rng.choice(self.sku_ids))
+                except OperationalError as error:
+                    errors.append(str(error))
+                else:
+                    timings[kind].append(
+                        (time.perf_counter() - started) * 1000)
+                finally:
+                    if not persistent:
+                        # As Django does at the end of a request with
+                        # CONN_MAX_AGE = 0
+                        connection.close()
+        finally:
+            connection.close()
+
+    def read(self, sku_id):
+        """A catalog page"""
+        list(SKU.objects.filter(pk__gte=sku_id).order_by('pk').values(
+            'pk', 'number', 'price', 'currency', 'quantity',
+            'product__name')[:50])
+
+    def write(self, sku_id):
+        """A reservation, written first like a checkout, and its release"""
+        with transaction.atomic():
+            if SKU.objects.filter(pk=sku_id, quantity__gte=1).update(
+                    quantity=F('quantity') - 1):
+                SKU.objects.filter(pk=sku_id).values('quantity').get()
+            else:
+                return
+        SKU.objects.filter(pk=sku_id).update(quantity=F('quantity') + 1)
+
+    def p95(self, timings):
+        if not timings:
+            return 0
+        timings.sort()
+        return timings[min(len(timings) - 1, int(len(timings) * 0.95))]
@@ -0,0 +1,134 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from store.cache import response_cache
+from store.fragments import fragment_cache
+from store.models import *
+from store.views import AttributeViewSet, ProductViewSet, SKUViewSet
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic catalog"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares list endpoint latency of the regular serializers with the "
+        "fast read serializers and with responses assembled from cached row "
+        "fragments. A synthetic catalog is created inside a transaction "
+        "that is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skus', type=int, default=2000,
+            help="Number of synthetic SKUs")
+        parser.add_argument(
+            '--page-size', type=int, default=500,
+            help="Rows per listed page")
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Runs per endpoint, the best one is reported")
+        parser.add_argument(
+            '--json', action='store_true',
+            help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            # Requests come from APIRequestFactory's 'testserver' host
+            with transaction.atomic(), \
+                    override_settings(ALLOWED_HOSTS=['*']):
+                self.populate(options['skus'])
+                results = self.run(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("%-20s %14s %14s %8s %15s %8s" % (
+            'endpoint', 'regular (ms)', 'fast (ms)', 'speedup',
+            'fragments (ms)', 'speedup'))
+        for result in results:
+            self.stdout.write("%-20s %14.2f %14.2f %7.1fx %15.2f %7.1fx" % (
+                result['endpoint'], result['regular_ms'], result['fast_ms'],
+                result['regular_ms'] / result['fast_ms'],
+                result['fragments_ms'],
+                result['regular_ms'] / result['fragments_ms']))
+
+    def populate(self, size):
+        """Creates ``size`` SKUs spread over products with two attributes"""
+        category = ProductCategory.objects.create(
+            name='benchmark', description='benchmark')
+        products = [
+            Product.objects.create(
+                name='product-%05d' % number, description='benchmark',
+                manufacturer='benchmark', category=category)
+            for number in range(max(1, size // 10))
+        ]
+        attributes = []
+        for type_name in ('size', 'finish'):
+            attribute_type = AttributeType.objects.create(
+                name=type_name, description='benchmark')
+            attributes.append([
+                Attribute.objects.create(
+                    type=attribute_type, name='%s-%d' % (type_name, number))
+                for number in range(10)
+            ])
+
+        SKU.objects.bulk_create(
+            SKU(number='BENCH-%08d' % number,
+                product=products[number % len(products)],
+                price='0.00059', currency='BTC', quantity=1)
+            for number in range(size))
+        Through = SKU.attributes.through
+        Through.objects.bulk_create(
+            Through(sku_id=sku_id, attribute_id=values[sku_id % 10].pk)
+            for sku_id in SKU.objects.filter(
+                number__startswith='BENCH-').values_list('pk', flat=True)
+            for values in attributes)
+
+    def time_list(self, viewset, page_size, repeat):
+        """Returns the best time in ms to list and render one page"""
+        view = viewset.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(repeat):
+            response_cache.cache.clear()
+            request = factory.get('/', {'page_size': page_size})
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings), response.content
+
+    def run(self, options):
+        results = []
+        for name, viewset in (('skus', SKUViewSet),
+                              ('products', ProductViewSet),
+                              ('product_attributes', AttributeViewSet)):
+            regular_ms, regular = self.time_list(
+                viewset, options['page_size'], options['repeat'])
+            with override_settings(STORE_FAST_READ_SERIALIZERS=True):
+                fast_ms, fast = self.time_list(
+                    viewset, options['page_size'], options['repeat'])
+
+            # The first run encodes the fragments, the best one reuses them
+            fragment_cache.clear()
+            with override_settings(STORE_FRAGMENT_CACHE=True):
+                fragments_ms, fragments = self.time_list(
+                    viewset, options['page_size'], options['repeat'])
+
+            assert regular == fast == fragments, (
+                "%s responses differ" % name)
+            results.append({
+                'endpoint': name,
+                'regular_ms': regular_ms,
+                'fast_ms': fast_ms,
+                'fragments_ms': fragments_ms,
+            })
+        return results
@@ -0,0 +1,215 @@
+import json
+import platform
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from store.cache import response_cache
+from store.models import *
+
+
+class Rollback(Exception):
+    """Raised to discard writes made by a benchmark case"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the store API hot paths against the current database and "
+        "records latency and query counts as JSON. Run generate_store_data "
+        "first for a realistic catalog.")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = Client()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help="Runs per case")
+        parser.add_argument(
+            '--page-size', type=int, default=50,
+            help="page_size of list requests")
+        parser.add_argument(
+            '--warm', action='store_true',
+            help="Keep the response cache between runs")
+        parser.add_argument(
+            '--only', default='',
+            help="Comma separated case names to run")
+        parser.add_argument(
+            '--output',
+            help="Write the JSON results to this file instead of stdout")
+        parser.add_argument(
+            '--compare',
+            help="JSON results of an earlier run to compare with")
+
+    def handle(self, *args, **options):
+        if not SKU.objects.exists():
+            raise CommandError(
+                "The catalog is empty, run generate_store_data first.")
+
+        cases = self.cases(options['page_size'])
+        only = [name for name in options['only'].split(',') if name]
+        if only:
+            cases = [case for case in cases if case[0] in only]
+
+        # Requests come from the test client's 'testserver' host
+        with override_settings(ALLOWED_HOSTS=['*']):
+            results = [
+                self.run(name, method, url, data, options)
+                for name, method, url, data in cases
+            ]
+
+        report = {
+            'meta': self.meta(options),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                self.compare(json.load(baseline_file), report)
+
+    def meta(self, options):
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'page_size': options['page_size'],
+            'warm': options['warm'],
+            'fast_read_serializers': getattr(
+                settings, 'STORE_FAST_READ_SERIALIZERS', False),
+            'rows': {
+                model._meta.model_name: model.objects.count()
+                for model in (ProductCategory, Product, Attribute, SKU,
+                              Order, OrderLine)
+            },
+        }
+
+    def cases(self, page_size):
+        """Returns (name, method, url, data) of every benchmark case"""
+        page = {'page_size': page_size}
+        sku = SKU.objects.order_by('pk').prefetch_related('attributes')[0]
+        attributes = ','.join(
+            str(attribute.pk) for attribute in sku.attributes.all()[:2])
+        product = sku.product
+        word = product.name.split()[0]
+        order = Order.objects.order_by('pk').first()
+
+        cases = [
+            ('skus', 'get', reverse('sku-list'), page),
+            ('skus_detail', 'get', reverse('sku-detail', args=(sku.pk,)), {}),
+            ('skus_filter_attributes', 'get', reverse('sku-list'),
+             dict(page, attributes=attributes)),
+            ('skus_filter_product', 'get', reverse('sku-list'),
+             dict(page, product_id=product.pk)),
+            ('skus_search', 'get', reverse('sku-list'),
+             dict(page, search=word)),
+            ('products', 'get', reverse('product-list'), page),
+            ('products_detail', 'get',
+             reverse('product-detail', args=(product.pk,)), {}),
+            ('orders', 'get', reverse('order-list'), page),
+            ('product_attributes', 'get', reverse('attribute-list'), page),
+            ('product_attributes_filter_product', 'get',
+             reverse('attribute-list'),
+             dict(page, sku_set__product_id=product.pk)),
+            ('product_attribute_types', 'get',
+             reverse('attributetype-list'), page),
+            ('product_attribute_types_filter_product', 'get',
+             reverse('attributetype-list'),
+             dict(page, attribute_set__sku_set__product_id=product.pk)),
+            ('facets', 'get', reverse('facet-list'),
+             {'product_id': product.pk}),
+            ('order_create', 'post', reverse('order-list'),
+             self.order_data(SKU.objects.filter(quantity__gte=10)[:3])),
+        ]
+        if order is not None:
+            cases.append(('orders_detail', 'get',
+                          reverse('order-detail', args=(order.pk,)), {}))
+        return cases
+
+    def order_data(self, skus):
+        address = {
+            'country': 'USA', 'street': '1 Bench Street',
+            'city': 'Bench City', 'state': 'BS', 'postal_code': '12345'
+        }
+        return {
+            'ship_to': address,
+            'bill_to': address,
+            'contact': {
+                'full_name': 'Bench Mark', 'email': 'bench@example.com'
+            },
+            'order_line_set': [
+                {
+                    'sku': sku.pk, 'price': str(sku.price),
+                    'currency': sku.currency, 'quantity': 1,
+                    'ordering': ordering
+                }
+                for ordering, sku in enumerate(skus, 1)
+            ]
+        }
+
+    def request(self, method, url, data):
+        if method == 'post':
+            # Roll back so every run sees the same stock
+            try:
+                with transaction.atomic():
+                    response = self.client.post(
+                        url, json.dumps(data),
+                        content_type='application/json')
+                    raise Rollback()
+            except Rollback:
+                return response
+        return self.client.get(url, data, HTTP_ACCEPT='application/json')
+
+    def run(self, name, method, url, data, options):
+        timings = []
+        for _ in range(options['repeat']):
+            if not options['warm']:
+                response_cache.cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = self.request(method, url, data)
+                timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        median = statistics.median(timings)
+        self.stderr.write("%-40s %8.2f ms" % (name, median))
+        return {
+            'name': name,
+            'method': method.upper(),
+            'url': url,
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'queries': len(queries),
+            'query_ms': sum(float(query['time']) for query in queries) * 1000,
+            'min_ms': timings[0],
+            'median_ms': median,
+            'p95_ms': timings[min(len(timings) - 1,
+                                  int(round(len(timings) * 0.95)) - 1)],
+            'max_ms': timings[-1],
+        }
+
+    def compare(self, baseline, report):
+        """Prints median latency and query count changes per case"""
+        before = {result['name']: result for result in baseline['results']}
+        self.stderr.write("\n%-40s %10s %10s %8s %12s" % (
+            'case', 'before ms', 'after ms', 'change', 'queries'))
+        for result in report['results']:
+            if result['name'] not in before:
+                continue
+            old = before[result['name']]
+            self.stderr.write("%-40s %10.2f %10.2f %+7.0f%% %5d -> %-5d" % (
+                result['name'], old['median_ms'], result['median_ms'],
+                (result['median_ms'] / old['median_ms'] - 1) * 100,
+                old['queries'], result['queries']))
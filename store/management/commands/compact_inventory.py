@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds the inventory shards of hot SKUs back into their quantity "
+        "and spreads the stock over the shards again; run it periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sku', type=int, action='append', dest='sku_ids',
+            help="Only compact this SKU id, may be repeated")
+
+    def handle(self, *args, **options):
+        count = inventory.compact(options['sku_ids'])
+        self.stdout.write("Compacted the inventory of %d SKUs." % count)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from store import dedup
+
+
+class Command(BaseCommand):
+    help = (
+        "Hashes the addresses and contacts stored before they were "
+        "deduplicated, merging the duplicates and repointing their orders.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help="Rows hashed per transaction")
+
+    def handle(self, *args, **options):
+        for model in dedup.REFERENCES:
+            hashed, merged = dedup.backfill(model, options['batch_size'])
+            self.stdout.write("%s: kept %d rows, merged %d duplicates." % (
+                model._meta.verbose_name_plural.title(), hashed, merged))
@@ -0,0 +1,147 @@
+import csv
+import re
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from store import export
+
+# Id of an NDJSON record, records are written id first
+NDJSON_ID = re.compile(rb'^\{"id": (\d+)')
+
+
+def ndjson_records(exported):
+    """Yields ``(offset, id)`` of the complete lines of an NDJSON export"""
+    offset = 0
+    for line in exported:
+        match = NDJSON_ID.match(line)
+        if match and line.endswith(b'\n'):
+            yield offset, int(match.group(1))
+        offset += len(line)
+
+
+def csv_records(exported):
+    """
+    Yields ``(offset, id)`` of the complete rows of a CSV export. Quoted
+    cells may hold line breaks, so rows are read as CSV records.
+    """
+    consumed = 0
+    complete = False
+
+    def lines():
+        nonlocal consumed, complete
+        for line in exported:
+            consumed += len(line)
+            complete = line.endswith(b'\n')
+            # The last line may be cut short in a character
+            yield line.decode('utf-8', 'replace')
+
+    offset = 0
+    try:
+        for row in csv.reader(lines()):
+            if complete and row and row[0].isdigit():
+                yield offset, int(row[0])
+            offset = consumed
+    except csv.Error:
+        # A record cut short
+        return
+
+
+RECORDS = {
+    'ndjson': ndjson_records,
+    'csv': csv_records,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams every order (archived orders included) or every SKU as "
+        "NDJSON or CSV, to a file or the standard output.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(export.EXPORTS))
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument(
+            '--output', help="File to write, defaults to the standard output")
+        parser.add_argument(
+            '--after', type=int,
+            help="Only export records with a greater id")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Continue an interrupted export to --output")
+        parser.add_argument(
+            '--chunk-size', type=int, help="Records read per query")
+        for name in ('created-after', 'created-before', 'modified-after',
+                     'modified-before'):
+            parser.add_argument(
+                '--' + name,
+                help="ISO 8601 timestamp, see store/export.py for the "
+                     "filters of each dataset")
+        parser.add_argument(
+            '--status', help="Comma separated order statuses")
+
+    def handle(self, *args, **options):
+        output_format = options['format']
+        after = options['after']
+        skip_header = False
+        if options['resume']:
+            if not options['output']:
+                raise CommandError("--resume needs --output.")
+            offset, after, resumed = self.resume_point(
+                options['output'], output_format)
+            with open(options['output'], 'ab') as output:
+                output.truncate(offset)
+            skip_header = resumed and output_format == 'csv'
+
+        params = {
+            name: options[name]
+            for name in ('created_after', 'created_before', 'modified_after',
+                         'modified_before', 'status')
+            if options[name] is not None
+        }
+        try:
+            exporter = export.EXPORTS[options['dataset']](
+                params, after, options['chunk_size'])
+        except serializers.ValidationError as exc:
+            raise CommandError('; '.join(
+                '%s: %s' % (name, ' '.join(errors))
+                for name, errors in exc.detail.items()))
+
+        stream = exporter.stream(output_format)
+        if skip_header:
+            next(stream)
+        if not options['output']:
+            for piece in stream:
+                self.stdout.write(piece, ending='')
+            return
+
+        mode = 'a' if options['resume'] else 'w'
+        records = 0
+        with open(options['output'], mode, newline='') as output:
+            for piece in stream:
+                output.write(piece)
+                records += 1
+        if output_format == 'csv' and not skip_header:
+            records -= 1
+        self.stderr.write("Wrote %d records to %s." % (
+            records, options['output']))
+
+    def resume_point(self, path, output_format):
+        """
+        Returns the offset to truncate ``path`` at, the id to resume after
+        and whether any record is kept. The last record is dropped, it may
+        have been cut short.
+        """
+        record_start = None
+        last_id = previous_id = None
+        try:
+            with open(path, 'rb') as exported:
+                for offset, record_id in RECORDS[output_format](exported):
+                    if record_id != last_id:
+                        previous_id, last_id = last_id, record_id
+                        record_start = offset
+        except FileNotFoundError:
+            return 0, None, False
+
+        if record_start is None:
+            return 0, None, False
+        return record_start, previous_id, True
@@ -0,0 +1,314 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from store import sales, search
+from store.attribute_index import attribute_index
+from store.cache import DEPENDENCIES, response_cache
+from store.category_tree import category_tree
+from store.fragments import STAMPS, fragment_cache
+from store.models import *
+
+WORDS = (
+    'alpha', 'bolt', 'cog', 'delta', 'edge', 'flux', 'gear', 'hinge', 'iron',
+    'joint', 'knob', 'lever', 'micro', 'nut', 'orbit', 'pivot', 'quartz',
+    'rivet', 'spring', 'torque', 'ultra', 'valve', 'washer', 'xeno', 'yoke',
+    'zinc',
+)
+
+ATTRIBUTE_TYPES = (
+    ('Size', ('XS', 'Small', 'Medium', 'Large', 'XL', 'XXL')),
+    ('Finish', ('Red', 'Blue', 'Green', 'Black', 'Chrome', 'Brass', 'Matte')),
+    ('Material', ('Steel', 'Aluminium', 'Copper', 'Plastic', 'Carbon')),
+    ('Thread', ('M3', 'M4', 'M5', 'M6', 'M8', 'M10')),
+    ('Pack', ('1', '5', '10', '25', '100')),
+)
+
+# Order statuses and how often they occur
+STATUS_WEIGHTS = (
+    (Order.COMPLETED, 70),
+    (Order.PROCESSING, 10),
+    (Order.PENDING_PAYMENT, 5),
+    (Order.ON_HOLD, 3),
+    (Order.FAILED, 4),
+    (Order.CANCELLED, 5),
+    (Order.REFUNDED, 3),
+)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Lets bulk inserts keep the timestamps set on the instances"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or
+        getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic catalog (category tree, products, attributes "
+        "and SKUs) and order history of configurable size.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--categories', type=int, default=30,
+            help="Number of product categories")
+        parser.add_argument(
+            '--category-depth', type=int, default=3,
+            help="Maximum depth of the category tree")
+        parser.add_argument(
+            '--products', type=int, default=1000,
+            help="Number of products")
+        parser.add_argument(
+            '--skus-per-product', type=int, default=10,
+            help="Average number of SKUs per product")
+        parser.add_argument(
+            '--attribute-types', type=int, default=3,
+            help="Number of attribute types every SKU has a value of (max %d)"
+                 % len(ATTRIBUTE_TYPES))
+        parser.add_argument(
+            '--orders', type=int, default=5000,
+            help="Number of orders")
+        parser.add_argument(
+            '--lines-per-order', type=int, default=3,
+            help="Average number of lines per order")
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help="Orders are spread over this many past days")
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help="Rows per bulk insert")
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Random seed, the same seed generates the same data")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.time()
+
+        with transaction.atomic():
+            categories = self.generate_categories(
+                options['categories'], options['category_depth'])
+            products = self.generate_products(
+                options['products'], categories)
+            attributes = self.generate_attributes(options['attribute_types'])
+            skus = self.generate_skus(
+                products, attributes, options['skus_per_product'])
+            self.generate_orders(
+                options['orders'], skus, options['lines_per_order'],
+                options['days'])
+            self.reset_sequences()
+
+        # Bulk inserts skip the signals maintaining these
+        search.rebuild()
+        sales.rebuild()
+        attribute_index.invalidate()
+        category_tree.invalidate()
+        for group in DEPENDENCIES:
+            response_cache.invalidate(group)
+        for model in STAMPS:
+            fragment_cache.invalidate(model)
+
+        self.stdout.write("Generated data in %.1fs." % (time.time() - started))
+
+    def word(self):
+        return self.rng.choice(WORDS)
+
+    def next_pk(self, model):
+        """Returns the first primary key unused by the model and archive"""
+        tables = {
+            Order: (Order, ArchivedOrder),
+            OrderLine: (OrderLine, ArchivedOrderLine),
+        }.get(model, (model,))
+        return max(
+            table.objects.aggregate(pk=Max('pk'))['pk'] or 0
+            for table in tables) + 1
+
+    def batch_size_for(self, model, objects):
+        """Caps --batch-size to what the database accepts per insert"""
+        return min(self.batch_size, connection.ops.bulk_batch_size(
+            model._meta.concrete_fields, objects))
+
+    def bulk_create(self, model, objects):
+        """Inserts objects in batches, assigning their primary keys"""
+        next_pk = self.next_pk(model)
+        for offset, instance in enumerate(objects):
+            instance.pk = next_pk + offset
+        model.objects.bulk_create(
+            objects, batch_size=self.batch_size_for(model, objects))
+        self.stdout.write("  %d %s" % (
+            len(objects), model._meta.verbose_name_plural))
+        return objects
+
+    def reset_sequences(self):
+        """Moves sequences past the explicitly assigned primary keys"""
+        statements = connection.ops.sequence_reset_sql(no_style(), [
+            ProductCategory, Product, AttributeType, Attribute, SKU, Address,
+            Contact, Order, OrderLine])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def generate_categories(self, count, depth):
+        """Builds a random MPTT tree, returns its leaves"""
+        nodes = []
+        with ProductCategory.objects.disable_mptt_updates():
+            for number in range(count):
+                candidates = [
+                    node for node in nodes if node.level < depth - 1]
+                parent = (
+                    self.rng.choice(candidates)
+                    if candidates and self.rng.random() < 0.7 else None)
+                node = ProductCategory(
+                    parent=parent,
+                    name='%s %s %d' % (
+                        self.word().title(), self.word(), number),
+                    description='Generated category')
+                # Only used to pick parents, the tree is rebuilt below
+                node.level = parent.level + 1 if parent else 0
+                node.tree_id = node.lft = node.rght = 0
+                node.save()
+                nodes.append(node)
+        ProductCategory.objects.rebuild()
+        self.stdout.write("  %d product categories" % len(nodes))
+
+        parents = {node.parent_id for node in nodes}
+        return [node for node in nodes if node.pk not in parents]
+
+    def generate_products(self, count, categories):
+        return self.bulk_create(Product, [
+            Product(
+                name='%s %s' % (self.word().title(), self.word()),
+                description='A %s %s widget' % (self.word(), self.word()),
+                manufacturer='%s Works' % self.word().title(),
+                category=self.rng.choice(categories))
+            for _ in range(count)
+        ])
+
+    def generate_attributes(self, count):
+        """Returns the attributes of each generated type"""
+        types = self.bulk_create(AttributeType, [
+            AttributeType(name=name, description=name)
+            for name, values in ATTRIBUTE_TYPES[:count]
+        ])
+        attributes = self.bulk_create(Attribute, [
+            Attribute(type=attribute_type, name=value, description=value)
+            for attribute_type, (name, values) in zip(types, ATTRIBUTE_TYPES)
+            for value in values
+        ])
+        return [
+            [attribute for attribute in attributes
+             if attribute.type_id == attribute_type.pk]
+            for attribute_type in types
+        ]
+
+    def generate_skus(self, products, attributes, per_product):
+        skus = []
+        links = []
+        for product in products:
+            variants = set()
+            for _ in range(self.rng.randint(1, per_product * 2 - 1)):
+                variant = tuple(
+                    self.rng.choice(values) for values in attributes)
+                if variant in variants:
+                    continue
+                variants.add(variant)
+                sku = SKU(
+                    number='%s-%06d-%02d' % (
+                        product.name[:3].upper(), product.pk, len(variants)),
+                    product=product,
+                    price=Decimal(self.rng.randint(1, 99999999)) / 10 ** 8,
+                    currency='BTC',
+                    quantity=self.rng.randint(0, 500))
+                skus.append(sku)
+                links.extend((sku, attribute) for attribute in variant)
+
+        self.bulk_create(SKU, skus)
+        Through = SKU.attributes.through
+        Through.objects.bulk_create(
+            [Through(sku_id=sku.pk, attribute_id=attribute.pk)
+             for sku, attribute in links],
+            batch_size=self.batch_size_for(Through, links))
+        return skus
+
+    def generate_orders(self, count, skus, lines_per_order, days):
+        now = timezone.now()
+        statuses = [status for status, weight in STATUS_WEIGHTS]
+        weights = [weight for status, weight in STATUS_WEIGHTS]
+
+        addresses = []
+        contacts = []
+        orders = []
+        lines = []
+        for number in range(count):
+            created = now - timedelta(
+                seconds=self.rng.randint(0, days * 86400))
+            ship_to = Address(
+                country=self.rng.choice(('USA', 'UK', 'DE', 'FR', 'JP')),
+                street='%d %s Street' % (number, self.word().title()),
+                city='%s City' % self.word().title(),
+                postal_code='%05d' % self.rng.randint(0, 99999),
+                created_timestamp=created, modified_timestamp=created)
+            # A third of the orders bill somewhere else
+            bill_to = ship_to
+            if self.rng.random() < 0.33:
+                bill_to = Address(
+                    country=ship_to.country,
+                    street='%d %s Avenue' % (number, self.word().title()),
+                    city=ship_to.city, postal_code=ship_to.postal_code,
+                    created_timestamp=created, modified_timestamp=created)
+                addresses.append(bill_to)
+            addresses.append(ship_to)
+            contact = Contact(
+                full_name='%s %s' % (
+                    self.word().title(), self.word().title()),
+                email='customer%d@example.com' % number,
+                created_timestamp=created, modified_timestamp=created)
+            contacts.append(contact)
+            order = Order(
+                status=self.rng.choices(statuses, weights)[0],
+                ship_to=ship_to, bill_to=bill_to, contact=contact,
+                created_timestamp=created, modified_timestamp=created)
+            orders.append(order)
+            order_lines = [
+                OrderLine(
+                    order=order, sku=sku, price=sku.price,
+                    currency=sku.currency,
+                    quantity=self.rng.randint(1, 5), ordering=ordering,
+                    created_timestamp=created, modified_timestamp=created)
+                for ordering, sku in enumerate(self.rng.sample(
+                    skus, min(len(skus), self.rng.randint(
+                        1, lines_per_order * 2 - 1))), 1)
+            ]
+            order.set_summary(order_lines)
+            lines.extend(order_lines)
+
+        with explicit_timestamps(Address, Contact, Order, OrderLine):
+            self.bulk_create(Address, addresses)
+            self.bulk_create(Contact, contacts)
+            # Foreign key ids were read before the targets had primary keys
+            for order in orders:
+                order.ship_to = order.ship_to
+                order.bill_to = order.bill_to
+                order.contact = order.contact
+            self.bulk_create(Order, orders)
+            for line in lines:
+                line.order = line.order
+            self.bulk_create(OrderLine, lines)
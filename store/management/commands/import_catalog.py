@@ -0,0 +1,93 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store import catalog_import
+
+
+class Command(BaseCommand):
+    help = (
+        "Upserts a supplier catalog from a CSV or JSONL file of SKU rows, "
+        "see store/catalog_import.py for the columns.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import")
+        parser.add_argument(
+            '--format', choices=catalog_import.FORMATS,
+            help="Defaults to the file extension")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Rows imported per transaction")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Skip the rows an earlier, failed run of this file "
+                 "committed")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if input_format not in catalog_import.FORMATS:
+            raise CommandError(
+                "Pass --format, the file extension isn't one of %s." %
+                ', '.join(catalog_import.FORMATS))
+        batch_size = catalog_import.batch_size(options['batch_size'])
+
+        checkpoint_path = path + '.checkpoint'
+        skip = 0
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                skip = json.load(checkpoint_file)['rows']
+            self.stdout.write("Resuming after row %d." % skip)
+
+        importer = catalog_import.CatalogImporter()
+        started = time.time()
+        read = skip
+        failed = 0
+        batch = []
+        with open(path, newline='') as input_file:
+            rows = catalog_import.read_rows(input_file, input_format)
+            for index, (line_number, row) in enumerate(rows):
+                if index < skip:
+                    continue
+                read += 1
+                try:
+                    batch.append(importer.clean(row))
+                except catalog_import.RowError as exc:
+                    failed += self.report('Line %d' % line_number, exc)
+                if len(batch) == batch_size:
+                    failed += self.import_batch(importer, batch)
+                    batch = []
+                    self.checkpoint(checkpoint_path, read, skip, started)
+            if batch:
+                failed += self.import_batch(importer, batch)
+                self.checkpoint(checkpoint_path, read, skip, started)
+
+        importer.finish()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.time() - started
+        self.stdout.write("Imported %d rows in %.1fs (%.0f rows/s), %d "
+                          "left out." % (
+                              read - skip, elapsed,
+                              (read - skip) / max(elapsed, 1e-6), failed))
+        for name, count in sorted(importer.stats.items()):
+            self.stdout.write("  %d %s" % (count, name))
+
+    def import_batch(self, importer, batch):
+        errors = importer.import_batch(batch)
+        for row, error in errors:
+            self.report('SKU %s' % row['number'], error)
+        return len(errors)
+
+    def report(self, label, error):
+        self.stderr.write("%s: %s" % (label, error))
+        return 1
+
+    def checkpoint(self, path, read, skip, started):
+        """Records the rows committed so far, reports the throughput"""
+        with open(path, 'w') as checkpoint_file:
+            json.dump({'rows': read}, checkpoint_file)
+        self.stdout.write("  %d rows, %.0f rows/s" % (
+            read, (read - skip) / max(time.time() - started, 1e-6)))
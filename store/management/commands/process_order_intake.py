@@ -0,0 +1,54 @@
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+from store import intake
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the orders queued by POST /api/orders/ when "
+        "STORE_ASYNC_ORDER_INTAKE is on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Number of worker processes")
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Requests a worker processes per transaction")
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait before polling an empty queue again")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the queue and exit instead of polling")
+
+    def handle(self, *args, **options):
+        if options['once'] and options['workers'] == 1:
+            count = intake.drain(batch_size=options['batch_size'])
+            self.stdout.write("Processed %d order requests." % count)
+            return
+
+        kwargs = {
+            'batch_size': options['batch_size'],
+            'poll_interval': options['poll_interval'],
+            'once': options['once'],
+        }
+        if options['workers'] == 1:
+            intake.run_worker(**kwargs)
+            return
+
+        # Forked workers must open their own database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=intake.run_worker, kwargs=kwargs)
+            for _ in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,15 @@
+import time
+from django.core.management.base import BaseCommand
+from store import sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily sales rollups from every order line, "
+        "archived orders included.")
+
+    def handle(self, *args, **options):
+        started = time.time()
+        count = sales.rebuild()
+        self.stdout.write("Wrote %d sales rollups in %.1fs." % (
+            count, time.time() - started))
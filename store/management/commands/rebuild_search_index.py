@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the SKU full-text search index from scratch."
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        if backend is None:
+            self.stderr.write("No search backend is configured.")
+            return
+
+        backend.install(connection)
+        self.stdout.write("Indexed %d SKUs." % search.rebuild())
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from store import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes SQLite read replicas with a consistent copy of the "
+        "primary database, once or every --interval seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help="Replicas to refresh, defaults to STORE_READ_REPLICAS")
+        parser.add_argument(
+            '--interval', type=float,
+            help="Keep refreshing, waiting this many seconds in between")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or replicas.replicas()
+        if not aliases:
+            raise CommandError(
+                "Name the replicas or list them in STORE_READ_REPLICAS.")
+        for alias in [DEFAULT_DB_ALIAS] + aliases:
+            if alias not in connections.databases:
+                raise CommandError("Unknown database %s." % alias)
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(
+                    "%s isn't SQLite; replicate it with the database's "
+                    "own replication." % alias)
+
+        while True:
+            for alias in aliases:
+                started = time.time()
+                self.copy(connections.databases[alias]['NAME'])
+                self.stdout.write("Refreshed %s in %.2fs." % (
+                    alias, time.time() - started))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
+
+    def copy(self, path):
+        """
+        Copies the primary to ``path``. Readers see the old copy or the
+        new one, never a partial copy.
+        """
+        partial = path + '.partial'
+        source = sqlite3.connect(
+            connections.databases[DEFAULT_DB_ALIAS]['NAME'])
+        target = sqlite3.connect(partial)
+        try:
+            # The backup API copies a consistent snapshot, even while the
+            # primary is written to
+            source.backup(target)
+            # A WAL copy would be read together with the -wal and -shm
+            # files the readers of the copy it replaces left behind
+            target.execute('PRAGMA journal_mode = delete')
+        finally:
+            target.close()
+            source.close()
+        os.replace(partial, path)
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_auto_20180520_1534'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attribute',
+            index=models.Index(fields=['name'], name='store_attri_name_4c41d7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attributetype',
+            index=models.Index(fields=['name'], name='store_attri_name_a8ac3b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_timestamp'], name='store_order_created_4f6715_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='store_produ_name_5e57da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['number'], name='store_sku_number_93daf8_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:30
+
+from collections import defaultdict
+from django.db import migrations
+
+# The SKU search index of store.search as of this migration
+TABLE = 'store_sku_search'
+
+FIELDS = (
+    'product_name', 'description', 'manufacturer', 'category_path',
+    'attribute_names')
+
+
+def install_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % (
+            TABLE, ', '.join(FIELDS)))
+
+    SKU = apps.get_model('store', 'SKU')
+    ProductCategory = apps.get_model('store', 'ProductCategory')
+    categories = {
+        pk: (parent_id, name)
+        for pk, parent_id, name in ProductCategory.objects.values_list(
+            'pk', 'parent_id', 'name')
+    }
+
+    def category_path(category_id):
+        names = []
+        while category_id in categories:
+            category_id, name = categories[category_id]
+            names.append(name)
+        return ' / '.join(reversed(names))
+
+    attribute_names = defaultdict(list)
+    for sku_id, name in SKU.attributes.through.objects.values_list(
+            'sku_id', 'attribute__name'):
+        attribute_names[sku_id].append(name)
+
+    documents = [
+        [pk, name, description, manufacturer, category_path(category_id),
+         ' '.join(attribute_names[pk])]
+        for pk, name, description, manufacturer, category_id in
+        SKU.objects.values_list(
+            'pk', 'product__name', 'product__description',
+            'product__manufacturer', 'product__category_id')
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s" % TABLE)
+        cursor.executemany(
+            "INSERT INTO %s (rowid, %s) VALUES (%s)" % (
+                TABLE, ', '.join(FIELDS),
+                ', '.join(['%s'] * (len(FIELDS) + 1))),
+            documents)
+
+
+def uninstall_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS %s" % TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_auto_20261018_1151'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:04
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def fill_order_summaries(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderLine = apps.get_model('store', 'OrderLine')
+
+    order_lines = defaultdict(list)
+    for line in OrderLine.objects.order_by('ordering').iterator():
+        order_lines[line.order_id].append(line)
+
+    for order in Order.objects.select_related('contact').iterator():
+        lines = order_lines[order.pk]
+        Order.objects.filter(pk=order.pk).update(
+            total=sum((line.price * line.quantity for line in lines), 0),
+            currency=lines[0].currency if lines else '',
+            line_count=len(lines),
+            item_count=sum(line.quantity for line in lines),
+            contact_name=order.contact.full_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_auto_20261018_1230'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='contact_name',
+            field=models.CharField(blank=True, max_length=150, verbose_name='Contact Name'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(blank=True, choices=[('BTC', 'BitCoin')], max_length=3, verbose_name='Currency'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Item Count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Line Count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=20, verbose_name='Total'),
+        ),
+        migrations.RunPython(fill_order_summaries, migrations.RunPython.noop),
+    ]
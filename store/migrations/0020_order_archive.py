@@ -0,0 +1,63 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_order_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_timestamp', models.DateTimeField(verbose_name='Create Timestamp')),
+                ('modified_timestamp', models.DateTimeField(verbose_name='Modified Timestamp')),
+                ('status', models.PositiveIntegerField(verbose_name='Status')),
+                ('total', models.DecimalField(decimal_places=8, max_digits=20, verbose_name='Total')),
+                ('currency', models.CharField(blank=True, choices=[('BTC', 'BitCoin')], max_length=3, verbose_name='Currency')),
+                ('line_count', models.PositiveIntegerField(verbose_name='Line Count')),
+                ('item_count', models.PositiveIntegerField(verbose_name='Item Count')),
+                ('contact_name', models.CharField(blank=True, max_length=150, verbose_name='Contact Name')),
+                ('period', models.CharField(max_length=7, verbose_name='Period')),
+                ('archived_timestamp', models.DateTimeField(auto_now_add=True, verbose_name='Archive Timestamp')),
+                ('bill_to', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bill_to_set', to='store.Address', verbose_name='Bill To')),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_contact_set', to='store.Contact', verbose_name='Contact')),
+                ('ship_to', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_ship_to_set', to='store.Address', verbose_name='Ship To')),
+            ],
+            options={
+                'verbose_name': 'Archived Order',
+                'verbose_name_plural': 'Archived Orders',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderLine',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_timestamp', models.DateTimeField(verbose_name='Create Timestamp')),
+                ('modified_timestamp', models.DateTimeField(verbose_name='Modified Timestamp')),
+                ('price', models.DecimalField(decimal_places=8, max_digits=8, verbose_name='Price')),
+                ('currency', models.CharField(choices=[('BTC', 'BitCoin')], max_length=3, verbose_name='Currency')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('ordering', models.PositiveIntegerField(verbose_name='Ordering')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_line_set', to='store.ArchivedOrder', verbose_name='Order')),
+                ('sku', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_order_line_set', to='store.SKU', verbose_name='SKU')),
+            ],
+            options={
+                'verbose_name': 'Archived OrderLine',
+                'verbose_name_plural': 'Archived OrderLines',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_timestamp'], name='store_archi_created_c09ff9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['period', 'created_timestamp'], name='store_archi_period_94e1c6_idx'),
+        ),
+    ]
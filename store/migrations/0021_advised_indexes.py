@@ -0,0 +1,17 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['product', 'number'], name='store_sku_product_fb9972_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_advised_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIntake',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_timestamp', models.DateTimeField(auto_now_add=True, verbose_name='Create Timestamp')),
+                ('modified_timestamp', models.DateTimeField(auto_now=True, verbose_name='Modified Timestamp')),
+                ('handle', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Handle')),
+                ('status', models.PositiveIntegerField(choices=[(1, 'Queued'), (2, 'Processing'), (3, 'Done'), (4, 'Failed')], default=1, verbose_name='Status')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('errors', models.TextField(blank=True, verbose_name='Errors')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('claimed_by', models.CharField(blank=True, max_length=100, verbose_name='Claimed By')),
+                ('claimed_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='Claim Timestamp')),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='intake', to='store.Order', verbose_name='Order')),
+            ],
+            options={
+                'verbose_name': 'Order Intake',
+                'verbose_name_plural': 'Order Intakes',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderintake',
+            index=models.Index(fields=['status', 'id'], name='store_order_status_77ed13_idx'),
+        ),
+    ]
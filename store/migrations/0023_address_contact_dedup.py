@@ -0,0 +1,54 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_order_intake'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Content Hash'),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Content Hash'),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='bill_to',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_bill_to_set', to='store.Address', verbose_name='Bill To'),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='contact',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_contact_set', to='store.Contact', verbose_name='Contact'),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='ship_to',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_ship_to_set', to='store.Address', verbose_name='Ship To'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='bill_to',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bill_to_set', to='store.Address', verbose_name='Bill To'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='contact',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='contact_set', to='store.Contact', verbose_name='Contact'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ship_to',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ship_to_set', to='store.Address', verbose_name='Ship To'),
+        ),
+    ]
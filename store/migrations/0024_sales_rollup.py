@@ -0,0 +1,38 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_address_contact_dedup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('currency', models.CharField(choices=[('BTC', 'BitCoin')], max_length=3, verbose_name='Currency')),
+                ('units', models.IntegerField(default=0, verbose_name='Units')),
+                ('revenue', models.DecimalField(decimal_places=8, default=0, max_digits=20, verbose_name='Revenue')),
+                ('line_count', models.IntegerField(default=0, verbose_name='Line Count')),
+                ('sku', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollup_set', to='store.SKU', verbose_name='SKU')),
+            ],
+            options={
+                'verbose_name': 'Sales Rollup',
+                'verbose_name_plural': 'Sales Rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['sku', 'day'], name='store_sales_sku_id_f62903_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together={('day', 'sku', 'currency')},
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_timestamp', models.DateTimeField(auto_now_add=True, verbose_name='Create Timestamp')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Receipt'), (2, 'Sale'), (3, 'Refund'), (4, 'Adjustment')], verbose_name='Kind')),
+                ('quantity', models.IntegerField(help_text='Change to the stock, negative for what leaves it', verbose_name='Quantity')),
+                ('order_id', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='Order')),
+            ],
+            options={
+                'verbose_name': 'Inventory Movement',
+                'verbose_name_plural': 'Inventory Movements',
+            },
+        ),
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(verbose_name='Index')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+            ],
+            options={
+                'verbose_name': 'Inventory Shard',
+                'verbose_name_plural': 'Inventory Shards',
+            },
+        ),
+        migrations.AddField(
+            model_name='sku',
+            name='inventory_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Counter rows the stock of a hot SKU is spread over, see store/inventory.py', verbose_name='Inventory Shards'),
+        ),
+        migrations.AddField(
+            model_name='inventoryshard',
+            name='sku',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_shard_set', to='store.SKU', verbose_name='SKU'),
+        ),
+        migrations.AddField(
+            model_name='inventorymovement',
+            name='sku',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movement_set', to='store.SKU', verbose_name='SKU'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventoryshard',
+            unique_together={('sku', 'index')},
+        ),
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(fields=['sku', 'created_timestamp'], name='store_inven_sku_id_7d4ad0_idx'),
+        ),
+    ]
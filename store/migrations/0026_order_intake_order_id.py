@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_inventory_ledger'),
+    ]
+
+    # The order_id column is kept, only its foreign key constraint goes
+    operations = [
+        migrations.AlterField(
+            model_name='orderintake',
+            name='order',
+            field=models.IntegerField(blank=True, db_column='order_id', null=True, unique=True, verbose_name='Order'),
+        ),
+        migrations.RenameField(
+            model_name='orderintake',
+            old_name='order',
+            new_name='order_id',
+        ),
+        migrations.AlterField(
+            model_name='orderintake',
+            name='order_id',
+            field=models.IntegerField(blank=True, null=True, unique=True, verbose_name='Order'),
+        ),
+    ]
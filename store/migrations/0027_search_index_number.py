@@ -0,0 +1,79 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:40
+
+from collections import defaultdict
+from django.db import migrations
+
+# The SKU search index of store.search as of this migration
+TABLE = 'store_sku_search'
+
+FIELDS = (
+    'product_name', 'description', 'manufacturer', 'category_path',
+    'attribute_names', 'number')
+
+
+def create_search_index(apps, schema_editor, fields):
+    """(Re)creates the index with ``fields`` and indexes every SKU"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+
+    # FTS5 tables can't gain columns, the index is built again
+    schema_editor.execute("DROP TABLE IF EXISTS %s" % TABLE)
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE %s USING fts5(%s, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % (
+            TABLE, ', '.join(fields)))
+
+    SKU = apps.get_model('store', 'SKU')
+    ProductCategory = apps.get_model('store', 'ProductCategory')
+    categories = {
+        pk: (parent_id, name)
+        for pk, parent_id, name in ProductCategory.objects.values_list(
+            'pk', 'parent_id', 'name')
+    }
+
+    def category_path(category_id):
+        names = []
+        while category_id in categories:
+            category_id, name = categories[category_id]
+            names.append(name)
+        return ' / '.join(reversed(names))
+
+    attribute_names = defaultdict(list)
+    for sku_id, name in SKU.attributes.through.objects.values_list(
+            'sku_id', 'attribute__name'):
+        attribute_names[sku_id].append(name)
+
+    documents = [
+        [pk, name, description, manufacturer, category_path(category_id),
+         ' '.join(attribute_names[pk]), number][:len(fields) + 1]
+        for pk, number, name, description, manufacturer, category_id in
+        SKU.objects.values_list(
+            'pk', 'number', 'product__name', 'product__description',
+            'product__manufacturer', 'product__category_id')
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO %s (rowid, %s) VALUES (%s)" % (
+                TABLE, ', '.join(fields),
+                ', '.join(['%s'] * (len(fields) + 1))),
+            documents)
+
+
+def index_numbers(apps, schema_editor):
+    create_search_index(apps, schema_editor, FIELDS)
+
+
+def unindex_numbers(apps, schema_editor):
+    create_search_index(apps, schema_editor, FIELDS[:-1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_order_intake_order_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_numbers, unindex_numbers),
+    ]
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import uuid
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import ugettext_lazy as _, ugettext
 from mptt.models import MPTTModel, TreeForeignKey
@@ -98,6 +102,7 @@ class Product(ModelBase):
 
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        indexes = [models.Index(fields=['name'])]
 
     def __str__(self):
         """Unicode representation of Product."""
@@ -116,6 +121,7 @@ class AttributeType(ModelBase):
 
         verbose_name = 'AttributeType'
         verbose_name_plural = 'AttributeType'
+        indexes = [models.Index(fields=['name'])]
 
     def __str__(self):
         """Unicode representation of AttributeType."""
@@ -137,6 +143,7 @@ class Attribute(ModelBase):
 
         verbose_name = 'Attribute'
         verbose_name_plural = 'Attribute'
+        indexes = [models.Index(fields=['name'])]
 
     def __str__(self):
         """Unicode representation of Attribute."""
@@ -156,19 +163,152 @@ class SKU(ModelBase):
     attributes = models.ManyToManyField(
         Attribute, verbose_name=_('Attributes'), related_name='sku_set')
     quantity = models.PositiveIntegerField(verbose_name=_('Quantity'))
+    inventory_shards = models.PositiveSmallIntegerField(
+        verbose_name=_('Inventory Shards'), default=0,
+        help_text=_('Counter rows the stock of a hot SKU is spread over, '
+                    'see store/inventory.py'))
 
     class Meta:
         """Meta definition for SKU."""
 
         verbose_name = 'SKU'
         verbose_name_plural = 'SKU'
+        indexes = [
+            models.Index(fields=['number']),
+            # SKU list filtered by product, see advise_indexes
+            models.Index(fields=['product', 'number']),
+        ]
 
     def __str__(self):
         """Unicode representation of SKU."""
         return self.number
 
 
-class Address(ModelBase):
+class InventoryShard(models.Model):
+    """
+    Part of the stock of a sharded SKU, sold from without touching the SKU
+    row. Folded back into ``SKU.quantity`` by store/inventory.py.
+    """
+
+    sku = models.ForeignKey(
+        SKU, on_delete=models.CASCADE, verbose_name=_('SKU'),
+        related_name='inventory_shard_set')
+    index = models.PositiveSmallIntegerField(verbose_name=_('Index'))
+    quantity = models.PositiveIntegerField(verbose_name=_('Quantity'))
+
+    class Meta:
+        """Meta definition for InventoryShard."""
+
+        verbose_name = 'Inventory Shard'
+        verbose_name_plural = 'Inventory Shards'
+        unique_together = (('sku', 'index'),)
+
+    def __str__(self):
+        """Unicode representation of InventoryShard."""
+        return '%s #%d' % (self.sku_id, self.index)
+
+
+class InventoryMovement(models.Model):
+    """
+    Append-only record of a change to the stock of a SKU, see
+    store/inventory.py.
+    """
+
+    RECEIPT = 1
+    SALE = 2
+    REFUND = 3
+    ADJUSTMENT = 4
+
+    KIND_CHOICES = (
+        (RECEIPT, _('Receipt')),
+        (SALE, _('Sale')),
+        (REFUND, _('Refund')),
+        (ADJUSTMENT, _('Adjustment')),
+    )
+
+    created_timestamp = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Create Timestamp'))
+    sku = models.ForeignKey(
+        SKU, on_delete=models.CASCADE, verbose_name=_('SKU'),
+        related_name='inventory_movement_set')
+    kind = models.PositiveSmallIntegerField(
+        choices=KIND_CHOICES, verbose_name=_('Kind'))
+    quantity = models.IntegerField(
+        verbose_name=_('Quantity'),
+        help_text=_('Change to the stock, negative for what leaves it'))
+    # Not a foreign key, the order may have moved to the archive
+    order_id = models.IntegerField(
+        null=True, blank=True, db_index=True, verbose_name=_('Order'))
+
+    class Meta:
+        """Meta definition for InventoryMovement."""
+
+        verbose_name = 'Inventory Movement'
+        verbose_name_plural = 'Inventory Movements'
+        indexes = [models.Index(fields=['sku', 'created_timestamp'])]
+
+    def __str__(self):
+        """Unicode representation of InventoryMovement."""
+        return '%s %+d' % (self.sku_id, self.quantity)
+
+
+class ContentAddressedModel(ModelBase):
+    """
+    Rows identified by a hash of their normalized content, so equal rows
+    are stored once, see store/dedup.py.
+    """
+    content_hash = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False,
+        verbose_name=_('Content Hash'))
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def content_fields(cls):
+        """The fields whose values make up the content hash"""
+        return [
+            field for field in cls._meta.concrete_fields
+            if not field.primary_key and field.name not in (
+                'content_hash', 'created_timestamp', 'modified_timestamp')
+        ]
+
+    @classmethod
+    def hash_content(cls, values):
+        """
+        Returns the hash of ``{field name: value}``, ignoring case and
+        repeated whitespace.
+        """
+        normalized = [
+            ' '.join(str(values.get(field.name) or '').split()).casefold()
+            for field in cls.content_fields()
+        ]
+        return hashlib.sha256(
+            json.dumps(normalized).encode('utf-8')).hexdigest()
+
+    def own_content_hash(self):
+        """Returns the hash of this row's current field values"""
+        return self.hash_content({
+            field.name: getattr(self, field.attname)
+            for field in self.content_fields()
+        })
+
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # content_hash isn't editable, forms don't check it themselves
+        if type(self)._default_manager.filter(
+                content_hash=self.own_content_hash()
+        ).exclude(pk=self.pk).exists():
+            raise ValidationError(
+                _('%(model)s with the same content already exists.'),
+                code='unique', params={'model': self._meta.verbose_name})
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.own_content_hash()
+        super().save(*args, **kwargs)
+
+
+class Address(ContentAddressedModel):
     """Model definition for Address."""
 
     country = models.CharField(
@@ -212,7 +352,7 @@ class Address(ModelBase):
         return self.street
 
 
-class Contact(ModelBase):
+class Contact(ContentAddressedModel):
     """Model definition for Contact."""
 
     full_name = models.CharField(max_length=150, verbose_name=_('Full Name'))
@@ -254,25 +394,106 @@ class Order(ModelBase):
         verbose_name=_('Status'), default=PROCESSING)
 
     ship_to = models.ForeignKey(
-        Address, on_delete=models.CASCADE, verbose_name=_('Ship To'),
+        Address, on_delete=models.PROTECT, verbose_name=_('Ship To'),
         related_name='ship_to_set')
     bill_to = models.ForeignKey(
-        Address, on_delete=models.CASCADE, verbose_name=_('Bill To'),
+        Address, on_delete=models.PROTECT, verbose_name=_('Bill To'),
         related_name='bill_to_set')
     contact = models.ForeignKey(
-        Contact, on_delete=models.CASCADE, verbose_name=_('Contact'),
+        Contact, on_delete=models.PROTECT, verbose_name=_('Contact'),
         related_name='contact_set')
 
+    # Summary of the order lines and contact, kept current on write
+    total = models.DecimalField(
+        verbose_name=_('Total'), max_digits=20, decimal_places=8,
+        default=0)
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, blank=True,
+        verbose_name=_('Currency'))
+    line_count = models.PositiveIntegerField(
+        verbose_name=_('Line Count'), default=0)
+    item_count = models.PositiveIntegerField(
+        verbose_name=_('Item Count'), default=0)
+    contact_name = models.CharField(
+        max_length=150, blank=True, verbose_name=_('Contact Name'))
+
     class Meta:
         """Meta definition for Order."""
 
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [models.Index(fields=['created_timestamp'])]
 
     def __str__(self):
         """Unicode representation of Order."""
         return str(self.id)
 
+    def set_summary(self, order_lines):
+        """Sets the summary fields from ``order_lines`` without saving"""
+        self.total = sum(
+            (line.price * line.quantity for line in order_lines), 0)
+        self.currency = order_lines[0].currency if order_lines else ''
+        self.line_count = len(order_lines)
+        self.item_count = sum(line.quantity for line in order_lines)
+        self.contact_name = self.contact.full_name
+
+    def refresh_summary(self):
+        """Recomputes and stores the summary fields from the database"""
+        self.set_summary(list(self.order_line_set.order_by('ordering')))
+        Order.objects.filter(pk=self.pk).update(
+            total=self.total, currency=self.currency,
+            line_count=self.line_count, item_count=self.item_count,
+            contact_name=self.contact_name)
+
+
+class OrderIntake(ModelBase):
+    """
+    Model definition for an order request queued by POST /api/orders/ in
+    asynchronous intake mode, see store/intake.py.
+    """
+
+    QUEUED = 1
+    PROCESSING = 2
+    DONE = 3
+    FAILED = 4
+
+    STATUS_CHOICES = (
+        (QUEUED, _('Queued')),
+        (PROCESSING, _('Processing')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    handle = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False,
+        verbose_name=_('Handle'))
+    status = models.PositiveIntegerField(
+        choices=STATUS_CHOICES, default=QUEUED, verbose_name=_('Status'))
+    # Order request data as JSON
+    payload = models.TextField(verbose_name=_('Payload'))
+    # Not a foreign key, the order may have moved to the archive
+    order_id = models.IntegerField(
+        null=True, blank=True, unique=True, verbose_name=_('Order'))
+    # Validation errors as JSON when FAILED
+    errors = models.TextField(blank=True, verbose_name=_('Errors'))
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name=_('Attempts'))
+    claimed_by = models.CharField(
+        max_length=100, blank=True, verbose_name=_('Claimed By'))
+    claimed_timestamp = models.DateTimeField(
+        null=True, blank=True, verbose_name=_('Claim Timestamp'))
+
+    class Meta:
+        """Meta definition for OrderIntake."""
+
+        verbose_name = 'Order Intake'
+        verbose_name_plural = 'Order Intakes'
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        """Unicode representation of OrderIntake."""
+        return str(self.handle)
+
 
 class OrderLine(ModelBase):
     """Model definition for OrderLine."""
@@ -300,6 +521,122 @@ class OrderLine(ModelBase):
         return str(self.ordering)
 
 
+class SalesRollup(models.Model):
+    """
+    Units and revenue of the counted orders, archived orders included, per
+    day, SKU and currency. Kept current on write by store/sales.py.
+    """
+
+    day = models.DateField(verbose_name=_('Day'))
+    sku = models.ForeignKey(
+        SKU, on_delete=models.CASCADE, verbose_name=_('SKU'),
+        related_name='sales_rollup_set')
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, verbose_name=_('Currency'))
+    units = models.IntegerField(verbose_name=_('Units'), default=0)
+    revenue = models.DecimalField(
+        verbose_name=_('Revenue'), max_digits=20, decimal_places=8,
+        default=0)
+    line_count = models.IntegerField(verbose_name=_('Line Count'), default=0)
+
+    class Meta:
+        """Meta definition for SalesRollup."""
+
+        verbose_name = 'Sales Rollup'
+        verbose_name_plural = 'Sales Rollups'
+        unique_together = (('day', 'sku', 'currency'),)
+        indexes = [models.Index(fields=['sku', 'day'])]
+
+    def __str__(self):
+        """Unicode representation of SalesRollup."""
+        return '%s %s' % (self.day, self.sku_id)
+
+
+class ArchivedOrder(models.Model):
+    """
+    Model definition for an Order moved out of the Order table by
+    store/archive.py. Keeps the Order's id and timestamps.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    created_timestamp = models.DateTimeField(
+        verbose_name=_('Create Timestamp'))
+    modified_timestamp = models.DateTimeField(
+        verbose_name=_('Modified Timestamp'))
+    status = models.PositiveIntegerField(verbose_name=_('Status'))
+
+    ship_to = models.ForeignKey(
+        Address, on_delete=models.PROTECT, verbose_name=_('Ship To'),
+        related_name='archived_ship_to_set')
+    bill_to = models.ForeignKey(
+        Address, on_delete=models.PROTECT, verbose_name=_('Bill To'),
+        related_name='archived_bill_to_set')
+    contact = models.ForeignKey(
+        Contact, on_delete=models.PROTECT, verbose_name=_('Contact'),
+        related_name='archived_contact_set')
+
+    total = models.DecimalField(
+        verbose_name=_('Total'), max_digits=20, decimal_places=8)
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, blank=True,
+        verbose_name=_('Currency'))
+    line_count = models.PositiveIntegerField(verbose_name=_('Line Count'))
+    item_count = models.PositiveIntegerField(verbose_name=_('Item Count'))
+    contact_name = models.CharField(
+        max_length=150, blank=True, verbose_name=_('Contact Name'))
+
+    # Month of created_timestamp as YYYY-MM
+    period = models.CharField(max_length=7, verbose_name=_('Period'))
+    archived_timestamp = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Archive Timestamp'))
+
+    class Meta:
+        """Meta definition for ArchivedOrder."""
+
+        verbose_name = 'Archived Order'
+        verbose_name_plural = 'Archived Orders'
+        indexes = [
+            models.Index(fields=['created_timestamp']),
+            models.Index(fields=['period', 'created_timestamp']),
+        ]
+
+    def __str__(self):
+        """Unicode representation of ArchivedOrder."""
+        return str(self.id)
+
+
+class ArchivedOrderLine(models.Model):
+    """Model definition for an OrderLine of an ArchivedOrder."""
+
+    id = models.IntegerField(primary_key=True)
+    created_timestamp = models.DateTimeField(
+        verbose_name=_('Create Timestamp'))
+    modified_timestamp = models.DateTimeField(
+        verbose_name=_('Modified Timestamp'))
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, verbose_name=_('Order'),
+        related_name='order_line_set')
+    sku = models.ForeignKey(
+        SKU, on_delete=models.CASCADE, verbose_name=_('SKU'),
+        related_name='archived_order_line_set')
+    price = models.DecimalField(
+        verbose_name=_('Price'), max_digits=8, decimal_places=8)
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, verbose_name=_('Currency'))
+    quantity = models.PositiveIntegerField(verbose_name=_('Quantity'))
+    ordering = models.PositiveIntegerField(verbose_name=_('Ordering'))
+
+    class Meta:
+        """Meta definition for ArchivedOrderLine."""
+
+        verbose_name = 'Archived OrderLine'
+        verbose_name_plural = 'Archived OrderLines'
+
+    def __str__(self):
+        """Unicode representation of ArchivedOrderLine."""
+        return str(self.ordering)
+
+
 # class OrderLineShippingInfo(ModelBase):
 #     """Model definition for OrderLineShippingInfo."""
 
@@ -0,0 +1,44 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.pagination import CursorPagination
+
+
+class StoreCursorPagination(CursorPagination):
+    """
+    Keyset pagination following each viewset's own queryset ordering, so
+    the cursor filter is served by the same index as the ORDER BY and any
+    page costs the same as the first.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Returns the ordering declared on the view's queryset, with the
+        primary key appended when no field of it is unique, so rows that
+        tie keep the same order from one page to the next.
+        """
+        ordering = tuple(queryset.query.order_by)
+        if not ordering:
+            return super().get_ordering(request, queryset, view)
+
+        assert '__' not in ordering[0], (
+            'Cursor pagination needs a plain field as the first ordering of '
+            '{view}.queryset, got "{field}".'.format(
+                view=view.__class__.__name__, field=ordering[0])
+        )
+        opts = queryset.query.model._meta
+        if not any(is_unique(opts, field) for field in ordering):
+            descending = ordering[0].startswith('-')
+            ordering += ('-pk' if descending else 'pk',)
+        return ordering
+
+
+def is_unique(opts, ordering_field):
+    """Returns whether ``ordering_field`` names a unique field of ``opts``"""
+    name = ordering_field.lstrip('-')
+    if name == 'pk':
+        return True
+    try:
+        return opts.get_field(name).unique
+    except FieldDoesNotExist:
+        return False
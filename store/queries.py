@@ -0,0 +1,137 @@
+"""
+Per-request SQL instrumentation and query budgets.
+
+``QueryInspectorMiddleware`` records every statement a request runs: the
+number of queries, the total database time, repeated statements (the
+signature of an N+1) and the slowest statements. Reports are tagged with
+the viewset (or view) and action that served the request.
+
+Viewsets declare what an action may cost in ``query_budget``, e.g.
+``{'list': 2, 'retrieve': 2}``. With ``STORE_QUERY_BUDGET_ENFORCE`` on (as
+in the query budget tests) a request over budget raises
+``QueryBudgetExceeded``; otherwise it is logged as a warning to the
+``store.queries`` logger. A ``STORE_QUERY_LOG_SAMPLE_RATE`` share of all
+reports is logged there as JSON at INFO level. Streaming responses run
+their queries after the middleware returned, so streamed actions (the
+exports) get no budget.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('store.queries')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more queries than its endpoint's budget"""
+
+
+class QueryRecorder(object):
+    """Database execute wrapper recording statements and their duration"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, repr(params), time.perf_counter() - started))
+
+    def report(self, slowest=5):
+        """Returns a JSON serializable summary of the recorded queries"""
+        statements = Counter(sql for sql, params, duration in self.queries)
+        executions = Counter(
+            (sql, params) for sql, params, duration in self.queries)
+        return {
+            'queries': len(self.queries),
+            'db_ms': round(sum(
+                duration for sql, params, duration in self.queries) * 1000, 3),
+            # Same statement and parameters run again
+            'duplicates': sum(count - 1 for count in executions.values()),
+            # Same statement with any parameters, most repeated first
+            'repeated': [
+                {'sql': sql, 'count': count}
+                for sql, count in statements.most_common()
+                if count > 1
+            ][:slowest],
+            'slowest': [
+                {'sql': sql, 'ms': round(duration * 1000, 3)}
+                for sql, params, duration in sorted(
+                    self.queries, key=lambda query: -query[2])[:slowest]
+            ],
+        }
+
+
+def endpoint(request):
+    """
+    Returns ``(view class, action)`` of the view that served ``request``,
+    either may be None.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, None
+
+    view_class = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    method = request.method.lower()
+    if actions:
+        return view_class, actions.get(method)
+    return view_class, method
+
+
+def query_budget(view_class, action):
+    """Returns the number of queries ``action`` may run, or None"""
+    budget = getattr(view_class, 'query_budget', None) or {}
+    return budget.get(action)
+
+
+class QueryInspectorMiddleware(object):
+    """Records the SQL run by each request, see the module docstring"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            started = time.perf_counter()
+            response = self.get_response(request)
+
+        view_class, action = endpoint(request)
+        budget = query_budget(view_class, action)
+        report = recorder.report(
+            getattr(settings, 'STORE_QUERY_LOG_SLOWEST', 5))
+        report.update({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': view_class.__name__ if view_class else None,
+            'action': action,
+            'budget': budget,
+            'total_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+        response.query_report = report
+
+        if budget is not None and report['queries'] > budget:
+            message = '%s.%s ran %d queries, over its budget of %d' % (
+                report['view'], action, report['queries'], budget)
+            if getattr(settings, 'STORE_QUERY_BUDGET_ENFORCE', False):
+                raise QueryBudgetExceeded(
+                    message + ':\n' + '\n'.join(
+                        sql for sql, params, duration in recorder.queries))
+            logger.warning(message, extra={'query_report': report})
+
+        if random.random() < getattr(
+                settings, 'STORE_QUERY_LOG_SAMPLE_RATE', 0):
+            logger.info(json.dumps(report), extra={'query_report': report})
+        return response
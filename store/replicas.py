@@ -0,0 +1,119 @@
+"""
+Read replicas.
+
+``ReplicaRouter`` sends every write, and by default every read, to the
+``default`` database. ``ReplicaMiddleware`` turns replica reads on for the
+requests that only browse: ``GET`` and ``HEAD`` requests served by a
+viewset with ``replica_reads = True`` (the catalog) or by an admin
+changelist. Their reads go to one of the ``STORE_READ_REPLICAS`` aliases,
+picked at random per request.
+
+Replicas lag behind the primary, so reads stay on the primary:
+
+- for ``STORE_REPLICA_STICKY_SECONDS`` after a client wrote, through a
+  cookie set on the response of every unsafe request, so a client reads
+  its own writes;
+- for as long after any catalog change committed, so no process caches
+  what it read from a replica that hasn't seen the change yet (see
+  ``store.versions``).
+
+The window should be longer than the replicas' lag. Locally, replicas are
+SQLite files refreshed from the primary by the ``sync_replicas`` command;
+under test they mirror ``default``.
+"""
+import random
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+COOKIE_NAME = 'store_primary_until'
+
+HOLD_KEY = 'store:replicas:primary_until'
+
+_state = threading.local()
+
+
+def replicas():
+    return list(getattr(settings, 'STORE_READ_REPLICAS', ()))
+
+
+def sticky_seconds():
+    return getattr(settings, 'STORE_REPLICA_STICKY_SECONDS', 5)
+
+
+def hold_cache():
+    """The cache every process reads the hold from, see ``CACHES``"""
+    return caches['shared']
+
+
+def hold_reads():
+    """Keeps every read, in every process, on the primary for the window"""
+    if replicas():
+        hold_cache().set(
+            HOLD_KEY, time.time() + sticky_seconds(), sticky_seconds())
+
+
+class ReplicaRouter(object):
+    """Routes reads to the replica picked for the request, if any"""
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in replicas()
+
+
+def reads_replica(request):
+    """Returns whether the view of ``request`` may read from a replica"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return False
+    if getattr(getattr(match.func, 'cls', None), 'replica_reads', False):
+        return True
+    return 'admin' in match.namespaces and (
+        match.url_name or '').endswith('_changelist')
+
+
+class ReplicaMiddleware(object):
+    """Picks the database a request reads from, see the module docstring"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.alias = None
+
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and \
+                replicas():
+            response.set_cookie(
+                COOKIE_NAME, '%.3f' % (time.time() + sticky_seconds()),
+                max_age=sticky_seconds(), httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        aliases = replicas()
+        if not aliases or not reads_replica(request):
+            return None
+        now = time.time()
+        try:
+            pinned = float(request.COOKIES.get(COOKIE_NAME, 0))
+        except ValueError:
+            pinned = 0
+        if pinned > now or hold_cache().get(HOLD_KEY, 0) > now:
+            return None
+        _state.alias = random.choice(aliases)
+        return None
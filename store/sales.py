@@ -0,0 +1,210 @@
+"""
+Sales rollups.
+
+``SalesRollup`` holds the units, revenue and number of lines sold per day,
+SKU and currency, so sales over a date range are summed from a few rows
+per day instead of every order line; products and categories are reached
+through the SKU. Only orders in ``COUNTED_STATUSES`` count, on the day
+they were created.
+
+The rollups are kept current on write: order creation adds the new lines
+(see ``OrderSerializer.create``), and ``store.signals`` reverses or adds
+back the lines of an order whose status moves out of or into the counted
+statuses, and the old and new values of edited or deleted lines. Every
+change is one upsert adding to the counters, so concurrent writers don't
+lose updates. Archiving doesn't change them. Bulk writes skip all that;
+``rebuild()`` (the ``rebuild_sales_rollups`` command) recomputes the
+rollups from the order lines and archived order lines.
+"""
+import datetime
+from collections import OrderedDict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, Sum)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import *
+
+COUNTED_STATUSES = (
+    Order.PENDING_PAYMENT, Order.PROCESSING, Order.COMPLETED,
+    Order.ON_HOLD)
+
+# Grouping of a report: {name: (key lookup, label lookup)}
+GROUPINGS = OrderedDict((
+    ('day', ('day', None)),
+    ('sku', ('sku', 'sku__number')),
+    ('product', ('sku__product_id', 'sku__product__name')),
+    ('category', (
+        'sku__product__category_id', 'sku__product__category__name')),
+))
+
+REPORT_DAYS = 30
+
+
+def contributions(day, lines, sign=1):
+    """
+    Returns ``{(day, sku id, currency): [units, revenue, line count]}`` of
+    ``lines`` (OrderLines, or their field values), negated with ``sign``
+    -1.
+    """
+    counters = {}
+    for line in lines:
+        if isinstance(line, dict):
+            sku_id, currency = line['sku_id'], line['currency']
+            price, quantity = line['price'], line['quantity']
+        else:
+            sku_id, currency = line.sku_id, line.currency
+            price, quantity = line.price, line.quantity
+        counter = counters.setdefault(
+            (day, sku_id, currency), [0, Decimal(0), 0])
+        counter[0] += sign * quantity
+        counter[1] += sign * price * quantity
+        counter[2] += sign
+    return counters
+
+
+def apply(counters):
+    """Adds ``counters`` (see ``contributions()``) to the rollups"""
+    counters = {key: value for key, value in counters.items() if any(value)}
+    if not counters:
+        return
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        for (day, sku_id, currency), (units, revenue, lines) in \
+                counters.items():
+            updated = SalesRollup.objects.filter(
+                day=day, sku_id=sku_id, currency=currency
+            ).update(
+                units=F('units') + units, revenue=F('revenue') + revenue,
+                line_count=F('line_count') + lines)
+            if not updated:
+                SalesRollup.objects.create(
+                    day=day, sku_id=sku_id, currency=currency, units=units,
+                    revenue=revenue, line_count=lines)
+        return
+
+    fields = [SalesRollup._meta.get_field(name) for name in (
+        'day', 'sku', 'currency', 'units', 'revenue', 'line_count')]
+    rows = list(counters.items())
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    for offset in range(0, len(rows), batch_size):
+        upsert(fields, rows[offset:offset + batch_size])
+
+
+def upsert(fields, rows):
+    """Adds ``rows`` of counters in one ``INSERT ... ON CONFLICT``"""
+    params = []
+    for key, value in rows:
+        params.extend(
+            field.get_db_prep_save(value, connection)
+            for field, value in zip(fields, key + tuple(value)))
+    quote_name = connection.ops.quote_name
+    table = quote_name(SalesRollup._meta.db_table)
+    columns = [quote_name(field.column) for field in fields]
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO UPDATE SET '
+            '%s' % (
+                table, ', '.join(columns), ', '.join([row] * len(rows)),
+                ', '.join(columns[:3]),
+                ', '.join(
+                    '%s = %s.%s + excluded.%s' % (
+                        column, table, column, column)
+                    for column in columns[3:])),
+            params)
+
+
+def day_of(timestamp):
+    """Returns the day an order created at ``timestamp`` counts on"""
+    return timezone.localtime(timestamp).date()
+
+
+def record(order, lines, sign=1):
+    """Adds (or with ``sign`` -1 removes) the lines of a counted order"""
+    if order.status in COUNTED_STATUSES:
+        apply(contributions(day_of(order.created_timestamp), lines, sign))
+
+
+def status_changed(order, old_status):
+    """Adds or reverses the lines of an order whose status changed"""
+    was_counted = old_status in COUNTED_STATUSES
+    if was_counted == (order.status in COUNTED_STATUSES):
+        return
+    lines = order.order_line_set.values(
+        'sku_id', 'currency', 'price', 'quantity')
+    apply(contributions(
+        day_of(order.created_timestamp), lines, -1 if was_counted else 1))
+
+
+def rebuild():
+    """
+    Recomputes every rollup from the order lines. Writes that run at the
+    same time may be counted twice or not at all, run it while orders
+    are quiet.
+    """
+    counters = {}
+    for line_model in (OrderLine, ArchivedOrderLine):
+        rows = line_model.objects.filter(
+            order__status__in=COUNTED_STATUSES
+        ).annotate(
+            day=TruncDate('order__created_timestamp')
+        ).values(
+            'day', 'sku_id', 'currency'
+        ).annotate(
+            units=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(
+                F('price') * F('quantity'), output_field=DecimalField(
+                    max_digits=20, decimal_places=8))),
+            lines=Count('pk'),
+        ).order_by()
+        for row in rows.iterator():
+            counter = counters.setdefault(
+                (row['day'], row['sku_id'], row['currency']),
+                [0, Decimal(0), 0])
+            counter[0] += row['units']
+            counter[1] += row['revenue']
+            counter[2] += row['lines']
+
+    rollups = [
+        SalesRollup(
+            day=day, sku_id=sku_id, currency=currency, units=units,
+            revenue=revenue, line_count=lines)
+        for (day, sku_id, currency), (units, revenue, lines) in
+        counters.items()
+    ]
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create(
+            rollups, batch_size=connection.ops.bulk_batch_size(
+                SalesRollup._meta.concrete_fields, rollups))
+    return len(rollups)
+
+
+def default_range():
+    """Returns the first and last day of the default report range"""
+    until = timezone.localdate()
+    return until - datetime.timedelta(days=REPORT_DAYS - 1), until
+
+
+def report(rollups, by='day', limit=None):
+    """
+    Returns the units, revenue and line count of ``rollups`` summed per
+    ``by`` (one of ``GROUPINGS``) and currency, by day or by revenue.
+    """
+    key, label = GROUPINGS[by]
+    expressions = {}
+    if key != by:
+        expressions[by] = F(key)
+    if label is not None:
+        expressions['name'] = F(label)
+    rows = rollups.values(
+        *([by] if key == by else []), 'currency', **expressions
+    ).annotate(
+        units=Sum('units'), revenue=Sum('revenue'),
+        line_count=Sum('line_count'))
+    if by == 'day':
+        rows = rows.order_by('day', 'currency')
+    else:
+        rows = rows.order_by('-revenue', by, 'currency')
+    return list(rows[:limit] if limit else rows)
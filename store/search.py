@@ -0,0 +1,251 @@
+"""
+Full-text search over SKUs.
+
+Every SKU is indexed as one document made of its product's name,
+description and manufacturer, the path of the product's category, the
+names of the SKU's attributes and the SKU's number. Backends are pluggable
+through the ``STORE_SEARCH_BACKEND`` setting; the default is a SQLite FTS5
+table living in the store database. The index is kept current by the
+receivers in ``store.signals``.
+"""
+import abc
+import re
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, Func, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from .models import ProductCategory, SKU
+
+# Number of SKU ids loaded per query while building documents
+CHUNK_SIZE = 500
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """Yields successive lists of at most ``size`` values"""
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build_documents(sku_model, category_model, sku_ids):
+    """
+    Yields ``(sku_id, fields)`` pairs for the given SKUs, where ``fields``
+    maps every indexed field to its text.
+
+    Models are passed in so migrations can index with historical models.
+    """
+    categories = {
+        pk: (parent_id, name)
+        for pk, parent_id, name in category_model.objects.values_list(
+            'pk', 'parent_id', 'name')
+    }
+
+    def category_path(category_id):
+        names = []
+        while category_id in categories:
+            category_id, name = categories[category_id]
+            names.append(name)
+        return ' / '.join(reversed(names))
+
+    through = sku_model.attributes.through
+    for chunk in chunks(sku_ids):
+        attribute_names = defaultdict(list)
+        for sku_id, name in through.objects.filter(
+                sku_id__in=chunk).values_list('sku_id', 'attribute__name'):
+            attribute_names[sku_id].append(name)
+
+        rows = sku_model.objects.filter(pk__in=chunk).values_list(
+            'pk', 'number', 'product__name', 'product__description',
+            'product__manufacturer', 'product__category_id')
+        for pk, number, name, description, manufacturer, category_id in rows:
+            yield pk, {
+                'product_name': name,
+                'description': description,
+                'manufacturer': manufacturer,
+                'category_path': category_path(category_id),
+                'attribute_names': ' '.join(attribute_names[pk]),
+                'number': number,
+            }
+
+
+class SearchBackend(abc.ABC):
+    """Interface of SKU search index backends"""
+
+    # Indexed fields and their weight in ranking
+    FIELDS = (
+        ('product_name', 10.0),
+        ('description', 1.0),
+        ('manufacturer', 3.0),
+        ('category_path', 2.0),
+        ('attribute_names', 5.0),
+        ('number', 10.0),
+    )
+
+    def is_available(self, connection):
+        """Whether the backend works on the given database connection"""
+        return True
+
+    @abc.abstractmethod
+    def install(self, connection):
+        """Creates the index storage"""
+
+    @abc.abstractmethod
+    def uninstall(self, connection):
+        """Drops the index storage"""
+
+    @abc.abstractmethod
+    def index(self, documents):
+        """Adds or replaces ``(sku_id, fields)`` documents"""
+
+    @abc.abstractmethod
+    def remove(self, sku_ids):
+        """Removes the documents of the given SKUs"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Removes every document"""
+
+    @abc.abstractmethod
+    def filter(self, queryset, query):
+        """
+        Returns the SKUs of ``queryset`` matching ``query``, annotated with
+        their ``search_rank``, lowest for the best match
+        """
+
+
+class Rowids(RawSQL):
+    """A subquery of rowids, for ``__in`` lookups adding the parentheses"""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class BM25Rank(Func):
+    """
+    The bm25 rank, in an FTS5 ``table``, of the row whose rowid is the
+    second expression for the match expression of the first
+    """
+    template = (
+        '(SELECT bm25(%(table)s, %(weights)s) FROM %(table)s '
+        'WHERE %(table)s MATCH %(expressions)s)')
+    arg_joiner = ' AND rowid = '
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """Search index stored in a SQLite FTS5 virtual table"""
+
+    table = 'store_sku_search'
+
+    def is_available(self, connection):
+        return connection.vendor == 'sqlite'
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % (
+                    self.table,
+                    ', '.join(field for field, weight in self.FIELDS)))
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % self.table)
+
+    def index(self, documents):
+        fields = [field for field, weight in self.FIELDS]
+        insert = "INSERT INTO %s (rowid, %s) VALUES (%s)" % (
+            self.table, ', '.join(fields),
+            ', '.join(['%s'] * (len(fields) + 1)))
+
+        with connection.cursor() as cursor:
+            for chunk in chunks(documents):
+                cursor.executemany(
+                    "DELETE FROM %s WHERE rowid = %%s" % self.table,
+                    [[sku_id] for sku_id, document in chunk])
+                cursor.executemany(insert, [
+                    [sku_id] + [document[field] for field in fields]
+                    for sku_id, document in chunk
+                ])
+
+    def remove(self, sku_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM %s WHERE rowid = %%s" % self.table,
+                [[sku_id] for sku_id in sku_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s" % self.table)
+
+    def match_expression(self, query):
+        """
+        Turns user input into an FTS5 query matching every word as a
+        prefix, so results show up while the user is still typing.
+        """
+        words = re.findall(r'\w+', query, re.UNICODE)
+        return ' '.join('"%s"*' % word for word in words)
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+
+        # Subqueries, so the other filters of the queryset narrow the
+        # matches in the same statement
+        return queryset.filter(pk__in=Rowids(
+            "SELECT rowid FROM {table} WHERE {table} MATCH %s".format(
+                table=self.table),
+            [expression])
+        ).annotate(search_rank=BM25Rank(
+            Value(expression), F('pk'), table=self.table,
+            weights=', '.join(str(weight) for field, weight in self.FIELDS),
+            output_field=FloatField()))
+
+
+def get_backend():
+    """
+    Returns the configured search backend, or ``None`` when search should
+    fall back to plain database lookups.
+    """
+    path = getattr(
+        settings, 'STORE_SEARCH_BACKEND', 'store.search.SQLiteFTS5Backend')
+    if not path:
+        return None
+
+    backend = import_string(path)()
+    if not backend.is_available(connection):
+        return None
+    return backend
+
+
+def index_skus(sku_ids):
+    """Indexes the current state of the given SKUs"""
+    backend = get_backend()
+    if backend is not None and sku_ids:
+        backend.index(build_documents(SKU, ProductCategory, sku_ids))
+
+
+def remove_skus(sku_ids):
+    """Drops the given SKUs from the index"""
+    backend = get_backend()
+    if backend is not None and sku_ids:
+        backend.remove(sku_ids)
+
+
+def rebuild(sku_model=SKU, category_model=ProductCategory):
+    """Reindexes every SKU, returns the number of indexed SKUs"""
+    backend = get_backend()
+    if backend is None:
+        return 0
+
+    backend.clear()
+    sku_ids = list(sku_model.objects.values_list('pk', flat=True))
+    backend.index(build_documents(sku_model, category_model, sku_ids))
+    return len(sku_ids)
@@ -1,6 +1,33 @@
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
 from rest_framework import serializers
 from .models import *
+from . import dedup, inventory, sales
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that resolves against instances preloaded into
+    the serializer context, so validating many rows costs a single query.
+    Falls back to a per-value lookup when nothing was preloaded.
+    """
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        preloaded = self.context.get('preloaded', {}).get(model)
+        if preloaded is None:
+            return super().to_internal_value(data)
+
+        try:
+            pk = model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        try:
+            return preloaded[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -70,6 +97,8 @@ class ContactSerializer(serializers.ModelSerializer):
 
 class OrderLineSerializer(serializers.ModelSerializer):
     """Serializer for OrderLine"""
+    sku = PreloadedPrimaryKeyRelatedField(queryset=SKU.objects.all())
+
     class Meta:
         model = OrderLine
         fields = ('id', 'sku', 'price', 'currency', 'quantity', 'ordering',)
@@ -88,6 +117,26 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'status', 'ship_to', 'bill_to', 'contact', 'order_line_set')
 
+    def to_internal_value(self, data):
+        """
+        Load every SKU referenced by the order lines up front.
+        """
+        order_lines_data = (
+            data.get('order_line_set') if isinstance(data, dict) else None)
+        if isinstance(order_lines_data, list):
+            sku_ids = set()
+            for order_line_data in order_lines_data:
+                try:
+                    sku_ids.add(int(order_line_data['sku']))
+                except (KeyError, TypeError, ValueError):
+                    # Left for the field to report
+                    pass
+
+            self.context.setdefault('preloaded', {})[SKU] = (
+                SKU.objects.in_bulk(sku_ids))
+
+        return super().to_internal_value(data)
+
     @transaction.atomic  # Run in single Database transaction
     def create(self, validated_data):
         """
@@ -100,30 +149,62 @@ class OrderSerializer(serializers.ModelSerializer):
         contact_data = validated_data.pop('contact')
         order_lines_data = validated_data.pop('order_line_set')
 
-        # Create FK instances
-        ship_to = AddressSerializer.create(
-            AddressSerializer(), validated_data=ship_to_data)
-        bill_to = AddressSerializer.create(
-            AddressSerializer(), validated_data=bill_to_data)
-        contact = ContactSerializer.create(
-            ContactSerializer(), validated_data=contact_data
-        )
-
-        # Create order
-        order, created = Order.objects.update_or_create(
+        # Reserve stock for every line in one guarded statement. Raises
+        # before anything is written if any SKU can't cover its lines.
+        reserved = inventory.reserve(
+            (order_line_data['sku'], order_line_data['quantity'])
+            for order_line_data in order_lines_data)
+
+        # Reuse the stored addresses and contact with the same content
+        ship_to, bill_to = dedup.upsert(
+            Address, [ship_to_data, bill_to_data])
+        contact, = dedup.upsert(Contact, [contact_data])
+
+        # Create order with its summary, the lines don't exist yet
+        order = Order(
             ship_to=ship_to, bill_to=bill_to, contact=contact,
             **validated_data)
+        order_lines = [
+            OrderLine(**order_line_data)
+            for order_line_data in order_lines_data]
+        order.set_summary(order_lines)
+        order.save()
+
+        # Create Reverse related OrderLines in a single insert
+        for order_line in order_lines:
+            order_line.order = order
+        OrderLine.objects.bulk_create(order_lines)
+        inventory.record_sale(order, reserved)
+        sales.record(order, order_lines)
+
+        return order
 
-        # Create Reverse related OrderLines
-        for order_line_data in order_lines_data:
-            order_line_data['order'] = order
-            order_line = OrderLineSerializer.create(
-                OrderLineSerializer(),
-                validated_data=order_line_data)
 
-            # Update the available quantity for this SKU
-            order_line.sku.quantity = (
-                order_line.sku.quantity - order_line.quantity)
-            order_line.sku.save()
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Read only Serializer for the Order summary fields"""
 
-        return order
+    class Meta:
+        model = Order
+        fields = (
+            'id', 'status', 'created_timestamp', 'contact_name',
+            'line_count', 'item_count', 'total', 'currency')
+        read_only_fields = fields
+
+
+class OrderIntakeSerializer(serializers.ModelSerializer):
+    """Read only Serializer for a queued order request"""
+
+    status_url = serializers.HyperlinkedIdentityField(
+        view_name='orderintake-detail', lookup_field='handle')
+    order = serializers.IntegerField(source='order_id', read_only=True)
+    errors = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderIntake
+        fields = (
+            'handle', 'status', 'status_url', 'order', 'errors',
+            'created_timestamp', 'modified_timestamp')
+        read_only_fields = fields
+
+    def get_errors(self, intake):
+        return json.loads(intake.errors) if intake.errors else None
@@ -0,0 +1,192 @@
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from mptt.signals import node_moved
+from . import inventory, sales, search
+from .attribute_index import attribute_index
+from .cache import response_cache
+from .category_tree import category_tree
+from .fragments import fragment_cache
+from .models import *
+
+
+@receiver(m2m_changed, sender=SKU.attributes.through)
+def sku_attributes_changed(sender, action, **kwargs):
+    """Invalidate the attribute index when SKU attributes change"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        attribute_index.invalidate()
+
+
+@receiver(post_delete, sender=SKU)
+@receiver(post_delete, sender=Attribute)
+def attribute_index_row_deleted(sender, **kwargs):
+    """Invalidate the attribute index when SKUs or attributes go away"""
+    attribute_index.invalidate()
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Attribute)
+@receiver(post_save, sender=AttributeType)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=SKU)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_delete, sender=AttributeType)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(node_moved, sender=ProductCategory)
+def catalog_changed(sender, **kwargs):
+    """Invalidate cached responses and fragments built from the model"""
+    response_cache.invalidate_model(sender)
+    fragment_cache.invalidate_model(sender)
+
+
+@receiver(m2m_changed, sender=SKU.attributes.through)
+def catalog_attributes_changed(sender, action, **kwargs):
+    """Invalidate cached responses and fragments listing SKU attributes"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        response_cache.invalidate_model(SKU)
+        response_cache.invalidate_model(Attribute)
+        fragment_cache.invalidate(SKU)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(node_moved, sender=ProductCategory)
+def category_tree_changed(sender, **kwargs):
+    """Rebuild the category tree and its product counts on next read"""
+    category_tree.invalidate()
+
+
+@receiver(post_save, sender=SKU)
+def search_sku_saved(sender, instance, **kwargs):
+    """Reindex a saved SKU"""
+    search.index_skus([instance.pk])
+
+
+@receiver(post_delete, sender=SKU)
+def search_sku_deleted(sender, instance, **kwargs):
+    """Drop a deleted SKU from the search index"""
+    search.remove_skus([instance.pk])
+
+
+@receiver(m2m_changed, sender=SKU.attributes.through)
+def search_sku_attributes_changed(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    """Reindex SKUs whose attributes changed"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search.index_skus([instance.pk])
+    elif action == 'pre_clear':
+        instance._search_sku_ids = list(
+            instance.sku_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        search.index_skus(instance._search_sku_ids)
+    elif action in ('post_add', 'post_remove'):
+        search.index_skus(list(pk_set))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Attribute)
+def search_sku_relation_saved(sender, instance, **kwargs):
+    """Reindex the SKUs of a saved product or attribute"""
+    search.index_skus(list(instance.sku_set.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Attribute)
+def search_attribute_deleting(sender, instance, **kwargs):
+    """Remember the SKUs of an attribute about to be deleted"""
+    instance._search_sku_ids = list(
+        instance.sku_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Attribute)
+def search_attribute_deleted(sender, instance, **kwargs):
+    """Reindex the SKUs that lost a deleted attribute"""
+    search.index_skus(getattr(instance, '_search_sku_ids', []))
+
+
+@receiver(post_save, sender=ProductCategory)
+def search_category_saved(sender, instance, **kwargs):
+    """Reindex SKUs whose category path runs through a saved category"""
+    search.index_skus(list(SKU.objects.filter(
+        product__category__in=instance.get_descendants(include_self=True)
+    ).values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=OrderLine)
+@receiver(post_delete, sender=OrderLine)
+def order_line_changed(sender, instance, raw=False, **kwargs):
+    """Keep the summary of the line's order current"""
+    if raw:
+        return
+    order = Order.objects.select_related('contact').filter(
+        pk=instance.order_id).first()
+    if order is not None:
+        order.refresh_summary()
+
+
+@receiver(post_save, sender=Contact)
+def order_contact_saved(sender, instance, created, raw=False, **kwargs):
+    """Copy a renamed contact to the summary of its orders"""
+    if not raw and not created:
+        Order.objects.filter(contact=instance).exclude(
+            contact_name=instance.full_name
+        ).update(contact_name=instance.full_name)
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance, raw=False, **kwargs):
+    """Remember the stored status of an order about to be saved"""
+    if not raw and instance.pk is not None:
+        instance._stored_status = Order.objects.filter(
+            pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def sales_order_saved(sender, instance, created, raw=False, **kwargs):
+    """Add or reverse the sales of an order moved in or out of counting"""
+    old_status = getattr(instance, '_stored_status', None)
+    if not raw and not created and old_status is not None:
+        sales.status_changed(instance, old_status)
+
+
+@receiver(post_save, sender=Order)
+def inventory_order_saved(sender, instance, created, raw=False, **kwargs):
+    """Put back the stock of an order that was just refunded"""
+    old_status = getattr(instance, '_stored_status', None)
+    if not raw and not created and old_status not in (
+            None, Order.REFUNDED) and instance.status == Order.REFUNDED:
+        inventory.refund(instance)
+
+
+@receiver(pre_save, sender=OrderLine)
+def sales_line_saving(sender, instance, raw=False, **kwargs):
+    """Remember the stored values of an order line about to be saved"""
+    if not raw and instance.pk is not None:
+        instance._sales_line = OrderLine.objects.filter(
+            pk=instance.pk).values(
+                'sku_id', 'currency', 'price', 'quantity').first()
+
+
+@receiver(post_save, sender=OrderLine)
+def sales_line_saved(sender, instance, raw=False, **kwargs):
+    """Replace the sales of an order line by its new values"""
+    if raw:
+        return
+    order = Order.objects.filter(pk=instance.order_id).first()
+    if order is not None:
+        old_line = getattr(instance, '_sales_line', None)
+        if old_line is not None:
+            sales.record(order, [old_line], -1)
+        sales.record(order, [instance])
+
+
+@receiver(post_delete, sender=OrderLine)
+def sales_line_deleted(sender, instance, **kwargs):
+    """Reverse the sales of a deleted order line"""
+    order = Order.objects.filter(pk=instance.order_id).first()
+    if order is not None:
+        sales.record(order, [instance], -1)
@@ -1,19 +1,107 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
 from decimal import Decimal
-from django.test import TestCase
+from unittest import mock
+from io import StringIO
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import (
+    DEFAULT_DB_ALIAS, connection, connections, OperationalError,
+    transaction)
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.db.models import Prefetch
-from rest_framework import status
-from rest_framework.test import APITestCase, URLPatternsTestCase
-from store import models
+from django.forms import modelform_factory
+from rest_framework import serializers, status
+from rest_framework.test import APIClient, APITestCase
+from store import (
+    archive, catalog_import, db_profile, index_advisor, intake, inventory,
+    models, pagination, replicas, versions, views)
+from store.cache import response_cache
+from store.category_tree import category_tree
+from store.fragments import fragment_cache
+from store.queries import QueryBudgetExceeded
+from store.serializers import OrderSerializer
 
 # Create your tests here.
 
 
-class OrdersApITests(APITestCase):
+@contextmanager
+def capture_on_commit_callbacks(using=DEFAULT_DB_ALIAS, execute=False):
+    """
+    Collects the on_commit callbacks registered in the block, which the
+    test's transaction never commits, and runs them with ``execute``. Like
+    ``TestCase.captureOnCommitCallbacks()`` of later Django versions.
+    """
+    callbacks = []
+    start_count = len(connections[using].run_on_commit)
+    try:
+        yield callbacks
+    finally:
+        callbacks[:] = [
+            callback for _, callback in
+            connections[using].run_on_commit[start_count:]]
+        if execute:
+            for callback in callbacks:
+                callback()
+
+
+def order_post_data(order_lines):
+    """Returns a valid order payload for the given (sku, quantity) lines"""
+    return {
+        'bill_to': {
+            'country': 'USA',
+            'street': 'street1',
+            'city': 'city1',
+            'state': 'state1',
+            'postal_code': '1234'
+        },
+        'ship_to': {
+            'country': 'UK',
+            'street': 'street2',
+            'city': 'city2',
+            'state': 'state2',
+            'postal_code': '5678'
+        },
+        'contact': {
+            'full_name': 'Full Name',
+            'email': 'email@example.com'
+        },
+        'order_line_set': [
+            {
+                'sku': str(sku),
+                'price': '0.0050',
+                'currency': 'BTC',
+                'quantity': str(quantity),
+                'ordering': str(ordering)
+            }
+            for ordering, (sku, quantity) in enumerate(order_lines, 1)
+        ]
+    }
+
+
+@override_settings(STORE_QUERY_LOG_SAMPLE_RATE=0)
+class StoreAPITestCase(APITestCase):
+    """Starts every test with a small catalog"""
 
     base_url = reverse('order-list')
 
     def setUp(self):
+        # The test's transaction never commits, publish the catalog to the
+        # caches
+        with capture_on_commit_callbacks(execute=True):
+            self.create_catalog()
+
+    def create_catalog(self):
         parent_category = models.ProductCategory.objects.create(
             parent=None, name="category_parent", description="Parent Category")
 
@@ -88,6 +176,10 @@ class OrdersApITests(APITestCase):
         #     ship_to=ship_to, bill_to=bill_to, contact=contact
         # )
 
+
+class OrdersApITests(StoreAPITestCase):
+    """Takes orders through the API"""
+
     def test_POSTing_a_new_order(self):
         post_data = {
             'bill_to': {
@@ -258,10 +350,1570 @@ class OrdersApITests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_POSTing_a_new_order_reserves_stock(self):
+        post_data = order_post_data([(1, 1), (2, 2), (1, 3)])
+
+        response = self.client.post(self.base_url, post_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 96)
+        self.assertEqual(models.SKU.objects.get(pk=2).quantity, 98)
+
+    def test_POSTing_a_new_order_exceeding_stock(self):
+        post_data = order_post_data([(1, 1), (2, 101)])
+
+        response = self.client.post(self.base_url, post_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('order_line_set', response.data)
+        self.assertEqual(models.Order.objects.count(), 0)
+        self.assertEqual(models.OrderLine.objects.count(), 0)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 100)
+        self.assertEqual(models.SKU.objects.get(pk=2).quantity, 100)
+
+    def test_POSTing_a_new_order_runs_constant_queries(self):
+        query_counts = []
+        for order_lines in ([(1, 1)], [(1, 1), (2, 1)] * 10):
+            with CaptureQueriesContext(connection) as queries:
+                serializer = OrderSerializer(
+                    data=order_post_data(order_lines))
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(models.OrderLine.objects.count(), 21)
+
+    def test_POSTing_bulk_orders(self):
+        url = reverse('order-bulk')
+        post_data = [
+            order_post_data([(1, 1)]),
+            order_post_data([(2, 500)]),
+            order_post_data([(999, 1)]),
+            order_post_data([(1, 2), (2, 3)]),
+        ]
+
+        response = self.client.post(url, post_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(
+            [result['status'] for result in results],
+            [201, 400, 400, 201])
+        self.assertIn('order_line_set', results[1]['errors'])
+        self.assertIn('order_line_set', results[2]['errors'])
+        self.assertEqual(len(results[3]['order']['order_line_set']), 2)
+        self.assertEqual(models.Order.objects.count(), 2)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 97)
+        self.assertEqual(models.SKU.objects.get(pk=2).quantity, 97)
+
+    def test_POSTing_bulk_orders_not_a_list(self):
+        url = reverse('order-bulk')
+
+        response = self.client.post(
+            url, order_post_data([(1, 1)]), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_GET_orders_newest_first(self):
+        url = reverse('order-list')
+        for order_lines in ([(1, 1)], [(2, 1)], [(1, 2)]):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+
+        response = self.client.get(url, {'page_size': 2}, format='json')
+        first_page = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'], format='json')
+        second_page = [order['id'] for order in response.data['results']]
+
+        self.assertEqual(first_page + second_page, [3, 2, 1])
+
+    def test_GET_orders_runs_constant_queries(self):
+        url = reverse('order-list')
+        query_counts = []
+        for order_lines in ([(1, 1)], [(1, 1), (2, 1)] * 5):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+            response = self.client.get(url, format='json')
+            query_counts.append(response.query_report['queries'])
+
+            order = response.data['results'][0]
+            response = self.client.get(
+                reverse('order-detail', args=(order['id'],)), format='json')
+            self.assertEqual(response.data, order)
+            query_counts.append(response.query_report['queries'])
+
+        self.assertEqual(query_counts, [2, 2, 2, 2])
+
+    def test_GET_order_summaries(self):
+        url = reverse('order-summary')
+        self.client.post(
+            self.base_url, order_post_data([(1, 2), (2, 3)]), format='json')
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = response.data['results'][0]
+        self.assertEqual(summary['contact_name'], 'Full Name')
+        self.assertEqual(summary['line_count'], 2)
+        self.assertEqual(summary['item_count'], 5)
+        self.assertEqual(Decimal(summary['total']), Decimal('0.025'))
+        self.assertEqual(summary['currency'], 'BTC')
+
+        # Summaries follow changes to the lines and the contact
+        order = models.Order.objects.get(pk=summary['id'])
+        order.order_line_set.get(ordering=1).delete()
+        order.contact.full_name = 'New Name'
+        order.contact.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.contact_name, 'New Name')
+        self.assertEqual(order.line_count, 1)
+        self.assertEqual(order.item_count, 3)
+        self.assertEqual(order.total, Decimal('0.015'))
+
+
+class CatalogApiTests(StoreAPITestCase):
+    """Reads the catalog through the API"""
+
     def test_GET_products(self):
 
         url = reverse('product-list')
 
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 3)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_GET_skus_walks_cursor_pages(self):
+        url = reverse('sku-list')
+        numbers = []
+
+        response = self.client.get(url, {'page_size': 1}, format='json')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 1)
+            numbers.extend(sku['number'] for sku in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'], format='json')
+
+        self.assertEqual(numbers, ['PR-RD-LG', 'PR-RD-SM'])
+
+    def test_GET_products_walks_cursor_pages_over_tied_names(self):
+        category = models.ProductCategory.objects.get(name='category_child')
+        for description in ('Product 4', 'Product 5'):
+            models.Product.objects.create(
+                name='Product', description=description,
+                manufacturer='WidgetFactory', category=category)
+        url = reverse('product-list')
+        descriptions = []
+
+        response = self.client.get(url, {'page_size': 1}, format='json')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            descriptions.extend(
+                product['description']
+                for product in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'], format='json')
+
+        self.assertEqual(descriptions, [
+            'Product 1', 'Product 4', 'Product 5', 'Product 2', 'Product 3'])
+
+    def test_cursor_pagination_breaks_ties_on_the_primary_key(self):
+        paginator = pagination.StoreCursorPagination()
+        orderings = [
+            (models.Product.objects.order_by('name'), ('name', 'pk')),
+            (models.Order.objects.order_by('-created_timestamp'),
+             ('-created_timestamp', '-pk')),
+            (models.OrderIntake.objects.order_by('handle'), ('handle',)),
+            (models.SKU.objects.order_by('number', 'id'), ('number', 'id')),
+        ]
+        for queryset, ordering in orderings:
+            self.assertEqual(
+                paginator.get_ordering(None, queryset, None), ordering)
+
+    def test_GET_catalog_fast_read_is_identical(self):
+        urls = [
+            reverse('sku-list'),
+            reverse('sku-list') + '?page_size=1',
+            reverse('sku-detail', args=(2,)),
+            reverse('product-list'),
+            reverse('product-detail', args=(1,)),
+            reverse('attribute-list'),
+            reverse('attribute-detail', args=(3,)),
+        ]
+
+        for url in urls:
+            regular = self.client.get(url, HTTP_ACCEPT='application/json')
+            with override_settings(STORE_FAST_READ_SERIALIZERS=True):
+                # Bypass cached regular responses
+                response_cache.cache.clear()
+                fast = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast['X-Cache'], 'MISS')
+            self.assertEqual(fast.content, regular.content, url)
+
+        with override_settings(STORE_FAST_READ_SERIALIZERS=True):
+            response = self.client.get(reverse('sku-detail', args=(99,)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        for setting in ('STORE_FAST_READ_SERIALIZERS', 'STORE_FRAGMENT_CACHE'):
+            with override_settings(**{setting: True}):
+                response = self.client.get(
+                    reverse('sku-detail', args=('abc',)))
+            self.assertEqual(
+                response.status_code, status.HTTP_404_NOT_FOUND, setting)
+
+
+class AttributeIndexTests(StoreAPITestCase):
+    """Filters and counts SKUs by attribute"""
+
+    def test_GET_skus_filtered_by_attributes(self):
+        url = reverse('sku-list')
+        small, large, red = models.Attribute.objects.order_by('id')
+
+        def numbers(attributes):
+            response = self.client.get(
+                url, {'attributes': attributes}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [sku['number'] for sku in response.data['results']]
+
+        self.assertEqual(numbers('%d' % red.pk), ['PR-RD-LG', 'PR-RD-SM'])
+        self.assertEqual(
+            numbers('%d,%d' % (small.pk, red.pk)), ['PR-RD-SM'])
+        self.assertEqual(numbers('%d,%d' % (small.pk, large.pk)), [])
+
+        # The index follows attribute changes
+        with capture_on_commit_callbacks(execute=True):
+            models.SKU.objects.get(number='PR-RD-LG').attributes.add(small)
+        self.assertEqual(
+            numbers('%d,%d' % (small.pk, large.pk)), ['PR-RD-LG'])
+
+    def test_GET_facets(self):
+        url = reverse('facet-list')
+        small, large, red = models.Attribute.objects.order_by('id')
+
+        # Product lookup by the filter, then the aggregate
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                url, {'product_id': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': red.type_id, 'name': 'Finish', 'attributes': [
+                {'id': red.pk, 'name': 'Red', 'sku_count': 2},
+            ]},
+            {'id': small.type_id, 'name': 'Size', 'attributes': [
+                {'id': large.pk, 'name': 'Large', 'sku_count': 1},
+                {'id': small.pk, 'name': 'Small', 'sku_count': 1},
+            ]},
+        ])
+
+        response = self.client.get(
+            url, {'attributes': '%d' % small.pk}, format='json')
+        self.assertEqual(
+            [(facet['name'], [attribute['name']
+                              for attribute in facet['attributes']])
+             for facet in response.data],
+            [('Finish', ['Red']), ('Size', ['Small'])])
+
+        response = self.client.get(url, {'product_id': 2}, format='json')
+        self.assertEqual(response.data, [])
+
+
+class CacheTests(StoreAPITestCase):
+    """Caches catalog responses until the catalog changes"""
+
+    def test_cache_versions_change_once_committed(self):
+        token = versions.get('attribute_index')
+        with capture_on_commit_callbacks() as callbacks:
+            models.SKU.objects.get(number='PR-RD-LG').attributes.clear()
+        self.assertEqual(versions.get('attribute_index'), token)
+        for callback in callbacks:
+            callback()
+        bumped = versions.get('attribute_index')
+        self.assertNotEqual(bumped, token)
+
+        # A rolled back savepoint drops its bumps
+        with capture_on_commit_callbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    versions.bump('attribute_index')
+                    raise OperationalError
+            except OperationalError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(versions.get('attribute_index'), bumped)
+
+        # A lost token is replaced by a new one, never an earlier one
+        versions.shared_cache().delete(versions.key('attribute_index'))
+        self.assertNotIn(versions.get('attribute_index'), (token, bumped))
+
+    def test_GET_products_served_from_cache(self):
+        url = reverse('product-detail', args=(1,))
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['name'], 'Product')
+
+        product = models.Product.objects.get(pk=1)
+        product.name = 'Renamed'
+        with capture_on_commit_callbacks(execute=True):
+            product.save()
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Renamed')
+
+    def test_GET_cache_stats_requires_staff(self):
+        response = self.client.get(reverse('cache-stats'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SearchTests(StoreAPITestCase):
+    """Searches SKUs through the search index"""
+
+    def test_GET_skus_search(self):
+        url = reverse('sku-list')
+
+        def numbers(query):
+            response = self.client.get(url, {'search': query}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [sku['number'] for sku in response.data['results']]
+
+        self.assertEqual(numbers('sma'), ['PR-RD-SM'])
+        self.assertEqual(sorted(numbers('red widget')),
+                         ['PR-RD-LG', 'PR-RD-SM'])
+        self.assertEqual(numbers('category_child larg'), ['PR-RD-LG'])
+        self.assertEqual(numbers('blue'), [])
+        # SKU numbers are indexed too
+        self.assertEqual(numbers('PR-RD-LG'), ['PR-RD-LG'])
+        self.assertEqual(numbers('rd-sm'), ['PR-RD-SM'])
+
+        # Other filters narrow the matches in the same query
+        small = models.Attribute.objects.get(name='Small')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url, {'search': 'red', 'attributes': small.pk})
+        self.assertEqual(
+            [sku['number'] for sku in response.data['results']],
+            ['PR-RD-SM'])
+        self.assertEqual(
+            len([query for query in queries if 'MATCH' in query['sql']]), 1)
+
+        # Matches are paged in rank order
+        response = self.client.get(url, {'search': 'red', 'page_size': 1})
+        paged = [sku['number'] for sku in response.data['results']]
+        response = self.client.get(response.data['next'])
+        paged += [sku['number'] for sku in response.data['results']]
+        self.assertEqual(paged, numbers('red'))
+        self.assertEqual(sorted(paged), ['PR-RD-LG', 'PR-RD-SM'])
+
+        # The index follows catalog changes
+        attribute = models.Attribute.objects.get(name='Large')
+        attribute.name = 'Huge'
+        attribute.save()
+        self.assertEqual(numbers('huge'), ['PR-RD-LG'])
+        self.assertEqual(numbers('large'), [])
+
+
+class FragmentTests(StoreAPITestCase):
+    """Assembles catalog responses from cached rows"""
+
+    def test_GET_catalog_from_fragments(self):
+        fragment_cache.clear()
+        urls = [
+            reverse('sku-list'),
+            reverse('sku-list') + '?page_size=1',
+            reverse('sku-detail', args=(2,)),
+            reverse('product-list'),
+            reverse('product-detail', args=(1,)),
+            reverse('attribute-list'),
+            reverse('attribute-detail', args=(3,)),
+        ]
+
+        for url in urls:
+            for accept in ('application/json', 'application/json; indent=2'):
+                response_cache.cache.clear()
+                regular = self.client.get(url, HTTP_ACCEPT=accept)
+                with override_settings(STORE_FRAGMENT_CACHE=True):
+                    response_cache.cache.clear()
+                    assembled = self.client.get(url, HTTP_ACCEPT=accept)
+                self.assertEqual(assembled.status_code, status.HTTP_200_OK)
+                self.assertEqual(assembled.content, regular.content, url)
+
+        stats = fragment_cache.stats()
+        self.assertEqual(
+            stats['sku'], {'hits': 6, 'misses': 2, 'hit_rate': 0.75})
+        self.assertEqual(stats['product']['misses'], 3)
+        self.assertEqual(stats['entries'], 8)
+
+        url = reverse('sku-detail', args=(1,))
+        with override_settings(STORE_FRAGMENT_CACHE=True):
+            product = models.Product.objects.get(pk=1)
+            product.name = 'Renamed'
+            with capture_on_commit_callbacks(execute=True):
+                product.save()
+            data = json.loads(self.client.get(url).content.decode())
+            self.assertEqual(data['product']['name'], 'Renamed')
+
+            attribute = models.Attribute.objects.get(name='Small')
+            attribute.name = 'Tiny'
+            with capture_on_commit_callbacks(execute=True):
+                attribute.save()
+            data = json.loads(self.client.get(url).content.decode())
+            self.assertEqual(
+                [row['name'] for row in data['attributes']], ['Red', 'Tiny'])
+
+            with capture_on_commit_callbacks(execute=True):
+                models.SKU.objects.get(pk=1).attributes.remove(attribute)
+            data = json.loads(self.client.get(url).content.decode())
+            self.assertEqual(
+                [row['name'] for row in data['attributes']], ['Red'])
+
+            fragment_cache.clear()
+            evictions = fragment_cache.stats()['evictions']
+            with override_settings(STORE_FRAGMENT_CACHE_MAX_BYTES=400):
+                response = self.client.get(reverse('product-list'))
+            self.assertEqual(len(response.data['results']), 3)
+            stats = fragment_cache.stats()
+            self.assertEqual(stats['entries'], 1)
+            self.assertEqual(stats['evictions'] - evictions, 2)
+
+
+class SparseFieldsetTests(StoreAPITestCase):
+    """Answers only the fields asked for"""
+
+    def test_GET_sparse_fieldsets(self):
+        url = reverse('sku-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url, {'fields': 'id,number,price,product.name'},
+                format='json')
+        self.assertEqual(
+            response.data['results'][0],
+            {'id': 2, 'number': 'PR-RD-LG', 'product': {'name': 'Product'},
+             'price': '0.00059000'})
+        # One query, without the product's other columns or the attributes
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('manufacturer', queries[0]['sql'])
+
+        response = self.client.get(
+            url, {'omit': 'url,product,attributes.id'}, format='json')
+        self.assertEqual(
+            list(response.data['results'][0]),
+            ['id', 'number', 'price', 'currency', 'attributes'])
+        self.assertEqual(
+            response.data['results'][0]['attributes'], [
+                {'name': 'Red'}, {'name': 'Large'}])
+
+        response = self.client.get(
+            url, {'fields': 'id,product.price'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data, {'fields': ['Unknown field "product.price".']})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('attribute-list'), {'fields': 'id,name'},
+                format='json')
+        self.assertEqual(
+            response.data['results'][0], {'id': 2, 'name': 'Large'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
+        # Writes aren't trimmed
+        response = self.client.post(
+            self.base_url + '?fields=id', order_post_data([(1, 1)]),
+            format='json')
+        self.assertIn('order_line_set', response.data)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.base_url, {'fields': 'id,order_line_set.quantity'},
+                format='json')
+        self.assertEqual(
+            response.data['results'],
+            [{'id': 1, 'order_line_set': [{'quantity': 1}]}])
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('price', queries[1]['sql'])
+
+        response = self.client.get(
+            reverse('facet-list'), {'omit': 'attributes'}, format='json')
+        self.assertEqual(
+            response.data, [{'id': 2, 'name': 'Finish'},
+                            {'id': 1, 'name': 'Size'}])
+
+
+@override_settings(STORE_QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(StoreAPITestCase):
+    """Holds every endpoint to its query budget"""
+
+    def test_GET_catalog_within_query_budgets(self):
+        urls = [
+            reverse('sku-list'),
+            reverse('sku-list') + '?product_id=1&search=red',
+            reverse('sku-detail', args=(1,)),
+            reverse('product-list'),
+            reverse('product-detail', args=(1,)),
+            reverse('attribute-list') + '?sku_set__product_id=1',
+            reverse('attribute-detail', args=(1,)),
+            reverse('attributetype-list'),
+            reverse('attributetype-detail', args=(1,)),
+            reverse('facet-list') + '?product_id=1',
+        ]
+
+        for url in urls:
+            # Over budget requests raise QueryBudgetExceeded
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsNotNone(response.query_report['budget'], url)
+
+        report = response.query_report
+        self.assertEqual(report['view'], 'FacetViewSet')
+        self.assertEqual(report['action'], 'list')
+        self.assertEqual(report['queries'], 2)
+
+    def test_GET_over_query_budget(self):
+        url = reverse('product-list')
+
+        with mock.patch.object(
+                views.ProductViewSet, 'query_budget', {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(url, format='json')
+
+            with override_settings(STORE_QUERY_BUDGET_ENFORCE=False), \
+                    self.assertLogs('store.queries', 'WARNING') as logs:
+                response_cache.cache.clear()
+                response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ProductViewSet.list ran 1 queries', logs.output[0])
+
+    def test_GET_query_reports_are_logged(self):
+        url = reverse('order-list')
+        for order_lines in ([(1, 1)], [(2, 1)]):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+
+        with override_settings(STORE_QUERY_LOG_SAMPLE_RATE=1), \
+                self.assertLogs('store.queries', 'INFO') as logs:
+            self.client.get(url, format='json')
+
+        report = json.loads(logs.records[0].getMessage())
+        self.assertEqual(report['view'], 'OrderViewSet')
+        self.assertEqual(report['action'], 'list')
+        self.assertEqual(report['status'], status.HTTP_200_OK)
+        self.assertEqual(report['queries'], 2)
+        self.assertEqual(len(report['slowest']), 2)
+        self.assertEqual(report['repeated'], [])
+
+
+class ArchiveTests(StoreAPITestCase):
+    """Moves old orders to the archive"""
+
+    def test_GET_orders_reads_archived_orders_by_date(self):
+        url = reverse('order-list')
+        for order_lines in ([(1, 1)], [(2, 1)], [(1, 2), (2, 2)]):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+        now = timezone.now()
+        models.Order.objects.filter(pk=1).update(
+            status=models.Order.COMPLETED,
+            created_timestamp=now - timedelta(days=400))
+        models.Order.objects.filter(pk=3).update(
+            status=models.Order.REFUNDED,
+            created_timestamp=now - timedelta(days=500))
+        models.Order.objects.filter(pk=2).update(
+            created_timestamp=now - timedelta(days=450))
+
+        self.assertEqual(archive.archive_orders(batch_size=1), 2)
+        self.assertEqual(
+            list(models.Order.objects.values_list('pk', flat=True)), [2])
+        self.assertEqual(models.OrderLine.objects.count(), 1)
+        self.assertEqual(models.ArchivedOrderLine.objects.count(), 3)
+        archived = models.ArchivedOrder.objects.get(pk=3)
+        self.assertEqual(archived.line_count, 2)
+        self.assertEqual(archived.period, archive.period(
+            now - timedelta(days=500)))
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(
+            [order['id'] for order in response.data['results']], [2])
+
+        # A date range pages over hot and archived orders
+        after = (now - timedelta(days=1000)).isoformat()
+        response = self.client.get(
+            url, {'created_after': after, 'page_size': 2}, format='json')
+        ids = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'], format='json')
+        ids.extend(order['id'] for order in response.data['results'])
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            len(response.data['results'][0]['order_line_set']), 2)
+
+        response = self.client.get(
+            reverse('order-summary'),
+            {'created_before': (now - timedelta(days=420)).isoformat()},
+            format='json')
+        self.assertEqual(
+            [order['id'] for order in response.data['results']], [2, 3])
+
+        # Archived orders can be read but not changed
+        detail_url = reverse('order-detail', args=(3,))
+        response = self.client.get(detail_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['contact']['full_name'], 'Full Name')
+        response = self.client.delete(detail_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archiving_orders_taken_in_asynchronously(self):
+        order_intake = intake.enqueue(order_post_data([(1, 1)]))
+        intake.drain()
+        order_intake.refresh_from_db()
+        models.Order.objects.filter(pk=order_intake.order_id).update(
+            status=models.Order.COMPLETED,
+            created_timestamp=timezone.now() - timedelta(days=400))
+
+        self.assertEqual(archive.archive_orders(), 1)
+        # SQLite checks the foreign keys on commit
+        connection.check_constraints()
+        order_intake.refresh_from_db()
+        self.assertEqual(order_intake.status, models.OrderIntake.DONE)
+        response = self.client.get(
+            reverse('orderintake-detail', args=(order_intake.handle,)),
+            format='json')
+        self.assertEqual(response.data['order'], order_intake.order_id)
+        self.assertTrue(models.ArchivedOrder.objects.filter(
+            pk=order_intake.order_id).exists())
+
+
+class IndexAdvisorTests(StoreAPITestCase):
+    """Proposes indexes for slow statements"""
+
+    def test_index_advisor_proposes_composite_index(self):
+        collector = index_advisor.QueryCollector()
+        with connection.execute_wrapper(collector):
+            list(models.Order.objects.filter(
+                status=models.Order.COMPLETED
+            ).order_by('-modified_timestamp')[:10])
+
+        reports = index_advisor.advise(collector.statements)
+        self.assertEqual(len(reports), 1)
+        self.assertIn('SCAN store_order', reports[0]['problems'][0])
+        [(model, index)] = reports[0]['proposals']
+        self.assertEqual(model, models.Order)
+        self.assertEqual(index.fields, ['status', 'modified_timestamp'])
+        self.assertEqual(
+            index_advisor.plan_problems(reports[0]['plan_after']), [])
+
+        # The index was only tried out
+        self.assertNotIn(
+            ['status', 'modified_timestamp'],
+            index_advisor.existing_indexes('store_order'))
+
+    def test_index_advisor_finds_full_scans(self):
+        sql, params = models.SKU.objects.filter(
+            currency='BTC', price__gt=1).query.sql_with_params()
+        plan = index_advisor.query_plan(sql, params)
+
+        self.assertEqual(
+            index_advisor.problem_tables(sql, plan), {'store_sku'})
+        # Equality first, then the range
+        self.assertEqual(
+            index_advisor.candidate_columns(sql, 'store_sku'),
+            ['currency', 'price'])
+
+    def test_index_advisor_finds_temp_b_trees(self):
+        sql, params = models.OrderLine.objects.filter(
+            order_id=1).order_by('quantity').query.sql_with_params()
+        plan = index_advisor.query_plan(sql, params)
+        self.assertIn('USE TEMP B-TREE FOR ORDER BY', plan)
+        self.assertEqual(
+            index_advisor.problem_tables(sql, plan), {'store_orderline'})
+        self.assertEqual(
+            index_advisor.candidate_columns(sql, 'store_orderline'),
+            ['order_id', 'quantity'])
+
+        # Sorted by a column of a joined table
+        sql, params = models.OrderLine.objects.select_related('sku').filter(
+            order_id=1).order_by('sku__number').query.sql_with_params()
+        plan = index_advisor.query_plan(sql, params)
+        self.assertEqual(
+            index_advisor.problem_tables(sql, plan), {'store_sku'})
+        self.assertEqual(
+            index_advisor.candidate_columns(sql, 'store_sku'), ['number'])
+
+    def test_index_advisor_tries_indexes_without_keeping_them(self):
+        sql, params = models.OrderLine.objects.filter(
+            order_id=1).order_by('quantity').query.sql_with_params()
+        plan = index_advisor.query_plan(sql, params)
+        [(model, index)] = index_advisor.proposals_for(sql, plan)
+        self.assertEqual(index.fields, ['order', 'quantity'])
+
+        after = index_advisor.try_indexes([(model, index)], sql, params)
+        self.assertEqual(index_advisor.plan_problems(after['plan']), [])
+        self.assertEqual(index_advisor.query_plan(sql, params), plan)
+        self.assertNotIn(
+            ['order_id', 'quantity'],
+            index_advisor.existing_indexes('store_orderline'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT name FROM sqlite_master WHERE type = %s',
+                ['index'])
+            self.assertNotIn(
+                index.name, [name for name, in cursor.fetchall()])
+
+
+class AdminTests(StoreAPITestCase):
+    """Administers the store"""
+
+    def test_admin_changelists_run_constant_queries(self):
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        changelists = (
+            reverse('admin:store_order_changelist'),
+            reverse('admin:store_order_changelist') + '?product=1',
+            reverse('admin:store_sku_changelist'),
+            reverse('admin:store_sku_changelist') + '?attribute=3',
+        )
+
+        query_counts = []
+        for order_lines in ([(1, 1)], [(1, 1), (2, 1)] * 5):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+            models.SKU.objects.create(
+                number='PR-%d' % len(query_counts), product_id=2,
+                price=0.00059, currency='BTC', quantity=1
+            ).attributes.add(3)
+
+            counts = []
+            for url in changelists:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts.append(len(queries))
+            query_counts.append(counts)
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_admin_changelist_estimates_big_counts(self):
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        url = reverse('admin:store_sku_changelist')
+
+        with override_settings(STORE_ADMIN_ESTIMATED_COUNT_THRESHOLD=1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any(
+                'COUNT(' in query['sql'] for query in queries))
+            self.assertEqual(response.context['cl'].result_count, 2)
+
+            models.SKU.objects.filter(number='PR-RD-SM').delete()
+            response = self.client.get(url)
+            # Only ids at both ends of the table are looked at
+            self.assertEqual(response.context['cl'].result_count, 1)
+
+            response = self.client.get(url, {'q': 'red'})
+            self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_admin_stock_edits_keep_concurrent_reservations(self):
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        # Content types cached by the admin outlive the flushes of the
+        # transaction test cases
+        self.addCleanup(ContentType.objects.clear_cache)
+        url = reverse('admin:store_sku_change', args=[1])
+        form = self.client.get(url).context['adminform'].form
+        data = {
+            name: form[name].value() for name in form.fields
+            if form[name].value() is not None}
+        data['initial-quantity'] = data['quantity']
+
+        # A checkout while the form is open
+        self.client.post(
+            self.base_url, order_post_data([(1, 5)]), format='json')
+        data.update(quantity=110, price='0.00042')
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        sku = models.SKU.objects.get(pk=1)
+        self.assertEqual((sku.quantity, str(sku.price)), (105, '0.00042000'))
+        self.assertEqual(
+            models.InventoryMovement.objects.filter(
+                sku_id=1, kind=models.InventoryMovement.ADJUSTMENT
+            ).values_list('quantity', flat=True).get(), 10)
+
+        # Removing more than is left is refused, the rest is saved
+        self.client.post(
+            self.base_url, order_post_data([(1, 5)]), format='json')
+        data.update({'initial-quantity': 105, 'quantity': 0,
+                     'price': '0.00043'})
+        self.client.post(url, data)
+        sku = models.SKU.objects.get(pk=1)
+        self.assertEqual((sku.quantity, str(sku.price)), (100, '0.00043000'))
+
+
+class OrderIntakeTests(StoreAPITestCase):
+    """Takes orders in asynchronously"""
+
+    @override_settings(STORE_ASYNC_ORDER_INTAKE=True)
+    def test_POSTing_an_order_queues_it_in_async_mode(self):
+        response = self.client.post(
+            self.base_url, order_post_data([(1, 2)]), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], models.OrderIntake.QUEUED)
+        self.assertEqual(response['Location'], response.data['status_url'])
+        self.assertEqual(models.Order.objects.count(), 0)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 100)
+
+        self.assertEqual(intake.drain(), 1)
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], models.OrderIntake.DONE)
+        order = models.Order.objects.get(pk=response.data['order'])
+        self.assertEqual(order.status, models.Order.PROCESSING)
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 98)
+
+    @override_settings(STORE_ASYNC_ORDER_INTAKE=True)
+    def test_queued_orders_fail_independently(self):
+        handles = []
+        for order_lines in ([(1, 60)], [(1, 60)], [(2, 1)]):
+            response = self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+            handles.append(response.data['handle'])
+        response = self.client.post(
+            self.base_url, order_post_data([(1, 'x')]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        intake.drain(batch_size=2)
+        intakes = [
+            models.OrderIntake.objects.get(handle=handle)
+            for handle in handles]
+        self.assertEqual(
+            [order_intake.status for order_intake in intakes],
+            [models.OrderIntake.DONE, models.OrderIntake.FAILED,
+             models.OrderIntake.DONE])
+        self.assertIsNone(intakes[1].order_id)
+        self.assertIn('order_line_set', json.loads(intakes[1].errors))
+        self.assertEqual(models.Order.objects.count(), 2)
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 40)
+
+    def test_queued_orders_failing_unexpectedly_fail_alone(self):
+        handles = [
+            intake.enqueue(order_post_data([(1, 1)])).handle
+            for _ in range(3)]
+        save = OrderSerializer.save
+        calls = []
+
+        def fail_second_order(serializer, **kwargs):
+            calls.append(serializer)
+            if len(calls) == 2:
+                raise KeyError('contact')
+            return save(serializer, **kwargs)
+
+        with mock.patch.object(OrderSerializer, 'save', fail_second_order), \
+                self.assertLogs('store.intake', 'ERROR'):
+            intake.drain(batch_size=10)
+
+        intakes = [
+            models.OrderIntake.objects.get(handle=handle)
+            for handle in handles]
+        self.assertEqual(
+            [order_intake.status for order_intake in intakes],
+            [models.OrderIntake.DONE, models.OrderIntake.FAILED,
+             models.OrderIntake.DONE])
+        self.assertEqual(json.loads(intakes[1].errors), intake.UNPROCESSABLE)
+        self.assertEqual(models.Order.objects.count(), 2)
+
+    def test_expired_order_intake_claims_are_claimed_again(self):
+        order_intake = intake.enqueue(order_post_data([(1, 1)]))
+        self.assertEqual(len(intake.claim('worker-1', 10)), 1)
+        self.assertEqual(intake.claim('worker-2', 10), [])
+
+        models.OrderIntake.objects.update(
+            claimed_timestamp=timezone.now() - timedelta(hours=1))
+        claimed = intake.claim('worker-2', 10)
+        self.assertEqual([order_intake.pk], [each.pk for each in claimed])
+        self.assertEqual(claimed[0].attempts, 2)
+
+        # Until they run out of attempts
+        models.OrderIntake.objects.update(
+            claimed_timestamp=timezone.now() - timedelta(hours=1))
+        with override_settings(STORE_ORDER_INTAKE_MAX_ATTEMPTS=2):
+            self.assertEqual(intake.claim('worker-3', 10), [])
+        order_intake.refresh_from_db()
+        self.assertEqual(order_intake.status, models.OrderIntake.FAILED)
+        self.assertEqual(
+            json.loads(order_intake.errors), intake.UNPROCESSABLE)
+
+
+class ExportTests(StoreAPITestCase):
+    """Streams the store data out"""
+
+    @override_settings(STORE_EXPORT_CHUNK_SIZE=1)
+    def test_exporting_orders_streams_every_order(self):
+        for order_lines in ([(1, 1)], [(1, 1), (2, 2)], [(2, 3)]):
+            self.client.post(
+                self.base_url, order_post_data(order_lines), format='json')
+        models.Order.objects.filter(pk=3).update(status=models.Order.COMPLETED)
+        url = reverse('order-export')
+        self.assertEqual(
+            self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [
+            json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], [1, 2, 3])
+        self.assertEqual(
+            [order_line['sku_number']
+             for order_line in records[1]['order_line_set']],
+            ['PR-RD-SM', 'PR-RD-LG'])
+        self.assertEqual(records[0]['ship_to']['country'], 'UK')
+
+        response = self.client.get(
+            url, {'output': 'csv', 'after': 1, 'status': '3,6'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0].split(',')[:2], ['id', 'status'])
+        # One row per order line
+        self.assertEqual([row.split(',')[0] for row in rows[1:]], ['2', '2'])
+
+        response = self.client.get(url, {'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_resuming_a_csv_export_with_line_breaks_in_cells(self):
+        for order_lines in ([(1, 1)], [(1, 1), (2, 2)], [(2, 3)]):
+            post_data = order_post_data(order_lines)
+            post_data['ship_to']['street'] = 'street2\n4,"Building B"'
+            self.client.post(self.base_url, post_data, format='json')
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        def export(*args):
+            call_command(
+                'export_store_data', 'orders', '--format', 'csv',
+                '--output', path, *args, stderr=StringIO())
+            with open(path, newline='') as exported:
+                return list(csv.reader(exported))
+
+        complete = export()
+        self.assertEqual(
+            [row[0] for row in complete[1:]], ['1', '2', '2', '3'])
+        # Interrupted in the middle of the street of order 3
+        with open(path, 'rb') as exported:
+            content = exported.read()
+        with open(path, 'wb') as exported:
+            exported.write(content[:content.rindex(b'street2\n') + 8])
+
+        self.assertEqual(export('--resume'), complete)
+
+    def test_exporting_skus_streams_the_catalog(self):
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('sku-export'), {'output': 'csv'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(rows[1].startswith('1,PR-RD-SM,'))
+        self.assertTrue(rows[1].endswith('Finish: Red; Size: Small'))
+
+
+class CatalogImportTests(StoreAPITestCase):
+    """Imports catalogs in batches"""
+
+    def import_catalog(self, rows, *args, path=None):
+        """Imports ``rows`` from a CSV file, returns its path and errors"""
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix='.csv')
+            os.close(handle)
+            self.addCleanup(os.remove, path)
+        with open(path, 'w', newline='') as catalog_file:
+            writer = csv.writer(catalog_file)
+            writer.writerow((
+                'number', 'price', 'currency', 'quantity', 'product_name',
+                'product_manufacturer', 'category', 'attributes'))
+            writer.writerows(rows)
+        errors = StringIO()
+        call_command(
+            'import_catalog', path, *args, stdout=StringIO(), stderr=errors)
+        return path, errors.getvalue()
+
+    def test_importing_a_catalog_upserts_by_natural_keys(self):
+        rows = [
+            ('PR-RD-SM', '0.001', 'BTC', '7', 'Product', 'WidgetFactory',
+             'category_child', 'Size: Large; Finish: Blue'),
+            ('NEW-1', '0.002', 'BTC', '3', 'Spanner', 'Tool Works',
+             'category_parent / Tools', 'Size: Small'),
+            ('NEW-2', '0.002', 'BTC', '3', 'Spanner', 'Tool Works', '', ''),
+            ('NEW-3', '2', 'BTC', '3', 'Hammer', 'Tool Works', '', ''),
+        ]
+        path, errors = self.import_catalog(rows)
+
+        self.assertIn('price', errors)
+        sku = models.SKU.objects.get(number='PR-RD-SM')
+        self.assertEqual((sku.price, sku.quantity), (Decimal('0.001'), 7))
+        self.assertEqual(
+            sorted(sku.attributes.values_list('name', flat=True)),
+            ['Blue', 'Large'])
+        spanners = models.SKU.objects.filter(product__name='Spanner')
+        self.assertEqual(spanners.count(), 2)
+        self.assertEqual(spanners.values('product_id').distinct().count(), 1)
+        self.assertFalse(models.SKU.objects.filter(number='NEW-3').exists())
+        tools = models.ProductCategory.objects.get(name='Tools')
+        self.assertEqual(
+            [category.name for category in tools.get_ancestors()],
+            ['category_parent'])
+        self.assertEqual(
+            models.ProductCategory.objects.filter(lft=0).count(), 0)
+
+        # Rows before the checkpoint are left alone
+        with open(path + '.checkpoint', 'w') as checkpoint_file:
+            json.dump({'rows': 1}, checkpoint_file)
+        rows[0] = rows[0][:3] + ('8',) + rows[0][4:]
+        rows[1] = rows[1][:3] + ('9',) + rows[1][4:]
+        self.import_catalog(rows, '--resume', path=path)
+        self.assertEqual(
+            models.SKU.objects.get(number='PR-RD-SM').quantity, 7)
+        self.assertEqual(models.SKU.objects.get(number='NEW-1').quantity, 9)
+
+    def test_importing_a_catalog_leaves_out_rows_short_of_stock(self):
+        rows = [
+            ('PR-RD-SM', '0.001', 'BTC', '7', 'Product', 'WidgetFactory',
+             'category_child', 'Size: Large'),
+            ('PR-RD-LG', '0.001', 'BTC', '7', 'Product', 'WidgetFactory',
+             'category_child', 'Size: Small'),
+        ]
+        # Checkouts took the stock between the read and the adjustment
+        adjust = inventory.adjust
+
+        def sold_out(sku_id, quantity, **kwargs):
+            if sku_id == 1:
+                raise inventory.InsufficientStock({1: (-quantity, 0)})
+            return adjust(sku_id, quantity, **kwargs)
+
+        with mock.patch.object(catalog_import.inventory, 'adjust', sold_out):
+            path, errors = self.import_catalog(rows)
+
+        self.assertIn('PR-RD-SM', errors)
+        self.assertIn('quantity', errors)
+        skus = models.SKU.objects.order_by('pk')
+        self.assertEqual(
+            [(sku.price, sku.quantity) for sku in skus],
+            [(Decimal('0.00059'), 100), (Decimal('0.001'), 7)])
+        self.assertEqual(
+            [sorted(sku.attributes.values_list('name', flat=True))
+             for sku in skus],
+            [['Red', 'Small'], ['Small']])
+
+    def test_importing_a_catalog_rebuilds_only_the_trees_it_grew(self):
+        rows = [
+            ('NEW-1', '0.002', 'BTC', '3', 'Spanner', 'Tool Works',
+             'category_parent / Tools / Spanners', ''),
+        ]
+        with mock.patch.object(
+                models.ProductCategory._tree_manager.__class__, 'rebuild'
+        ) as rebuild:
+            self.import_catalog(rows)
+        rebuild.assert_not_called()
+        spanners = models.ProductCategory.objects.get(name='Spanners')
+        self.assertEqual(
+            [category.name for category in spanners.get_ancestors()],
+            ['category_parent', 'Tools'])
+        child = models.ProductCategory.objects.get(name='category_child')
+        self.assertEqual(child.get_descendant_count(), 0)
+
+        # A new top level category renumbers the trees
+        rows[0] = rows[0][:6] + ('Aa Tools / Spanners',) + rows[0][7:]
+        self.import_catalog(rows)
+        self.assertEqual(
+            list(models.ProductCategory.objects.filter(
+                parent=None).order_by('tree_id').values_list(
+                    'name', flat=True)),
+            ['Aa Tools', 'category_child', 'category_parent'])
+        self.assertEqual(
+            models.ProductCategory.objects.filter(lft=0).count(), 0)
+
+    def test_importing_a_catalog_builds_the_tree_of_every_batch(self):
+        rows = [
+            ('NEW-1', '0.002', 'BTC', '3', 'Spanner', 'Tool Works',
+             'Tools / Spanners', ''),
+            ('NEW-2', '0.002', 'BTC', '3', 'Drill', 'Tool Works',
+             'Tools / Drills', ''),
+        ]
+        link_attributes = catalog_import.CatalogImporter.link_attributes
+        calls = []
+
+        def fail_second_batch(importer, *args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError('disk I/O error')
+            return link_attributes(importer, *args)
+
+        with mock.patch.object(
+                catalog_import.CatalogImporter, 'link_attributes',
+                fail_second_batch), self.assertRaises(OperationalError), \
+                capture_on_commit_callbacks(execute=True):
+            self.import_catalog(rows, '--batch-size', '1')
+
+        # The committed batch is in the tree and the caches
+        self.assertEqual(
+            models.ProductCategory.objects.filter(lft=0).count(), 0)
+        spanners = models.ProductCategory.objects.get(name='Spanners')
+        self.assertEqual(
+            [category.name for category in spanners.get_ancestors()],
+            ['Tools'])
+        self.assertFalse(
+            models.ProductCategory.objects.filter(name='Drills').exists())
+        response = self.client.get(
+            reverse('category-detail', args=[spanners.pk]))
+        self.assertEqual(response.data['total_product_count'], 1)
+
+
+class CategoryTreeTests(StoreAPITestCase):
+    """Reads the category tree"""
+
+    def test_category_tree_counts_products_per_subtree(self):
+        parent = models.ProductCategory.objects.get(name='category_parent')
+        leaf = models.ProductCategory.objects.create(
+            parent=parent, name='category_leaf', description='Leaf')
+        models.Product.objects.filter(name='Product 2').update(category=leaf)
+        # Bulk updates don't send signals
+        with capture_on_commit_callbacks(execute=True):
+            category_tree.invalidate()
+
+        response = self.client.get(reverse('category-list'))
+        self.assertEqual(
+            [(node['name'], node['product_count'],
+              node['total_product_count']) for node in response.data],
+            [('category_child', 1, 1), ('category_parent', 1, 2)])
+        self.assertEqual(
+            [node['name'] for node in response.data[1]['children']],
+            ['category_leaf'])
+
+        response = self.client.get(
+            reverse('category-detail', args=[leaf.pk]))
+        self.assertEqual(response.data['total_product_count'], 1)
+        response = self.client.get(reverse('category-detail', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(
+            reverse('product-list'), {'category': parent.pk})
+        self.assertEqual(
+            sorted(product['name'] for product in response.data['results']),
+            ['Product 2', 'Product 3'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('sku-list'), {'category': parent.pk})
+        self.assertEqual(response.data['results'], [])
+        self.assertIn('"lft" BETWEEN', queries[0]['sql'])
+        response = self.client.get(reverse('product-list'), {'category': 999})
+        self.assertEqual(response.data['results'], [])
+
+        # Saved categories rebuild the tree
+        with capture_on_commit_callbacks(execute=True):
+            models.ProductCategory.objects.create(
+                parent=leaf, name='category_twig', description='Twig')
+        response = self.client.get(
+            reverse('category-detail', args=[leaf.pk]))
+        self.assertEqual(
+            [node['name'] for node in response.data['children']],
+            ['category_twig'])
+
+
+class DedupTests(StoreAPITestCase):
+    """Stores equal addresses and contacts once"""
+
+    def test_orders_reuse_stored_addresses_and_contacts(self):
+        post_data = order_post_data([(1, 1)])
+        post_data['bill_to'] = dict(post_data['ship_to'])
+        response = self.client.post(self.base_url, post_data, format='json')
+        order = models.Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.ship_to_id, order.bill_to_id)
+
+        # Case and whitespace don't make a different address
+        post_data['bill_to']['street'] = '  STREET2 '
+        post_data['contact']['email'] = 'Email@Example.com'
+        response = self.client.post(self.base_url, post_data, format='json')
+        repeat = models.Order.objects.get(pk=response.data['id'])
+        self.assertEqual(
+            (repeat.ship_to_id, repeat.bill_to_id, repeat.contact_id),
+            (order.ship_to_id, order.ship_to_id, order.contact_id))
+
+    def test_dedupe_contacts_merges_stored_duplicates(self):
+        orders = [
+            self.client.post(
+                self.base_url, order_post_data([(1, 1)]), format='json'
+            ).data['id']
+            for _ in range(3)]
+        # Rows stored before deduplication have no hash
+        models.Address.objects.bulk_create(
+            models.Address(country='UK', street=street, city='City')
+            for street in ('1 Street', '1  street', '2 Street'))
+        models.Contact.objects.bulk_create(
+            models.Contact(full_name='Name', email='name@example.com')
+            for order in orders)
+        addresses = list(models.Address.objects.filter(
+            content_hash__isnull=True).order_by('pk'))
+        contacts = list(models.Contact.objects.filter(
+            content_hash__isnull=True).order_by('pk'))
+        for order, contact in zip(orders, contacts):
+            models.Order.objects.filter(pk=order).update(
+                ship_to=addresses[1], bill_to=addresses[2], contact=contact)
+
+        call_command('dedupe_contacts', batch_size=2, stdout=StringIO())
+
+        self.assertFalse(models.Address.objects.filter(
+            content_hash__isnull=True).exists())
+        self.assertFalse(
+            models.Address.objects.filter(pk=addresses[1].pk).exists())
+        self.assertEqual(models.Contact.objects.filter(
+            email='name@example.com').count(), 1)
+        for order in models.Order.objects.filter(pk__in=orders):
+            self.assertEqual(
+                (order.ship_to_id, order.bill_to_id, order.contact_id),
+                (addresses[0].pk, addresses[2].pk, contacts[0].pk))
+
+    def test_dedupe_contacts_keeps_the_oldest_row(self):
+        # Stored before deduplication, without a hash
+        models.Contact.objects.bulk_create([models.Contact(
+            full_name='Full Name', email='email@example.com')])
+        older = models.Contact.objects.get()
+        order = self.client.post(
+            self.base_url, order_post_data([(1, 1)]), format='json'
+        ).data['id']
+        newer = models.Order.objects.get(pk=order).contact_id
+        self.assertGreater(newer, older.pk)
+
+        call_command('dedupe_contacts', stdout=StringIO())
+
+        self.assertFalse(models.Contact.objects.filter(pk=newer).exists())
+        self.assertEqual(
+            models.Order.objects.get(pk=order).contact_id, older.pk)
+        self.assertIsNotNone(
+            models.Contact.objects.get(pk=older.pk).content_hash)
+
+    def test_stored_addresses_and_contacts_are_read_only(self):
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.addCleanup(ContentType.objects.clear_cache)
+        self.client.post(
+            self.base_url, order_post_data([(1, 1)]), format='json')
+        contact = models.Contact.objects.get()
+
+        response = self.client.get(reverse('admin:store_contact_add'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        url = reverse('admin:store_contact_change', args=[contact.pk])
+        response = self.client.post(url, {
+            'full_name': 'Other Name', 'email': 'other@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        contact.refresh_from_db()
+        self.assertEqual(contact.full_name, 'Full Name')
+
+        # Forms see the content hash of the row
+        form = modelform_factory(models.Contact, fields='__all__')(
+            {'full_name': 'full  name', 'email': 'EMAIL@example.com'})
+        self.assertIn('already exists', str(form.errors))
+
+
+class SalesTests(StoreAPITestCase):
+    """Rolls up sales for reports"""
+
+    def test_sales_rollups_follow_orders(self):
+        def rollups():
+            return sorted(models.SalesRollup.objects.filter(
+                line_count__gt=0
+            ).values_list('sku_id', 'units', 'revenue', 'line_count'))
+
+        first = self.client.post(
+            self.base_url, order_post_data([(1, 2), (2, 1)]), format='json'
+        ).data['id']
+        second = self.client.post(
+            self.base_url, order_post_data([(1, 3)]), format='json'
+        ).data['id']
+        self.assertEqual(rollups(), [
+            (1, 5, Decimal('0.025'), 2), (2, 1, Decimal('0.005'), 1)])
+
+        # Cancelling reverses the order, edited lines replace their sales
+        order = models.Order.objects.get(pk=first)
+        order.status = models.Order.CANCELLED
+        order.save()
+        line = models.OrderLine.objects.get(order_id=second)
+        line.quantity = 1
+        line.save()
+        self.assertEqual(rollups(), [(1, 1, Decimal('0.005'), 1)])
+        order.status = models.Order.COMPLETED
+        order.save()
+        incremental = rollups()
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(rollups(), incremental)
+
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(
+            reverse('sales-list'), {'by': 'product', 'category': 2})
+        self.assertEqual(
+            [(row['name'], row['units'], row['line_count'])
+             for row in response.data['results']],
+            [('Product', 4, 3)])
+        response = self.client.get(reverse('sales-list'), {'by': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('admin:sales'))
+        self.assertContains(response, '<td>Product</td>')
+
+
+class InventoryTests(StoreAPITestCase):
+    """Keeps the inventory ledger"""
+
+    def test_sharded_inventory_ledger(self):
+        models.SKU.objects.filter(pk=1).update(inventory_shards=4)
+        call_command('compact_inventory', stdout=StringIO())
+        self.assertEqual(
+            sorted(models.InventoryShard.objects.filter(
+                sku_id=1).values_list('index', 'quantity')),
+            [(0, 25), (1, 25), (2, 25), (3, 25)])
+        self.assertEqual(models.SKU.objects.get(pk=1).quantity, 0)
+
+        # 30 is more than any shard holds, the shards are folded first
+        serializer = OrderSerializer(data=order_post_data([(1, 30)]))
+        serializer.is_valid(raise_exception=True)
+        first = serializer.save().pk
+        inventory.compact()
+        self.client.post(
+            self.base_url, order_post_data([(1, 2)]), format='json')
+        self.assertEqual(inventory.available([1, 2]), {1: 68, 2: 100})
+        response = self.client.post(
+            self.base_url, order_post_data([(1, 69)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('available 68', response.data['order_line_set'][0])
+
+        order = models.Order.objects.get(pk=first)
+        for order_status in (models.Order.REFUNDED, models.Order.COMPLETED,
+                             models.Order.REFUNDED):
+            order.status = order_status
+            order.save()
+        self.assertEqual(inventory.available([1]), {1: 98})
+        self.assertEqual(
+            list(models.InventoryMovement.objects.filter(
+                order_id=first).order_by('pk').values_list(
+                    'kind', 'quantity')),
+            [(models.InventoryMovement.SALE, -30),
+             (models.InventoryMovement.REFUND, 30)])
+
+        inventory.compact()
+        self.assertEqual(inventory.available([1]), {1: 98})
+        self.assertEqual(
+            sorted(models.InventoryShard.objects.filter(
+                sku_id=1).values_list('quantity', flat=True)),
+            [24, 24, 24, 24])
+
+    def test_sharded_stock_is_shown_in_full(self):
+        models.SKU.objects.filter(pk=1).update(inventory_shards=4)
+        inventory.compact()
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        # The search joins every attribute of a SKU
+        response = self.client.get(
+            reverse('admin:store_sku_changelist'), {'q': 'small'})
+        self.assertEqual(
+            {sku.pk: sku.available
+             for sku in response.context['cl'].result_list},
+            {1: 100})
+
+        response = self.client.get(reverse('sku-export'), {'output': 'csv'})
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()))
+        quantity = rows[0].index('quantity')
+        self.assertEqual([row[quantity] for row in rows[1:]], ['100', '100'])
+
+
+class DbProfileTests(StoreAPITestCase):
+    """Tunes and checks database connections"""
+
+    def test_connections_are_tuned_and_checked(self):
+        response = self.client.get(reverse('health'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['databases'], {'default': {'ok': True}})
+
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        report = self.client.get(
+            reverse('health'), format='json').data['databases']['default']
+        # WAL is written to the database file, deployments opt in
+        self.assertEqual(report['journal_mode'], 'delete')
+        self.assertEqual(report['busy_timeout'], 5000)
+        opted_in = mock.MagicMock(vendor='sqlite', alias='default')
+        with override_settings(STORE_DB_PROFILES={
+                'sqlite': {'journal_mode': 'wal'}}):
+            db_profile.apply(opted_in)
+        opted_in.cursor().__enter__().execute.assert_called_once_with(
+            'PRAGMA journal_mode = wal')
+
+        dropped = mock.Mock(connection=object(), vendor='postgresql')
+        dropped.is_usable.return_value = False
+        local = mock.Mock(connection=object(), vendor='sqlite')
+        with mock.patch.object(
+                db_profile.connections, 'all',
+                return_value=[dropped, local]):
+            db_profile.check_connections(sender=None)
+        dropped.close.assert_called_once_with()
+        local.is_usable.assert_not_called()
+
+        with mock.patch.object(
+                db_profile.connections['default'], 'cursor',
+                side_effect=OperationalError('unable to open database')):
+            reports = db_profile.health()
+        self.assertEqual(reports['default']['ok'], False)
+        with mock.patch.object(
+                db_profile, 'health', return_value=reports):
+            response = self.client.get(reverse('health'), format='json')
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn(
+            'unable', response.data['databases']['default']['error'])
+
+
+@override_settings(
+    STORE_READ_REPLICAS=['replica'], STORE_QUERY_LOG_SAMPLE_RATE=0)
+class ReadReplicaTests(TransactionTestCase):
+    """Routes catalog reads to the replica, mirroring default under test"""
+
+    client_class = APIClient
+
+    def setUp(self):
+        category = models.ProductCategory.objects.create(
+            parent=None, name="category", description="Category")
+        product = models.Product.objects.create(
+            name='Product', description='Product',
+            manufacturer='WidgetFactory', category=category
+        )
+        self.sku = models.SKU.objects.create(
+            number="SKU", product=product, price=0.00059, currency='BTC',
+            quantity=10
+        )
+        replicas.hold_cache().delete(replicas.HOLD_KEY)
+
+    def reads(self, url):
+        """Returns the number of queries ``url`` ran on each database"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(primary), len(replica)
+
+    def test_catalog_reads_use_the_replica_until_a_write(self):
+        self.assertEqual(self.reads(reverse('product-list')), (0, 1))
+        self.assertEqual(self.reads(reverse('order-list')), (1, 0))
+
+        # The client reads its own order from the primary
+        response = self.client.post(
+            reverse('order-list'), order_post_data([(self.sku.pk, 1)]),
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(replicas.COOKIE_NAME, response.cookies)
+        self.assertEqual(
+            self.reads(reverse('sku-detail', args=[self.sku.pk])), (2, 0))
+
+        # Other clients too while the replica may miss a catalog change
+        self.client.cookies.clear()
+        models.Product.objects.get().save()
+        self.assertEqual(self.reads(reverse('product-list') + '?id=1'), (1, 0))
+        replicas.hold_cache().delete(replicas.HOLD_KEY)
+        self.assertEqual(self.reads(reverse('product-list') + '?id=2'), (0, 1))
+
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        primary, replica = self.reads(
+            reverse('admin:store_product_changelist'))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+
+class InventoryReservationStressTests(TransactionTestCase):
+    """Fires concurrent orders at a single hot SKU"""
+
+    ORDERS = 200
+    STOCK = 75
+    MAX_LATENCY = 10.0  # seconds, per order including lock retries
+
+    def setUp(self):
+        category = models.ProductCategory.objects.create(
+            parent=None, name="category", description="Category")
+        product = models.Product.objects.create(
+            name='Product', description='Product',
+            manufacturer='WidgetFactory', category=category
+        )
+        self.sku = models.SKU.objects.create(
+            number="HOT", product=product, price=0.00059, currency='BTC',
+            quantity=self.STOCK
+        )
+
+    def place_order(self, results):
+        started = time.monotonic()
+        outcome = None
+        try:
+            while outcome is None:
+                serializer = OrderSerializer(
+                    data=order_post_data([(self.sku.pk, 1)]))
+                try:
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                    outcome = 'sold'
+                except OperationalError:
+                    # SQLite reports lock contention instead of blocking,
+                    # retry on a fresh connection like a client would
+                    connection.close()
+                    time.sleep(0.005)
+                except serializers.ValidationError:
+                    outcome = 'rejected'
+        finally:
+            connection.close()
+        results.append((outcome, time.monotonic() - started))
+
+    def test_parallel_orders_never_oversell(self):
+        self.assert_parallel_orders_never_oversell()
+
+    def test_parallel_orders_never_oversell_a_sharded_sku(self):
+        models.SKU.objects.filter(pk=self.sku.pk).update(inventory_shards=4)
+        inventory.compact()
+        self.assert_parallel_orders_never_oversell()
+        self.assertFalse(models.InventoryShard.objects.exclude(
+            quantity=0).exists())
+
+    def assert_parallel_orders_never_oversell(self):
+        results = []
+        threads = [
+            threading.Thread(target=self.place_order, args=(results,))
+            for _ in range(self.ORDERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sold = [latency for outcome, latency in results if outcome == 'sold']
+        rejected = [outcome for outcome, _ in results if outcome == 'rejected']
+
+        self.assertEqual(len(results), self.ORDERS)
+        self.assertEqual(len(sold), self.STOCK)
+        self.assertEqual(len(rejected), self.ORDERS - self.STOCK)
+        self.assertEqual(models.SKU.objects.get(pk=self.sku.pk).quantity, 0)
+        self.assertEqual(models.Order.objects.count(), self.STOCK)
+        self.assertEqual(models.OrderLine.objects.count(), self.STOCK)
+        self.assertLess(
+            max(latency for _, latency in results), self.MAX_LATENCY)
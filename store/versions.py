@@ -0,0 +1,58 @@
+"""
+Version tokens of the in-process caches.
+
+The attribute index, the category tree, the response cache and the
+fragment cache each keep what they hold in the memory of every process,
+keyed on the version token of a name. The tokens live in the ``shared``
+cache alias (see ``CACHES``), which every process of the deployment reads:
+a change made by a worker, an intake worker or a management command
+replaces the token and every process drops or rebuilds on its next read.
+
+``bump()`` replaces the tokens once the transaction commits, so a read
+running meanwhile can only store the state before the change under the
+token about to be replaced. Tokens are random: a token lost to eviction or
+a cache restart is replaced by a new one and never brings back what was
+stored under an older one.
+"""
+import uuid
+from django.core.cache import caches
+from django.db import transaction
+from . import replicas
+
+CACHE_ALIAS = 'shared'
+
+
+def shared_cache():
+    return caches[CACHE_ALIAS]
+
+
+def key(name):
+    return 'store:version:%s' % name
+
+
+def token():
+    return uuid.uuid4().hex
+
+
+def get(name):
+    """Returns the current token of ``name``"""
+    cache = shared_cache()
+    version = cache.get(key(name))
+    if version is None:
+        # Concurrent first reads agree on the token added first
+        cache.add(key(name), token(), None)
+        version = cache.get(key(name))
+    return version
+
+
+def replace(names):
+    """Replaces the tokens of ``names`` right away"""
+    shared_cache().set_many({key(name): token() for name in names}, None)
+    # Replicas may not have the change yet, don't rebuild from them
+    replicas.hold_reads()
+
+
+def bump(*names):
+    """Replaces the tokens of ``names`` once the transaction commits"""
+    # Right away outside a transaction, dropped if it's rolled back
+    transaction.on_commit(lambda: replace(names))
@@ -1,14 +1,58 @@
-from django.shortcuts import render
-from django.db.models import Prefetch
-from rest_framework import viewsets, generics, filters
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.db.models import Count, Prefetch
+from rest_framework import (
+    viewsets, generics, filters, mixins, permissions, serializers, status)
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .serializers import *
 from .models import *
+from .archive import OrderHistory
+from .attribute_index import attribute_index
+from .cache import CachedResponseMixin, response_cache
+from .category_tree import category_tree
+from .fast_serializers import (
+    FastReadMixin, FastAttributeSerializer, FastProductSerializer,
+    FastSKUSerializer)
+from .fieldsets import SparseDataMixin, SparseFieldsMixin
+from .fragments import fragment_cache
+from . import db_profile, export, intake, sales, search
 from django_filters.rest_framework import DjangoFilterBackend
 import django_filters
 
 # Create your views here.
 
 
+def export_response(request, dataset):
+    """
+    Streams the ``dataset`` export (see store/export.py) filtered by the
+    query parameters, as NDJSON or with ``?output=csv`` as CSV. Resumes
+    after the record whose id is passed in ``?after=``.
+    """
+    output = request.query_params.get('output', 'ndjson')
+    if output not in export.FORMATS:
+        raise serializers.ValidationError(
+            {'output': ['Expected one of %s.' % ', '.join(export.FORMATS)]})
+    after = request.query_params.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            raise serializers.ValidationError(
+                {'after': ['Expected the id of the last record received.']})
+
+    exporter = export.EXPORTS[dataset](request.query_params, after)
+    response = StreamingHttpResponse(
+        exporter.stream(output), content_type=export.CONTENT_TYPES[output])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        dataset, output)
+    return response
+
+
 class M2MFilter(django_filters.Filter):
     """ Filter to enable filtering on multiple values"""
     def filter(self, qs, value):
@@ -23,17 +67,122 @@ class M2MFilter(django_filters.Filter):
         return qs
 
 
+class AttributeIndexFilter(M2MFilter):
+    """
+    M2MFilter on SKU attributes served from the in-memory attribute index.
+    Falls back to one join per value when the values aren't ids or the
+    matching SKUs are too many to pass back as an id list.
+    """
+    def filter(self, qs, value):
+        if not value:
+            return qs
+
+        try:
+            attribute_ids = [int(v) for v in value.split(',')]
+        except ValueError:
+            return super().filter(qs, value)
+
+        sku_ids = attribute_index.sku_ids(attribute_ids)
+        if sku_ids is None:
+            return super().filter(qs, value)
+        return qs.filter(pk__in=sku_ids)
+
+
+class CategoryFilter(django_filters.NumberFilter):
+    """
+    Filter on a category and all of its descendants, resolved from the
+    cached category tree into one ``lft``/``rght`` range over the
+    category found through ``name``.
+    """
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+
+        lookups = category_tree.subtree(int(value), self.name + '__')
+        if lookups is None:
+            return qs.none()
+        return qs.filter(**lookups)
+
+
 class SKUFilterSet(django_filters.FilterSet):
     """FilterSet for SKU"""
-    attributes = M2MFilter(name='attributes')
+    attributes = AttributeIndexFilter(name='attributes')
+    category = CategoryFilter(name='product__category')
 
     class Meta:
         model = SKU
-        fields = ('attributes', 'product_id')
+        fields = ('attributes', 'product_id', 'category')
+
+
+class ProductFilterSet(django_filters.FilterSet):
+    """FilterSet for Product"""
+    category = CategoryFilter(name='category')
+
+    class Meta:
+        model = Product
+        fields = ('id', 'category')
+
+
+class SalesFilterSet(django_filters.FilterSet):
+    """FilterSet for SalesRollup, over days and the catalog"""
+    since = django_filters.DateFilter(name='day', lookup_expr='gte')
+    until = django_filters.DateFilter(name='day', lookup_expr='lte')
+    sku = django_filters.NumberFilter(name='sku_id')
+    product_id = django_filters.NumberFilter(name='sku__product_id')
+    category = CategoryFilter(name='sku__product__category')
+
+    class Meta:
+        model = SalesRollup
+        fields = ('since', 'until', 'sku', 'product_id', 'category')
+
+
+def sales_report(params, limit=None):
+    """
+    Returns the sales between the ``since`` and ``until`` days of
+    ``params`` (the last ``sales.REPORT_DAYS`` days by default) summed per
+    ``by`` (``day``, ``sku``, ``product`` or ``category``), see
+    store/sales.py.
+    """
+    by = params.get('by') or 'day'
+    if by not in sales.GROUPINGS:
+        raise serializers.ValidationError(
+            {'by': ['Expected one of %s.' % ', '.join(sales.GROUPINGS)]})
+    since, until = sales.default_range()
+    params = params.copy()
+    params['since'] = params.get('since') or since.isoformat()
+    params['until'] = params.get('until') or until.isoformat()
+    rollups = export.filtered(
+        SalesFilterSet, params, SalesRollup.objects.all())
+    return {
+        'since': params['since'],
+        'until': params['until'],
+        'by': by,
+        'results': sales.report(rollups, by, limit),
+    }
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter served from the SKU search index. Matches are ranked best
+    first; without a usable backend it falls back to ``search_fields``.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        backend = search.get_backend()
+        if not terms or backend is None:
+            return super().filter_queryset(request, queryset, view)
 
+        return backend.filter(queryset, ' '.join(terms)).order_by(
+            'search_rank', 'pk')
 
-class SKUViewSet(viewsets.ModelViewSet):
+
+class SKUViewSet(
+        CachedResponseMixin, FastReadMixin, SparseFieldsMixin,
+        viewsets.ModelViewSet):
     """ViewSet for SKU"""
+    cache_group = 'skus'
+    replica_reads = True
+    query_budget = {'list': 5, 'retrieve': 3}
     queryset = SKU.objects.all().select_related(
         'product'
     ).prefetch_related(
@@ -41,45 +190,341 @@ class SKUViewSet(viewsets.ModelViewSet):
             'attributes',
             queryset=Attribute.objects.select_related(
                 'type'
-            ).order_by('type__name')
+            ).order_by('type__name', 'id')
         )
     ).order_by('number')
     serializer_class = SKUSerializer
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
+    fast_serializer_class = FastSKUSerializer
+    filter_backends = (DjangoFilterBackend, IndexedSearchFilter,)
     filter_class = SKUFilterSet
     search_fields = ('attributes__name',)
 
+    @action(detail=False, authentication_classes=(SessionAuthentication,),
+            permission_classes=(IsAdminUser,))
+    def export(self, request):
+        """Every SKU with its product and attributes, streamed, for staff"""
+        return export_response(request, 'skus')
+
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(
+        CachedResponseMixin, FastReadMixin, SparseFieldsMixin,
+        viewsets.ModelViewSet):
     """ViewSet for Product"""
+    cache_group = 'products'
+    replica_reads = True
+    query_budget = {'list': 2, 'retrieve': 2}
     queryset = Product.objects.all().order_by('name')
     serializer_class = ProductSerializer
-    filter_fields = ('id',)
+    fast_serializer_class = FastProductSerializer
+    filter_class = ProductFilterSet
+
 
+class OrderFilterSet(django_filters.FilterSet):
+    """FilterSet for Order, also applied to ArchivedOrder"""
+    created_after = django_filters.IsoDateTimeFilter(
+        name='created_timestamp', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(
+        name='created_timestamp', lookup_expr='lt')
+
+    class Meta:
+        model = Order
+        fields = ('created_after', 'created_before')
 
-class OrderViewSet(viewsets.ModelViewSet):
-    """ViewSet for Order"""
-    queryset = Order.objects.all().order_by("-created_timestamp")
+
+class OrderViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
+    """
+    ViewSet for Order. Reads asking for a date range (``created_after``
+    and/or ``created_before``) include archived orders, see
+    store/archive.py; archived orders are read only.
+    """
+    query_budget = {'list': 4, 'retrieve': 3, 'create': 15, 'summary': 2}
+    queryset = Order.objects.select_related(
+        'ship_to', 'bill_to', 'contact'
+    ).prefetch_related(
+        'order_line_set'
+    ).order_by("-created_timestamp")
+    archived_queryset = ArchivedOrder.objects.select_related(
+        'ship_to', 'bill_to', 'contact'
+    ).prefetch_related(
+        'order_line_set'
+    ).order_by("-created_timestamp")
     serializer_class = OrderSerializer
+    filter_class = OrderFilterSet
+
+    def get_object(self):
+        """Falls back to the archive when reading an archived order"""
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method not in permissions.SAFE_METHODS:
+                raise
+            return get_object_or_404(
+                self.sparse_queryset(self.archived_queryset),
+                pk=self.kwargs['pk'])
 
+    def create(self, request, *args, **kwargs):
+        """
+        With ``STORE_ASYNC_ORDER_INTAKE`` the validated order is queued
+        instead, the response has the handle to poll, see store/intake.py.
+        """
+        if not getattr(settings, 'STORE_ASYNC_ORDER_INTAKE', False):
+            return super().create(request, *args, **kwargs)
 
-class AttributeViewSet(viewsets.ModelViewSet):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_intake = intake.enqueue(request.data)
+        data = OrderIntakeSerializer(
+            order_intake, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': data['status_url']})
+
+    def history_response(self, queryset, archived_queryset, serializer_class):
+        """
+        Returns the paginated response of ``queryset``, merged with
+        ``archived_queryset`` when the request asks for a date range.
+        """
+        queryset = self.filter_queryset(
+            self.sparse_queryset(queryset, serializer_class))
+        if set(OrderFilterSet.base_filters) & set(self.request.query_params):
+            queryset = OrderHistory(queryset, OrderFilterSet(
+                self.request.query_params,
+                queryset=self.sparse_queryset(
+                    archived_queryset, serializer_class)).qs)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.sparse_serializer(serializer_class(
+                page, many=True, context=self.get_serializer_context()))
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.sparse_serializer(serializer_class(
+            queryset, many=True, context=self.get_serializer_context()))
+        return Response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        return self.history_response(
+            self.get_queryset(), self.archived_queryset,
+            self.get_serializer_class())
+
+    @action(detail=False)
+    def summary(self, request):
+        """
+        Orders with their status, totals and contact name only, read from
+        the summary columns on Order without touching the order lines.
+        """
+        fields = OrderSummarySerializer.Meta.fields
+        return self.history_response(
+            Order.objects.only(*fields).order_by("-created_timestamp"),
+            ArchivedOrder.objects.only(*fields).order_by(
+                "-created_timestamp"),
+            OrderSummarySerializer)
+
+    @action(detail=False, authentication_classes=(SessionAuthentication,),
+            permission_classes=(IsAdminUser,))
+    def export(self, request):
+        """
+        Every order with its addresses, contact and lines, archived orders
+        included, streamed, for staff. Filters: ``created_after``,
+        ``created_before`` and ``status`` (comma separated).
+        """
+        return export_response(request, 'orders')
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many orders in one request. Each order is validated and
+        saved independently, so one bad order doesn't reject the batch.
+        """
+        orders_data = request.data
+        if not isinstance(orders_data, list):
+            raise serializers.ValidationError(
+                {'non_field_errors': ['Expected a list of orders.']})
+
+        limit = getattr(settings, 'STORE_BULK_ORDER_LIMIT', 100)
+        if len(orders_data) > limit:
+            raise serializers.ValidationError(
+                {'non_field_errors': [
+                    'At most %d orders can be created at once.' % limit]})
+
+        results = []
+        for index, order_data in enumerate(orders_data):
+            serializer = self.get_serializer(data=order_data)
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            except serializers.ValidationError as exc:
+                results.append({
+                    'index': index,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': exc.detail
+                })
+            else:
+                results.append({
+                    'index': index,
+                    'status': status.HTTP_201_CREATED,
+                    'order': serializer.data
+                })
+
+        return Response({'results': results})
+
+
+class OrderIntakeViewSet(
+        SparseFieldsMixin, mixins.RetrieveModelMixin,
+        viewsets.GenericViewSet):
+    """
+    Status of an order queued by POST /api/orders/ in asynchronous intake
+    mode, looked up by its handle.
+    """
+    query_budget = {'retrieve': 1}
+    queryset = OrderIntake.objects.all()
+    serializer_class = OrderIntakeSerializer
+    lookup_field = 'handle'
+
+
+class AttributeViewSet(
+        CachedResponseMixin, FastReadMixin, SparseFieldsMixin,
+        viewsets.ModelViewSet):
     """ViewSet for Attribute"""
-    queryset = Attribute.objects.all().order_by("name")
+    cache_group = 'product_attributes'
+    replica_reads = True
+    query_budget = {'list': 4, 'retrieve': 3}
+    queryset = Attribute.objects.select_related(
+        'type'
+    ).prefetch_related(
+        Prefetch('type__attribute_set', Attribute.objects.order_by('id'))
+    ).order_by("name")
     serializer_class = AttributeSerializer
+    fast_serializer_class = FastAttributeSerializer
     filter_fields = ('type__id', 'sku_set__product_id')
 
 
-class AttributeTypeViewSet(viewsets.ModelViewSet):
+class AttributeTypeViewSet(
+        CachedResponseMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """ViewSet for AttributeType"""
+    cache_group = 'product_attribute_types'
+    replica_reads = True
+    query_budget = {'list': 3, 'retrieve': 2}
     queryset = AttributeType.objects.prefetch_related(
         Prefetch(
             'attribute_set',
             Attribute.objects.select_related('type').order_by('type__name')
-        ),
-        Prefetch(
-            'attribute_set__sku_set', SKU.objects.all().order_by('number'))
+        )
     ).order_by("name").distinct()
 
     serializer_class = AttributeTypeSerializer
     filter_fields = ('attribute_set__sku_set__product_id', )
+
+
+class CategoryViewSet(SparseDataMixin, viewsets.ViewSet):
+    """
+    The product category tree, served from the in-memory category tree
+    (see store/category_tree.py). Every category has the number of
+    products filed directly under it and under its whole subtree.
+    """
+    query_budget = {'list': 2, 'retrieve': 2}
+    replica_reads = True
+
+    def list(self, request):
+        return Response(category_tree.roots())
+
+    def retrieve(self, request, pk=None):
+        try:
+            node = category_tree.node(int(pk))
+        except ValueError:
+            node = None
+        if node is None:
+            raise Http404
+        return Response(node)
+
+
+class FacetViewSet(SparseDataMixin, viewsets.ViewSet):
+    """
+    Attribute types with their attributes and the number of matching SKUs,
+    for the SKUs selected by the SKU filters (e.g. ``?product_id=1``).
+    """
+    cache_group = 'facets'
+    replica_reads = True
+    query_budget = {'list': 2}
+
+    def list(self, request):
+        return response_cache.fetch(
+            self.cache_group, request, lambda: Response(self.facets(request)))
+
+    def facets(self, request):
+        skus = SKUFilterSet(request.query_params, queryset=SKU.objects.all())
+
+        # Single aggregate query over the SKU/attribute table
+        rows = Attribute.objects.filter(
+            sku_set__in=skus.qs.values('pk')
+        ).values(
+            'type_id', 'type__name', 'id', 'name'
+        ).annotate(
+            sku_count=Count('sku_set')
+        ).order_by('type__name', 'type_id', 'name')
+
+        facets = []
+        for row in rows:
+            if not facets or facets[-1]['id'] != row['type_id']:
+                facets.append({
+                    'id': row['type_id'],
+                    'name': row['type__name'],
+                    'attributes': []
+                })
+            facets[-1]['attributes'].append({
+                'id': row['id'],
+                'name': row['name'],
+                'sku_count': row['sku_count']
+            })
+        return facets
+
+
+class SalesViewSet(SparseDataMixin, viewsets.ViewSet):
+    """
+    Units, revenue and order lines sold per day, SKU, product or category
+    (``?by=``) over a range of days (``?since=`` and ``?until=``), summed
+    from the sales rollups. Filters on ``sku``, ``product_id`` and
+    ``category``. For staff.
+    """
+    authentication_classes = (SessionAuthentication,)
+    permission_classes = (IsAdminUser,)
+    # Session, user, the report and a cold category tree
+    query_budget = {'list': 5}
+
+    def list(self, request):
+        return Response(sales_report(request.query_params))
+
+
+class CacheStatsView(APIView):
+    """
+    Hit/miss counters of the catalog response cache per group, and of the
+    row fragment cache under ``fragments``, for staff
+    """
+    authentication_classes = (SessionAuthentication,)
+    permission_classes = (IsAdminUser,)
+    query_budget = {'get': 2}
+
+    def get(self, request):
+        return Response(dict(
+            response_cache.stats(), fragments=fragment_cache.stats()))
+
+
+class HealthView(APIView):
+    """
+    Whether the primary and the read replicas answer, for load balancers:
+    200 if all do, 503 otherwise. Staff also see the round trip times and
+    the connection settings in effect.
+    """
+    authentication_classes = (SessionAuthentication,)
+    # No query_budget, the statements grow with the number of replicas
+
+    def get(self, request):
+        reports = db_profile.health()
+        if not request.user.is_staff:
+            reports = {
+                alias: {'ok': report['ok']}
+                for alias, report in reports.items()}
+        healthy = all(report['ok'] for report in reports.values())
+        return Response(
+            {'ok': healthy, 'databases': reports},
+            status=status.HTTP_200_OK if healthy
+            else status.HTTP_503_SERVICE_UNAVAILABLE)